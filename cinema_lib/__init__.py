@@ -3,6 +3,7 @@ Utility library for Cinema databases.
 
 The various submodules are:
     cinema.cl: command line utility for library functions
+    cinema.server: read-only query server for Spec D databases
     cinema.spec: utilities for specifications
     cinema.spec.a: utilities for Spec A
     cinema.spec.d: utilities for Spec D
@@ -45,6 +45,11 @@ class ERROR_CODES:
   NO_INPUT_DATABASE_FOR_CV_COMMAND = 34
   CONVERSION_FROM_SQLITE_TO_D_FAILED = 35
   NO_OUTPUT_DATABASE_FOR_SQLITE_TO_D_CONVERSION = 36
+  IMAGE_SHAPE_FAILED = 37
+  CONVERSION_FROM_A_TO_SQLITE_FAILED = 38
+  NO_INPUT_DATABASE_FOR_A_TO_SQLITE_CONVERSION = 39
+  SERVER_FAILED = 40
+  NO_INPUT_DATABASE_FOR_SERVER = 41
 
 # if the user provides a new label, override the default
 def relabel(default, user, is_file=False):
@@ -202,6 +207,25 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
             help="FLAG: report verbosely")
     parser.add_argument("-q", "--quick", action="store_true", default=False,
             help="FLAG: do not validate row data, if validating (--test)")
+    parser.add_argument("--cache", action="store_true", default=False,
+            help="FLAG: read the Spec D CSV from a binary cache next to it, creating it if it is missing or out of date, if validating (--test) or converting (--d2s)")
+    parser.add_argument("--bulk", action="store_true", default=False,
+            help="FLAG: load the rows in large transactions without synchronous writes, building the database in memory (so it needs to fit in memory) and copying it to disk, if converting (--d2s)")
+    parser.add_argument("--incremental", action="store_true", default=False,
+            help="FLAG: only validate the Spec D rows appended since the last incremental validation, and save a checkpoint next to the CSV, if validating (--test)")
+    parser.add_argument("--sample", metavar="P", type=float,
+            help="only validate a random sample of the fraction P of the Spec D rows (and their files), and report the confidence, if validating (--test)")
+    parser.add_argument("--sample-rows", metavar="N", type=int,
+            help="only validate a random sample of N Spec D rows (and their files), and report the confidence, if validating (--test)")
+    parser.add_argument("--images", choices=[d.IMAGE_HEADER, d.IMAGE_DECODE],
+            help="also check the headers of PNG and JPEG images in the Spec D FILE columns, and that they have the same dimensions in a column, or decode them, if validating (--test)")
+    parser.add_argument("-w", "--workers", metavar="N", type=int, default=1,
+            help="check Spec D rows in a pool of N processes, if validating (--test)")
+    parser.add_argument("--list-workers", metavar="N", type=int, 
+            default=d.LIST_WORKERS,
+            help="check files in a pool of N threads (in each process), if validating (--test), default {0}".format(d.LIST_WORKERS))
+    parser.add_argument("--verify", choices=[d.VERIFY_SIZE, d.VERIFY_CHECKSUM],
+            help="also check that files are not empty (size), or that they can be read through (checksum), if validating (--test)")
     parser.add_argument("-a", "--astaire", metavar="DB", type=str,
             help="INPUT: specify an input Spec A database")
     parser.add_argument("-d", "--dietrich", metavar="DB", type=str,
@@ -215,12 +239,19 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
     parser.add_argument("--a2d", "--astairetodietrich", action="store_true",
         default=False,
         help="COMMAND: convert a Spec D database to a Spec A database, in place")
+    parser.add_argument("--a2s", "--astairetosqlite", action="store_true", 
+        default=False,
+        help="COMMAND: create a SQLite3 database from a Spec A database, to ./<database_name>.sqlite, without creating a Spec D database")
     parser.add_argument("--d2s", "--dietrichtosqlite", action="store_true", 
         default=False,
-        help="COMMAND: create a SQLite3 database from a Spec D database, to ./<database_name>.sqlite")
+        help="COMMAND: create a SQLite3 database from a Spec D database, to ./<database_name>.sqlite, with indexes on the parameter columns")
     parser.add_argument("--s2d", "--sqlitetodietrich", metavar="DB", type=str, 
         default=False,
         help='COMMAND: create a a Spec D database CSV from a SQLite database. If there is only one table, it converts that table, otherwise it converts a table or view named "cinema".')
+    parser.add_argument("--query", metavar="SQL", type=str, default=None,
+        help="with --s2d, convert the rows of a SQL query instead of a table")
+    parser.add_argument("--serve", metavar="PORT", type=int, default=None,
+        help="COMMAND: serve read-only JSON queries of a Spec D database over HTTP on localhost:PORT (0 for any free port), until interrupted. see cinema_lib.server for the requests")
 
     # add image tools
     if image_ok:
@@ -250,6 +281,8 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
                 help="command: add the 95th percentile data calculated from images in column number N")
         parser.add_argument("--image-99th", metavar="N", type=int,
                 help="command: add the 99th percentile data calculated from images in column number N")
+        parser.add_argument("--image-shape", metavar="N", type=int,
+                help="command: add image width, height and channels columns read from the PNG, JPEG or TIFF headers of images in column number N, without decoding them")
 
     # add cv2 tools
     if cv_ok:
@@ -294,12 +327,25 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
     checked_db = False
     if args.test:
         if args.astaire is not None:
-            if not a.check_database(args.astaire, quick=args.quick):
+            if args.workers != 1:
+                log.warning("Spec A databases have no rows to check in "
+                            "processes, ignoring --workers. Use "
+                            "--list-workers for the file checks.")
+            if not a.check_database(args.astaire, quick=args.quick,
+                                    verify=args.verify,
+                                    list_workers=args.list_workers):
                 exit(ERROR_CODES.SPEC_A_VALIDATION_FAILED)
             else:
                 checked_db = True
         if args.dietrich is not None:
-            if not d.check_database(args.dietrich, quick=args.quick):
+            if not d.check_database(args.dietrich, quick=args.quick,
+                                    cache=args.cache, workers=args.workers,
+                                    verify=args.verify, 
+                                    incremental=args.incremental,
+                                    sample=args.sample,
+                                    sample_rows=args.sample_rows,
+                                    images=args.images,
+                                    list_workers=args.list_workers):
                 exit(ERROR_CODES.SPEC_D_VALIDATION_FAILED)
             else:
                 checked_db = True
@@ -348,13 +394,29 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
 #           log.error("Input database not specified for A to D conversion.")
 #           exit(ERROR_CODES.NO_INPUT_DATABASE_FOR_A_TO_D_CONVERSION)
     
+    # convert A to S
+    if args.a2s and not command:
+        if args.astaire is not None:
+            basename = os.path.split(os.path.normpath(args.astaire))[1]
+            log.info('Using "{0}" for the table name.'.format(basename))
+            if spec.convert_a_to_sqlite3(args.astaire, 
+                    where=os.path.splitext(basename)[0] + ".sqlite") == None:
+                exit(ERROR_CODES.CONVERSION_FROM_A_TO_SQLITE_FAILED)
+            else:
+                command = True
+        else:
+            log.error(
+              "Input database not specified for A to SQLite conversion.")
+            exit(ERROR_CODES.NO_INPUT_DATABASE_FOR_A_TO_SQLITE_CONVERSION)
+
     # convert D to S
     if args.d2s and not command:
         if args.dietrich is not None:
             basename = os.path.split(os.path.normpath(args.dietrich))[1]
             log.info('Using "{0}" for the table name.'.format(basename))
             if d.get_sqlite3(args.dietrich, 
-                    where=os.path.splitext(basename)[0] + ".sqlite") == None:
+                    where=os.path.splitext(basename)[0] + ".sqlite",
+                    cache=args.cache, bulk=args.bulk, index=True) == None:
                 exit(ERROR_CODES.CONVERSION_FROM_D_TO_SQLITE_FAILED)
             else:
                 command = True
@@ -373,25 +435,32 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
                 conn = sqlite3.Connection(args.s2d)
                 cursor = conn.cursor()
                 tables = [row[0] for row in
-                    cursor.execute("select name from sqlite_master")]
-                if len(tables) < 1:
+                    cursor.execute("select name from sqlite_master where "
+                        "type in ('table', 'view') and "
+                        "name not like 'sqlite\\_%' escape '\\'")]
+                if args.query is not None:
+                    pass
+                elif len(tables) < 1:
                     log.error("No tables found in SQLite database.")
                     exit(ERROR_CODES.CONVERSION_FROM_SQLITE_TO_D_FAILED)
-                if len(tables) == 1:
+                elif len(tables) == 1:
                     table = tables[0]
+                elif "cinema" not in tables:
+                    log.error(
+                    'No table or view named "cinema" in SQLite database.')
+                    exit(ERROR_CODES.CONVERSION_FROM_SQLITE_TO_D_FAILED)
                 else:
-                    if "cinema" not in tables:
-                        log.error(
-                        'No table or view named "cinema" in SQLite database.')
-                        exit(ERROR_CODES.CONVERSION_FROM_SQLITE_TO_D_FAILED)
-                    else:
-                        table = "cinema"
+                    table = "cinema"
             except Exception as e:
                 log.error("Unable to process SQLite database: {0}.".format(e))
                 exit(ERROR_CODES.CONVERSION_FROM_SQLITE_TO_D_FAILED)
 
-            log.info('Converting table "{0}".'.format(table))
-            if d.get_sqlite3_to_csv(conn, table, args.dietrich) == None:
+            if args.query is not None:
+                log.info('Converting query "{0}".'.format(args.query))
+            else:
+                log.info('Converting table "{0}".'.format(table))
+            if d.get_sqlite3_to_csv(conn, table, args.dietrich, 
+                                    query=args.query) == None:
                 exit(ERROR_CODES.CONVERSION_FROM_SQLITE_TO_D_FAILED)
             else:
                 command = True
@@ -400,6 +469,28 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
               "Output database not specified for D to SQLite conversion.")
             exit(ERROR_CODES.NO_OUTPUT_DATABASE_FOR_SQLITE_TO_D_CONVERSION)
 
+    # serve D
+    if args.serve is not None and not command:
+        if args.dietrich is not None:
+            from . import server
+            query_server = server.make_server(args.dietrich, args.serve, 
+                                              cache=args.cache)
+            if query_server == None:
+                exit(ERROR_CODES.SERVER_FAILED)
+            print("Serving on http://{0}:{1}/".format(
+                *query_server.server_address))
+            try:
+                query_server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                query_server.server_close()
+                query_server.pool.close()
+            command = True
+        else:
+            log.error("Input database not specified for the server.")
+            exit(ERROR_CODES.NO_INPUT_DATABASE_FOR_SERVER)
+
     # image commands
     if image_ok and not command:
         from .image import d as d_image # TODO FIXME
@@ -419,7 +510,8 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
             args.image_90th is not None or \
             args.image_95th is not None or \
             args.image_99th is not None or \
-            args.image_joint is not None 
+            args.image_joint is not None or \
+            args.image_shape is not None
 
         if command:
             if args.dietrich is None:
@@ -570,6 +662,13 @@ $ cinema -d cinema_lib/test/data/sphere.cdb --cv-fast-draw 2 --label FAST
                                        image.file_joint_entropy,
                                        n_components=0):
                 exit(ERROR_CODES.IMAGE_JOINT_FAILED)
+        # image-shape
+        elif args.image_shape is not None:
+            check_n(header, args.image_shape)
+            if d_image.file_add_shape_columns(args.dietrich,
+                                              args.image_shape,
+                                              relabel("image", args.label)):
+                exit(ERROR_CODES.IMAGE_SHAPE_FAILED)
 
     # computer vision commands
     if cv_ok and not command:
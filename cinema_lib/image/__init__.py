@@ -7,6 +7,9 @@ from skimage import color
 from skimage import feature
 import numpy as np
 import os
+import struct
+
+from ..spec.d import PNG_SIGNATURE, JPEG_SIGNATURE, get_image_header
 
 from .. import check_numpy_version     
                     
@@ -218,3 +221,115 @@ def file_joint_entropy(db_path, image_path, discretization=1024):
         u, u_counts = np.unique(im, return_counts=True, axis=0)
         u_counts = u_counts.astype(np.float64) / total
         return -np.sum(u_counts * np.log2(u_counts)) 
+
+TIFF_SIGNATURES = (b"II*\0", b"MM\0*", b"II+\0", b"MM\0+")
+
+# TIFF tag value formats by field type (BYTE, SHORT, LONG, LONG8)
+__TIFF_FORMATS = {1: "B", 3: "H", 4: "I", 16: "Q"}
+# TIFF dtype kinds by SampleFormat
+__TIFF_KINDS = {1: "u", 2: "i", 3: "f"}
+
+def __probe_tiff(f):
+    # returns (width, height, channels, dtype) of the first image file 
+    # directory (IFD) of a TIFF or BigTIFF
+    b = f.read(16)
+    order = "<" if b[:2] == b"II" else ">"
+    if struct.unpack(order + "H", b[2:4])[0] == 42:
+        entry, count_format, offset_format = 12, "H", "I"
+        offset = struct.unpack(order + "I", b[4:8])[0]
+    else:
+        entry, count_format, offset_format = 20, "Q", "Q"
+        offset = struct.unpack(order + "Q", b[8:16])[0]
+    inline = struct.calcsize(offset_format)
+    f.seek(offset)
+    b = f.read(struct.calcsize(count_format))
+    if len(b) < struct.calcsize(count_format):
+        raise ValueError("truncated image file directory")
+    n = struct.unpack(order + count_format, b)[0]
+    entries = f.read(n * entry)
+    if len(entries) < n * entry:
+        raise ValueError("truncated image file directory")
+
+    tags = {}
+    for i in range(0, n * entry, entry):
+        tag, kind = struct.unpack(order + "HH", entries[i:i + 4])
+        if tag not in (256, 257, 258, 277, 339) or \
+           kind not in __TIFF_FORMATS:
+            continue
+        count = struct.unpack(order + offset_format, 
+                              entries[i + 4:i + 4 + inline])[0]
+        value_format = order + __TIFF_FORMATS[kind] * count
+        size = struct.calcsize(value_format)
+        data = entries[i + 4 + inline:i + entry]
+        if size > inline:
+            f.seek(struct.unpack(order + offset_format, data)[0])
+            data = f.read(size)
+            if len(data) < size:
+                raise ValueError("truncated tag {0}".format(tag))
+        tags[tag] = struct.unpack(value_format, data[:size])
+    if 256 not in tags or 257 not in tags:
+        raise ValueError("no image width or length")
+
+    channels = tags.get(277, (1,))[0]
+    depth = max(tags.get(258, (1,)))
+    kind = __TIFF_KINDS.get(tags.get(339, (1,))[0], "u")
+    if depth == 1 and kind == "u":
+        dtype = np.dtype(np.bool_)
+    else:
+        size = 1
+        while size * 8 < depth:
+            size = size * 2
+        dtype = np.dtype(kind + str(size))
+    return (tags[256][0], tags[257][0], channels, dtype)
+
+def file_probe(db_path, image_path):
+    """
+    Read the shape, data type and number of channels of a PNG, JPEG or 
+    TIFF image file from its header, without decoding the pixels (PNG
+    and JPEG files are walked with spec.d.get_image_header). The shape 
+    and data type are the same as for the array that Scikit-image 
+    io.imread returns for the image (the first image of a multi-page 
+    TIFF).
+
+    arguments:
+        db_path : string
+            POSIX path for the Cinema database
+        image_path : string
+            relative POSIX path to the image from the Cinema database
+
+    returns:
+        tuple of (shape, dtype, channels), where shape is (height, width)
+        for single channel images and (height, width, channels) otherwise,
+        and dtype is a numpy dtype
+
+    raises:
+        ValueError if it isn't a PNG, JPEG or TIFF, or the header is 
+        truncated or invalid, and OSError if it can't be read
+    """
+
+    fn = os.path.join(db_path, image_path)
+    with open(fn, "rb") as f:
+        signature = f.read(len(PNG_SIGNATURE))
+        f.seek(0)
+        if signature[:4] in TIFF_SIGNATURES:
+            width, height, channels, dtype = __probe_tiff(f)
+    if signature == PNG_SIGNATURE or signature.startswith(JPEG_SIGNATURE):
+        # the same parser as the Spec D image check, seeking over the
+        # PNG chunks without checking their CRCs
+        image_format, width, height, channels, depth = \
+            get_image_header(fn, crc=False)
+        if depth == 1 and channels == 1:
+            dtype = np.dtype(np.bool_)
+        elif depth > 8:
+            dtype = np.dtype(np.uint16)
+        else:
+            dtype = np.dtype(np.uint8)
+    elif signature[:4] not in TIFF_SIGNATURES:
+        raise ValueError("not a PNG, JPEG or TIFF signature")
+    if width == 0 or height == 0 or channels == 0:
+        raise ValueError("zero width, height or channels")
+
+    if channels == 1:
+        return ((height, width), dtype, channels)
+    return ((height, width, channels), dtype, channels)
+
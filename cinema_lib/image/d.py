@@ -3,6 +3,7 @@ Row functions for processing image data in Cinema D.
 """
 
 from ..spec import d
+from .. import image
 
 from skimage import io
 
@@ -14,12 +15,15 @@ def file_add_column(db_path, column_number,
                     function_name, image_function,
                     csv_path=d.SPEC_D_CSV_FILENAME,
                     n_components=None,
-                    fill="NaN"):
+                    fill="NaN",
+                    cursor=None,
+                    out_csv_path=None):
     """
     Adds a new column(s) to a Spec D database. Given a function that returns
     a list, array or tuple of values, it will determine the vector length
     that image_function returns if n_components is None by reading the
-    the first image in the database. If n_components is >= 0, then 
+    the header of the first image in the database (see image.file_probe). 
+    If n_components is >= 0, then 
     image_function must return a vector of the same length (returns a
     scalar if n_components is 0). It adds a number of columns to the
     database based on n_components, where it will add 1 for 0 components.
@@ -45,35 +49,58 @@ def file_add_column(db_path, column_number,
             the relative POSIX path to data.csv (or otherwise named)
         n_components : integer = None
             the number of components (vector length) that image_function
-            will return. if None, will read the first image in the database
+            will return. if None, will read the header of the first image 
+            in the database (or decode it, if it isn't a PNG, JPEG or TIFF)
             and it is assumed that image_function will return the same
             number of components.
         fill : string = "NaN"
             the replacement value if the image_function raises an exception
             and does not return a value - will be turned into a vector
             of length n_components
+        cursor : d.Cursor = None
+            if not None, only process the rows after the cursor in the
+            database, and append them with the new column(s) to 
+            out_csv_path instead of rewriting csv_path (see 
+            d.append_columns_by_row_data). this is for processing the rows
+            of a database as they are written
+        out_csv_path : string = None
+            the relative POSIX path of the CSV to append to, if cursor is
+            not None
 
     returns:
         a boolean, True if there was an error and no changes were made
         to the database, and False if the database was updated
     """
 
+    if cursor is not None:
+        if out_csv_path is None:
+            log.error("An out_csv_path is needed to add columns with a "
+                      "cursor.")
+            return(True)
+        csv_path = cursor.csv_path
+
     # get the first image
     data = d.get_iterator(db_path, csv_path)
     next(data)
-    row = next(data)
-    im = io.imread(os.path.join(db_path, row[column_number]))
+    row = next(data, None)
+    if row is None:
+        log.error("There are no rows in \"{0}\".".format(csv_path))
+        return(True)
+    try:
+        shape = image.file_probe(db_path, row[column_number])[0]
+    except ValueError:
+        shape = io.imread(os.path.join(db_path, row[column_number])).shape
     # close the file
     del(data)
 
-    if not (len(im.shape) == 2 or len(im.shape) == 3):
-        log.error("Unsupported image dimensions: {0}.".format(im.shape))
+    if not (len(shape) == 2 or len(shape) == 3):
+        log.error("Unsupported image dimensions: {0}.".format(shape))
         return(True)
 
     # determine the number of components
     if n_components == None:
-        if len(im.shape) == 3:
-            n_components = im.shape[2]
+        if len(shape) == 3:
+            n_components = shape[2]
         else:
             n_components = 0
 
@@ -84,10 +111,81 @@ def file_add_column(db_path, column_number,
                              range(0, n_components)])
 
     # iterate over the rows
-    d.add_columns_by_row_data(db_path, column_names,
-      d.file_row_function(db_path, column_number, n_components, 
-                          function_name, image_function, fill), 
-                          csv_path=csv_path)
+    row_function = d.file_row_function(db_path, column_number, n_components,
+                                       function_name, image_function, fill)
+    if cursor is not None:
+        if d.append_columns_by_row_data(db_path, column_names, 
+                                        row_function, cursor, 
+                                        out_csv_path) is None:
+            return(True)
+        return False
+
+    d.add_columns_by_row_data(db_path, column_names, row_function,
+                              csv_path=csv_path)
     return False
 
+def file_add_shape_columns(db_path, column_number, prefix="image",
+                           csv_path=d.SPEC_D_CSV_FILENAME, fill=None,
+                           cursor=None, out_csv_path=None):
+    """
+    Adds the width, height and number of channels of the images in a 
+    FILE column as new columns to a Spec D database, reading only the 
+    image headers (see image.file_probe), in one pass over the database.
+
+    arguments:
+        db_path : string
+            POSIX path to a Cinema Spec D database
+        column_number : integer >= 0
+            FILE column that contains the image files
+        prefix : string = "image"
+            the new columns are named "<prefix> width", "<prefix> height"
+            and "<prefix> channels"
+        csv_path : string = d.SPEC_D_CSV_FILENAME
+            the relative POSIX path to data.csv (or otherwise named)
+        fill : string = None
+            the replacement value if there is no image in a row, or it 
+            can't be probed. None leaves the cells empty, which keeps 
+            the columns integer typed for d.check_database
+        cursor : d.Cursor = None
+            if not None, only process the rows after the cursor, and 
+            append them to out_csv_path (see file_add_column)
+        out_csv_path : string = None
+            the relative POSIX path of the CSV to append to, if cursor is
+            not None
+
+    returns:
+        a boolean, True if there was an error and no changes were made
+        to the database, and False if the database was updated
+    """
+
+    column_names = (prefix + " width", prefix + " height", 
+                    prefix + " channels")
+    nans = (fill,) * 3
+
+    def row_function(row):
+        if row[column_number] is None:
+            return nans
+        try:
+            shape, dtype, channels = image.file_probe(db_path, 
+                                                      row[column_number])
+        except Exception as e:
+            log.error("Unable to probe \"{0}\": {1}".format(
+                row[column_number], e))
+            return nans
+        return (str(shape[1]), str(shape[0]), str(channels))
+
+    if cursor is not None:
+        if out_csv_path is None:
+            log.error("An out_csv_path is needed to add columns with a "
+                      "cursor.")
+            return(True)
+        if d.append_columns_by_row_data(db_path, column_names, 
+                                        row_function, cursor, 
+                                        out_csv_path) is None:
+            return(True)
+        return False
+
+    d.add_columns_by_row_data(db_path, column_names, row_function,
+                              csv_path=csv_path)
+    return False
 
@@ -0,0 +1,623 @@
+"""
+A local, read-only query server for a Spec D database. The CSV is loaded
+once into a SQLite3 file (see spec.d.get_sqlite3), and queried concurrently
+over HTTP through a pool of read-only connections, so that web viewers and
+notebooks don't each parse the CSV.
+
+GET requests, that return JSON:
+    /header
+        {"header": [...], "types": [...], "rows": n}
+    /files?<column>=<value>&...
+        {"files": [...]}, the FILE paths of the matching rows
+    /rows?<column>=<value>&...&limit=<n>
+        {"header": [...], "rows": [[...], ...]}, the matching rows
+    /stats
+        the request counters (see QueryStats.stats)
+
+A value selects the rows equal to it, repeating a column selects the rows
+equal to any of its values, an empty value selects the empty values, and
+"lo..hi" selects lo <= value <= hi in a numeric column (either can be
+empty, for no bound), as in spec.d.query_sqlite3.
+"""
+
+from .spec import d
+
+import os
+import sqlite3
+import shutil
+import tempfile
+import hashlib
+import threading
+import queue
+import time
+import json
+import logging as log
+import http.server
+import socketserver
+from collections import deque
+from urllib.parse import urlsplit, parse_qsl
+from urllib.request import pathname2url
+
+SERVER_ADDRESS = "127.0.0.1"
+SERVER_CONNECTIONS = 4
+SERVER_LATENCY_SAMPLES = 1024
+
+class Snapshot(object):
+    """
+    A SQLite3 file loaded from a Spec D CSV, in WAL mode, with a writer
+    connection that appends the rows added to the CSV, and a pool of
+    read-only connections. In WAL mode, appending doesn't block readers.
+
+    attributes:
+        fn : string
+            POSIX path of the SQLite3 file
+        table : string
+            the name of the table
+        header : tuple of strings
+            the header of the table
+        types : tuple of strings
+            the Spec D types of the columns
+        signature : tuple
+            (size, modification time) of the CSV when it was last read
+        offset : integer
+            byte offset after the last row that was loaded, or None if
+            rows can't be appended
+        digest : bytes
+            MD5 of the first and last SIGNATURE_BLOCK_SIZE bytes before 
+            *offset* in the CSV, or None if rows can't be appended
+        n_rows : integer
+            the number of rows in the table
+    """
+
+    def __init__(self, fn, table, n_connections=SERVER_CONNECTIONS):
+        self.fn = fn
+        self.table = table
+        self.writer = sqlite3.connect(fn, check_same_thread=False)
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        quoted = "\"" + table.replace("\"", "\"\"") + "\""
+        columns = self.writer.execute("PRAGMA table_info({0})".format(
+            quoted)).fetchall()
+        self.header = tuple(c[1] for c in columns)
+        self.types = tuple(d.SQLITE3_TO_CDB.get(c[2], d.TYPE_STRING)
+                           for c in columns)
+        self.n_rows = self.writer.execute("SELECT count(*) FROM {0}".format(
+            quoted)).fetchone()[0]
+        self.signature = None
+        self.offset = None
+        self.digest = None
+        self.retired = False
+        self.n_out = 0
+        self.lock = threading.Lock()
+        self.idle = queue.Queue()
+        uri = "file:{0}?mode=ro".format(pathname2url(os.path.abspath(fn)))
+        for i in range(0, n_connections):
+            self.idle.put(sqlite3.connect(uri, uri=True,
+                                          check_same_thread=False))
+
+    def acquire(self):
+        """
+        Return an idle read-only connection, waiting for one if all of
+        them are in use, or None if the snapshot is retired.
+        """
+
+        with self.lock:
+            if self.retired:
+                return None
+            self.n_out = self.n_out + 1
+        return self.idle.get()
+
+    def release(self, connection):
+        """
+        Return a connection to the pool, and close the snapshot if it is
+        retired and it was the last connection in use.
+        """
+
+        self.idle.put(connection)
+        with self.lock:
+            self.n_out = self.n_out - 1
+            last = self.retired and self.n_out == 0
+        if last:
+            self.close()
+
+    def retire(self):
+        """
+        Close the snapshot, when the connections in use are released.
+        """
+
+        with self.lock:
+            self.retired = True
+            last = self.n_out == 0
+        if last:
+            self.close()
+
+    def close(self):
+        """
+        Close the connections, and remove the SQLite3 file.
+        """
+
+        while not self.idle.empty():
+            self.idle.get().close()
+        self.writer.close()
+        for ext in ("", "-wal", "-shm"):
+            if os.path.exists(self.fn + ext):
+                os.unlink(self.fn + ext)
+
+class QueryPool(object):
+    """
+    A Spec D database loaded into a SQLite3 file, for concurrent read-only
+    queries. The CSV is checked for changes at most every
+    *refresh_interval* seconds, by a query. Rows appended to the CSV are
+    inserted into the SQLite3 file, and if it was rewritten otherwise
+    (e.g., by spec.d.add_columns_by_row_data), or the new rows would widen
+    the type of a column (see spec.d.append_sqlite3), it is loaded into a new
+    file that replaces the old one when it is complete. In either case,
+    queries aren't blocked while it is updated. The bytes before the new 
+    rows are checked to be unchanged by their first and last 
+    spec.d.SIGNATURE_BLOCK_SIZE bytes (as spec.d.get_cache checks a 
+    file), so appending reads only the new rows.
+
+    attributes:
+        db_path : string
+            POSIX path to Cinema database
+        csv_path : string
+            POSIX relative path to Cinema CSV
+        directory : string
+            the directory the SQLite3 files are written to
+        snapshot : Snapshot
+            the current SQLite3 file, or None if it hasn't been loaded
+        n_appends : integer
+            the number of times rows were appended
+        n_loads : integer
+            the number of times the CSV was loaded
+    """
+
+    def __init__(self, db_path, csv_path=d.SPEC_D_CSV_FILENAME,
+                 directory=None, n_connections=SERVER_CONNECTIONS,
+                 refresh_interval=d.FOLLOW_POLL_INTERVAL, cache=False,
+                 index=True):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self.temporary = directory is None
+        self.directory = tempfile.mkdtemp(prefix="cinema_") \
+            if directory is None else directory
+        self.n_connections = n_connections
+        self.refresh_interval = refresh_interval
+        self.cache = cache
+        self.index = index
+        self.table = os.path.splitext(
+            os.path.split(os.path.normpath(db_path))[1])[0]
+        self.snapshot = None
+        self.n_appends = 0
+        self.n_loads = 0
+        self.checked = 0
+        self.refreshing = threading.Lock()
+
+    def __filename(self):
+        # the CSV, or the compressed CSV if it doesn't exist (see 
+        # spec.d.get_iterator)
+        fn = os.path.join(self.db_path, self.csv_path)
+        if not os.path.isfile(fn):
+            for ext in d.COMPRESSION_EXTS.values():
+                if os.path.isfile(fn + ext):
+                    return fn + ext
+        return fn
+
+    def __signature(self):
+        st = os.stat(self.__filename())
+        return (st.st_size, st.st_mtime_ns)
+
+    def __digest(self, offset):
+        # the MD5 of the first and last blocks of the bytes before offset in
+        # the CSV, as spec.d.get_cache signs a file, so checking that they
+        # are unchanged doesn't read the whole CSV
+        md5 = hashlib.md5()
+        with open(self.__filename(), "rb") as f:
+            for start in (0, max(offset - d.SIGNATURE_BLOCK_SIZE, 0)):
+                f.seek(start)
+                n = min(offset - start, d.SIGNATURE_BLOCK_SIZE)
+                b = f.read(n)
+                if len(b) < n:
+                    raise ValueError("file is shorter than expected")
+                md5.update(b)
+        return md5.digest()
+
+    def __load(self):
+        # load the CSV into a new SQLite3 file
+        signature = self.__signature()
+        self.n_loads = self.n_loads + 1
+        fn = os.path.join(self.directory, "{0}.{1}{2}".format(self.table,
+            self.n_loads, d.SQLITE3_EXT))
+        for ext in ("", "-wal", "-shm"):
+            if os.path.exists(fn + ext):
+                os.unlink(fn + ext)
+        connection = d.get_sqlite3(self.db_path, self.csv_path, fn,
+                                   cache=self.cache, bulk=True,
+                                   index=self.index)
+        if connection is None:
+            if os.path.exists(fn):
+                os.unlink(fn)
+            return None
+        connection.close()
+        snapshot = Snapshot(fn, self.table, self.n_connections)
+
+        # rows can be appended if the file didn't change while we read it,
+        # and it ends on a row boundary
+        fn = self.__filename()
+        if fn == os.path.join(self.db_path, self.csv_path) and \
+           signature == self.__signature():
+            with open(fn, "rb") as f:
+                f.seek(max(signature[0] - 1, 0))
+                if f.read(1) == b"\n":
+                    snapshot.offset = signature[0]
+                    snapshot.digest = self.__digest(signature[0])
+        snapshot.signature = signature
+        return snapshot
+
+    def __append(self, snapshot, signature):
+        # append the rows after the offset of the snapshot, if the bytes
+        # before it are unchanged (by their first and last blocks), returns
+        # True if they were
+        if snapshot.offset is None or signature[0] < snapshot.offset or \
+           self.__digest(snapshot.offset) != snapshot.digest:
+            return False
+        try:
+            n_rows, end = d.append_sqlite3(snapshot.writer, self.db_path,
+                snapshot.offset, self.csv_path, self.table)
+            snapshot.writer.commit()
+        except Exception as e:
+            snapshot.writer.rollback()
+            log.info("Unable to append rows from \"{0}\": {1}".format(
+                os.path.join(self.db_path, self.csv_path), e))
+            return False
+        snapshot.digest = self.__digest(end)
+        snapshot.offset = end
+        snapshot.signature = signature
+        snapshot.n_rows = snapshot.n_rows + n_rows
+        self.n_appends = self.n_appends + 1
+        log.info("Appended {0} rows to \"{1}\".".format(n_rows, snapshot.fn))
+        return True
+
+    def refresh(self, force=False):
+        """
+        Load the CSV if it hasn't been loaded, or has changed, appending
+        the new rows if it was appended to. Returns immediately if another
+        thread is refreshing it, or it was checked less than
+        *refresh_interval* seconds ago.
+
+        arguments:
+            force : boolean = False
+                if True, check the CSV, waiting for another thread that is
+                refreshing it
+
+        returns:
+            True if the CSV is loaded, False if not
+        """
+
+        if not force and (self.snapshot is not None and
+                          time.monotonic() - self.checked <
+                          self.refresh_interval):
+            return True
+        if not self.refreshing.acquire(blocking=force or
+                                       self.snapshot is None):
+            return True
+        try:
+            self.checked = time.monotonic()
+            old = self.snapshot
+            if old is not None:
+                signature = self.__signature()
+                if signature == old.signature or self.__append(old,
+                                                               signature):
+                    return True
+            snapshot = self.__load()
+            if snapshot is None:
+                return old is not None
+            self.snapshot = snapshot
+            if old is not None:
+                old.retire()
+            return True
+        except Exception as e:
+            log.error("Error in refreshing \"{0}\": {1}".format(
+                os.path.join(self.db_path, self.csv_path), e))
+            return self.snapshot is not None
+        finally:
+            self.refreshing.release()
+
+    def acquire(self):
+        """
+        Refresh the CSV, and return an idle read-only connection of the 
+        current snapshot, that has to be released to the snapshot (see
+        Snapshot.acquire), so that the header and types of the snapshot 
+        are those of the table that is queried.
+
+        returns:
+            (Snapshot, connection), or None if it isn't loaded
+        """
+
+        connection = None
+        while connection is None:
+            if not self.refresh():
+                return None
+            snapshot = self.snapshot
+            connection = snapshot.acquire()
+        return (snapshot, connection)
+
+    def query(self, conditions, column=d.FILE_HEADER_KEYWORD, limit=None):
+        """
+        Return the values of a column in the rows that match conditions,
+        with a connection from the pool (see spec.d.query_sqlite3).
+
+        returns:
+            (header, list of values or rows), or None on error
+        """
+
+        acquired = self.acquire()
+        if acquired is None:
+            return None
+        snapshot, connection = acquired
+        try:
+            values = d.query_sqlite3(connection, self.table, conditions,
+                                     column, limit)
+        finally:
+            snapshot.release(connection)
+        return (snapshot.header, values) if values is not None else None
+
+    def close(self):
+        """
+        Close the connections, and remove the SQLite3 files.
+        """
+
+        if self.snapshot is not None:
+            self.snapshot.retire()
+            self.snapshot = None
+        if self.temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+class QueryStats(object):
+    """
+    Thread safe counters of the requests to a query server, and their
+    latency.
+    """
+
+    def __init__(self, n_samples=SERVER_LATENCY_SAMPLES):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.n_requests = 0
+        self.n_errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.samples = deque(maxlen=n_samples)
+
+    def add(self, seconds, error=False):
+        """
+        Count a request that took *seconds*.
+        """
+
+        with self.lock:
+            self.n_requests = self.n_requests + 1
+            if error:
+                self.n_errors = self.n_errors + 1
+            self.seconds = self.seconds + seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.samples.append(seconds)
+
+    def stats(self):
+        """
+        Return a dictionary of the number of requests and errors, the
+        uptime, the requests per second, and the mean, median, 99th
+        percentile (of the last *n_samples* requests) and maximum latency,
+        in milliseconds.
+        """
+
+        with self.lock:
+            uptime = time.monotonic() - self.start
+            samples = sorted(self.samples)
+            n = self.n_requests
+            def percentile(p):
+                if len(samples) == 0:
+                    return 0.0
+                return samples[min(int(p * len(samples)),
+                                   len(samples) - 1)] * 1000
+            return {"requests": n,
+                    "errors": self.n_errors,
+                    "uptime": uptime,
+                    "qps": n / uptime if uptime > 0 else 0.0,
+                    "mean_ms": self.seconds / n * 1000 if n > 0 else 0.0,
+                    "median_ms": percentile(0.5),
+                    "p99_ms": percentile(0.99),
+                    "max_ms": self.max_seconds * 1000}
+
+def __parse_value(value, column_type):
+    # convert a query string value to the type of its column, or a slice
+    # for a range of a numeric column, or None for an empty value
+    if value == "":
+        return None
+    if column_type == d.TYPE_INTEGER or column_type == d.TYPE_FLOAT:
+        convert = int if column_type == d.TYPE_INTEGER else float
+        if ".." in value:
+            lo, hi = value.split("..", 1)
+            return slice(float(lo) if lo else None, float(hi) if hi else None)
+        try:
+            return convert(value)
+        except ValueError:
+            return float(value)
+    return value
+
+def parse_conditions(query, header, types):
+    """
+    Parse the conditions of a query string (see the module documentation)
+    for spec.d.query_sqlite3.
+
+    arguments:
+        query : list of (string, string)
+            the (column, value) pairs of the query string
+        header : tuple of strings
+            the columns of the table
+        types : tuple of strings
+            the Spec D types of the columns
+
+    returns:
+        a dictionary of column name => condition
+
+    raises:
+        ValueError if a column isn't in the header, or a value isn't a
+        number in a numeric column
+    """
+
+    column_types = dict(zip(header, types))
+    conditions = {}
+    for k, v in query:
+        if k not in column_types:
+            raise ValueError("no column named \"{0}\"".format(k))
+        value = __parse_value(v, column_types[k])
+        if k not in conditions:
+            conditions[k] = value
+        elif isinstance(conditions[k], list):
+            conditions[k].append(value)
+        else:
+            conditions[k] = [conditions[k], value]
+    return conditions
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handle a GET request to a QueryServer.
+    """
+
+    def __reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __get(self, path, query):
+        # returns (status, body) of a request
+        pool = self.server.pool
+        if path == "/stats":
+            stats = self.server.stats.stats()
+            stats["appends"] = pool.n_appends
+            stats["loads"] = pool.n_loads
+            return (200, stats)
+        if not pool.refresh():
+            return (500, {"error": "unable to load the database"})
+        snapshot = pool.snapshot
+        if path == "/header":
+            return (200, {"header": snapshot.header, "types": snapshot.types,
+                          "rows": snapshot.n_rows})
+        if path != "/files" and path != "/rows":
+            return (404, {"error": "no such path \"{0}\"".format(path)})
+
+        limit = None
+        column = d.FILE_HEADER_KEYWORD
+        if path == "/rows":
+            limit = [int(v) for k, v in query if k == "limit"]
+            limit = limit[-1] if len(limit) > 0 else None
+            query = [(k, v) for k, v in query if k != "limit"]
+            column = None
+
+        # the conditions are parsed for the snapshot that is queried
+        acquired = pool.acquire()
+        if acquired is None:
+            return (500, {"error": "unable to load the database"})
+        snapshot, connection = acquired
+        try:
+            conditions = parse_conditions(query, snapshot.header, 
+                                          snapshot.types)
+            values = d.query_sqlite3(connection, pool.table, conditions, 
+                                     column, limit)
+        finally:
+            snapshot.release(connection)
+        if values is None:
+            return (500, {"error": "unable to query the database"})
+        if path == "/files":
+            return (200, {"files": values})
+        return (200, {"header": snapshot.header,
+                      "rows": [list(row) for row in values]})
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        try:
+            status, body = self.__get(url.path,
+                parse_qsl(url.query, keep_blank_values=True))
+        except ValueError as e:
+            status, body = (400, {"error": str(e)})
+        except Exception as e:
+            log.error("Error in \"{0}\": {1}".format(self.path, e))
+            status, body = (500, {"error": str(e)})
+        self.__reply(status, body)
+        self.server.stats.add(time.perf_counter() - start, status != 200)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+class QueryServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    An HTTP server, with a thread per request, for concurrent read-only
+    queries of a Spec D database (see the module documentation).
+
+    attributes:
+        pool : QueryPool
+            the database that is queried
+        stats : QueryStats
+            the request counters
+    """
+
+    daemon_threads = True
+
+    def __init__(self, pool, port=0, address=SERVER_ADDRESS):
+        http.server.HTTPServer.__init__(self, (address, port), QueryHandler)
+        self.pool = pool
+        self.stats = QueryStats()
+
+def make_server(db_path, port=0, address=SERVER_ADDRESS,
+                csv_path=d.SPEC_D_CSV_FILENAME,
+                n_connections=SERVER_CONNECTIONS,
+                refresh_interval=d.FOLLOW_POLL_INTERVAL, cache=False):
+    """
+    Load a Spec D database, and return a QueryServer for it, that isn't
+    serving yet. Call serve_forever() to serve requests, and shutdown() and
+    then server_close() and pool.close() to stop.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        port : integer = 0
+            the port to listen on, or 0 for any free port (see
+            server_address)
+        address : string = SERVER_ADDRESS
+            the address to listen on, by default only the local host
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        n_connections : integer = SERVER_CONNECTIONS
+            the number of read-only connections, i.e., the number of
+            queries that run at once
+        refresh_interval : float = FOLLOW_POLL_INTERVAL
+            the least number of seconds between checks for changes to the
+            CSV
+        cache : boolean = False
+            if True, read the rows from the binary cache (see get_sqlite3)
+
+    returns:
+        a QueryServer if successful, None if not
+
+    side effects:
+        writes the SQLite3 file(s) to a temporary directory
+
+        logs error and info messages to the logger
+    """
+
+    pool = QueryPool(db_path, csv_path, n_connections=n_connections,
+                     refresh_interval=refresh_interval, cache=cache)
+    if not pool.refresh(True):
+        pool.close()
+        return None
+    try:
+        server = QueryServer(pool, port, address)
+    except Exception as e:
+        log.error("Unable to listen on {0}:{1}: {2}".format(address, port, e))
+        pool.close()
+        return None
+    log.info("Serving \"{0}\" on http://{1}:{2}/".format(db_path,
+        server.server_address[0], server.server_address[1]))
+    return server
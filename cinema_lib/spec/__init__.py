@@ -6,17 +6,152 @@ from ..spec import d
 from ..spec import a
 
 import os
+import re
+import sqlite3
 import logging as log
+from itertools import product, islice
 
 CINEMA_DATABASE_EXT = ".cdb"
+CONVERT_BATCH_SIZE = 65536
 
-def convert_a_to_d(db_path):
+# CSV values that need to be quoted
+__NEEDS_QUOTES = re.compile(r'[,"\r\n]')
+# the minimum number of rows formatted at once from precomputed strings
+__BLOCK_SIZE = 256
+
+def __quote(value):
+    # quote a CSV value if needed, as csv.QUOTE_MINIMAL does
+    if __NEEDS_QUOTES.search(value) is None:
+        return value
+    return '"' + value.replace('"', '""') + '"'
+
+def __open_view(db_path):
+    # returns (View, prefix of the filenames) of a Spec A database, or 
+    # (None, None)
+
+    # special case to handle incorrectly written Spec A databases from 
+    # ParaView
+    db = a.get_view(db_path)
+    if db == None:
+        # ParaView writes the info.json file here ...
+        db = a.get_view(db_path, "image/info.json")
+        if db == None:
+            log.error("Unable to open \"{0}\" in \"{1}\".".format(
+                a.SPEC_A_JSON_FILENAME, db_path))
+            return (None, None)
+        return (db, "image/")
+    return (db, "")
+
+def __name_pieces(db):
+    # split the filenames into the formatted values of each argument (with
+    # the literal text before them) and the literal text at the end, so 
+    # that a filename is the concatenation of its arguments' pieces. 
+    # returns (pieces, suffix), or None if the arguments aren't in the 
+    # same order in the name pattern as in the rows, or a piece needs to
+    # be quoted
+    pieces = [[""] * len(values) for values in db.values]
+    text = ""
+    last = -1
+    try:
+        for literal, position, tail in a.parse_name_pattern(db.name_pattern,
+                                                            db.keys):
+            text = text + literal
+            if position is None:
+                continue
+            if position <= last:
+                return None
+            last = position
+            form = "{0" + tail + "}"
+            pieces[last] = [text + form.format(v) for v in db.values[last]]
+            text = ""
+    except Exception:
+        return None
+    for values in pieces + [[text]]:
+        if any(__NEEDS_QUOTES.search(p) is not None for p in values):
+            return None
+    return (pieces, text)
+
+def __write_pieces(f, cells, pieces, prefix, suffix, batch_size):
+    # write the rows from the product of the cells and the filename 
+    # pieces, formatting blocks of the fastest varying arguments at once
+    m = len(cells)
+    size = 1
+    while m > 0 and size < __BLOCK_SIZE:
+        m = m - 1
+        size = size * len(cells[m])
+    inner = [(",".join(c) + ",", "".join(p) + suffix + "\n") for c, p in 
+             zip(product(*cells[m:]), product(*pieces[m:]))]
+
+    batch = []
+    n_rows = 0
+    for c, p in zip(product(*cells[:m]), product(*pieces[:m])):
+        left = ",".join(c) + "," if m > 0 else ""
+        middle = prefix + "".join(p)
+        batch.append("".join([left + c + middle + p for c, p in inner]))
+        n_rows = n_rows + len(inner)
+        if n_rows >= batch_size:
+            f.write("".join(batch))
+            batch = []
+            n_rows = 0
+    f.write("".join(batch))
+
+def __write_rows(f, db, cells, prefix, batch_size):
+    # write the rows from the product of the cells and the filenames, 
+    # quoting the filenames
+    files = db.filenames()
+    if prefix:
+        files = map(prefix.__add__, files)
+    lines = map(",".join, map(tuple.__add__, product(*cells), 
+                              zip(map(__quote, files))))
+    while True:
+        batch = list(islice(lines, batch_size))
+        if len(batch) == 0:
+            break
+        f.write("\n".join(batch) + "\n")
+
+def __write_csv(db_path, csv_fn, batch_size):
+    # write the Spec D CSV of a Spec A database to *csv_fn*, removing it 
+    # if it fails. returns True if it was written
+    db, prefix = __open_view(db_path)
+    if db == None:
+        return False
+
+    # create the csv 
+    try:
+        with open(csv_fn, "w") as f:
+            f.write(",".join([__quote(h) for h in db.header]) + "\n")
+            cells = [[__quote(str(v)) for v in values] 
+                     for values in db.values]
+            pieces = __name_pieces(db) if len(cells) > 0 else None
+            if pieces is not None and \
+               __NEEDS_QUOTES.search(prefix) is None:
+                __write_pieces(f, cells, pieces[0], prefix, pieces[1], 
+                               batch_size)
+            else:
+                __write_rows(f, db, cells, prefix, batch_size)
+
+    except Exception as e:
+        log.error("Conversion of database failed with \"{0}\".".format(e))
+        os.unlink(csv_fn)
+        return False
+
+    return True
+
+def convert_a_to_d(db_path, batch_size=CONVERT_BATCH_SIZE):
     """
-    Create a Spec D CSV, in place, in a Spec A database.
+    Create a Spec D CSV, in place, in a Spec A database. 
+
+    Every argument value is converted (and quoted, if needed) once, and
+    the rows are formatted in batches from the product of those strings,
+    and written at once. If the arguments are in the same order in the 
+    name pattern as in the rows, the filenames are also concatenated from
+    the formatted values of each argument, rather than formatted per row.
 
     arguments:
         db_path : string
             POSIX path to a Cinema Spec A database
+        batch_size : integer = CONVERT_BATCH_SIZE
+            the number of rows to write at once
 
     returns:
         True if it was able to create it, False if not
@@ -32,45 +167,136 @@ def convert_a_to_d(db_path):
     if os.path.exists(csv_fn):
         log.error("{0} exists. Refusing to execute.".format(csv_fn))
         return False
-    
-    # special case to handle incorrectly written Spec A databases from ParaView
-    use_imagedir = False
-    db = a.get_iterator(db_path)
+
+    return __write_csv(db_path, csv_fn, batch_size)
+
+def __typed_values(cells, column_type):
+    # the values of an argument, as they are written to the CSV, converted
+    # to the type of their column as SQLite converts them in get_sqlite3,
+    # where NaN is kept as text, as SQLite stores a NaN float as NULL
+    if column_type == d.TYPE_INTEGER:
+        return [int(c) for c in cells]
+    elif column_type == d.TYPE_FLOAT:
+        values = []
+        for c in cells:
+            f = float(c)
+            values.append(f if f == f else c)
+        return values
+    return cells
+
+def convert_a_to_sqlite3(db_path, where=":memory:", 
+                         batch_size=CONVERT_BATCH_SIZE):
+    """
+    Returns a SQLite3 database with the rows of a Spec A database, as 
+    spec.d.get_sqlite3 would for the Spec D database that convert_a_to_d 
+    creates, without writing or parsing a CSV. The types of the columns 
+    are inferred from the argument values, as they are written to the CSV,
+    with spec.d.infer_type, and the table is created with 
+    spec.d.create_sqlite3_table. Every argument value is converted to the
+    type of its column once, and the rows are inserted as tuples from the
+    product of those values, *batch_size* rows per executemany.
+
+    arguments:
+        db_path : string
+            POSIX path to a Cinema Spec A database
+        where : string = ":memory:"
+            where to back the SQLite3 on disk; ":memory:" is temporary in 
+            memory
+        batch_size : integer = CONVERT_BATCH_SIZE
+            number of rows inserted per executemany
+
+    returns:
+        a SQLite3 database if successful, None if not. The table will be
+        named by the base filename of *db_path*, and typed as in 
+        spec.d.get_sqlite3.
+
+    side effects:
+        will open a file on disk at *where* if given a POSIX path or URI
+
+        logs error and info messages to the logger
+    """
+
+    log.info("Converting \"{0}\" into a SQLite database at \"{1}\".".format(
+        db_path, where))
+
+    db, prefix = __open_view(db_path)
     if db == None:
-        # ParaView writes the info.json file here ...
-        db = a.get_iterator(db_path,"image/info.json")
-        if db == None:
-            log.error("Unable to open \"{0}\" in \"{1}\".".format(
-                a.SPEC_A_JSON_FILENAME, db_path))
-            return False
-        else:
-            use_imagedir = True 
+        return None
 
-    # create the csv 
     try:
-        with open(csv_fn, "w") as f:
-            # iterate over the data
-            firstline = True
-            for row in db:
-                line = ""
-                for col in row[:-1]:
-                    line = line + str(col) + ","
-
-                # ParaView exception logic 
-                if use_imagedir:
-                    if firstline:
-                        line = line + str(row[-1]) + "\n"
-                        firstline = False
-                    else:
-                        line = line + "image/" + str(row[-1]) + "\n"
-                else:
-                    line = line + str(row[-1]) + "\n"
-
-                f.write(line)
+        cells = [[str(v) for v in values] for values in db.values]
+        types = [d.infer_type(c) for c in cells] + \
+                [d.TYPE_STRING]
+        types = [t if t != d.TYPE_EMPTY else d.TYPE_STRING for t in types]
+        log.info("Types are {0}.".format(types))
+        name = os.path.splitext(
+                os.path.split(os.path.normpath(db_path))[1])[0]
+        log.info("Table name is \"{0}\".".format(name))
+
+        connection = sqlite3.connect(where)
+        d.create_sqlite3_table(connection, name, db.header, types)
+        values = [__typed_values(c, t) for c, t in zip(cells, types)]
+        files = db.filenames()
+        if prefix:
+            files = map(prefix.__add__, files)
+        insert = "INSERT INTO \"{0}\" VALUES ({1})".format(name, 
+            ",".join("?" * len(db.header)))
+        rows = map(tuple.__add__, product(*values), zip(files))
+        while True:
+            batch = list(islice(rows, batch_size))
+            if len(batch) == 0:
+                break
+            connection.executemany(insert, batch)
+        connection.commit()
 
+        log.info("Insertion of {0} rows into \"{1}\" was successful.".format(
+            len(db), name))
+        return connection
+    except Exception as e:
+        log.error("Error in creating database: {0}.".format(e))
+        return None
+
+def convert_a_to_npz(db_path, npz_path):
+    """
+    Write the columns of a Spec A database to a NumPy .npz file, one 
+    array per column in the order of the header, as spec.a.get_columns 
+    expands them, without writing or parsing a CSV. Requires numpy.
+
+    arguments:
+        db_path : string
+            POSIX path to a Cinema Spec A database
+        npz_path : string
+            POSIX path of the .npz file to write
+
+    returns:
+        True if it was able to create it, False if not
+
+    side effects:
+        logs error and info messages to the logger
+        writes out *npz_path*
+    """
+
+    import numpy as np
+
+    log.info("Writing the columns of \"{0}\" to \"{1}\".".format(db_path,
+                                                                npz_path))
+    db, prefix = __open_view(db_path)
+    if db == None:
+        return False
+
+    try:
+        columns = a.get_columns(db_path, 
+                                json_path="image/info.json" if prefix else
+                                a.SPEC_A_JSON_FILENAME)
+        if columns == None:
+            return False
+        if prefix:
+            columns[d.FILE_HEADER_KEYWORD] = np.char.add(prefix, 
+                columns[d.FILE_HEADER_KEYWORD].data)
+        np.savez(npz_path, **{k: np.ma.getdata(v) 
+                              for k, v in columns.items()})
     except Exception as e:
         log.error("Conversion of database failed with \"{0}\".".format(e))
         return False
 
     return True
-
@@ -6,8 +6,11 @@ from ...spec import d
 
 import json
 import os
+import re
+import string
 import logging as log
-from itertools import product
+from collections import OrderedDict
+from itertools import product, islice, starmap
 
 SPEC_A_JSON_FILENAME = "info.json"
 KEY_TYPE = "type"
@@ -24,6 +27,9 @@ KEY_ARG_LABEL = "label"
 KEY_ARG_TYPE = "type"
 KEY_ARG_VALUES = "values"
 
+# the argument name of a replacement field, without attributes or indices
+__FIELD_NAME = re.compile(r"[^.\[]*")
+
 def get_dictionary(db_path, json_path=SPEC_A_JSON_FILENAME):
     """
     Get the dictionary for the json_path in the Cinema Spec A database.
@@ -50,7 +56,119 @@ def get_dictionary(db_path, json_path=SPEC_A_JSON_FILENAME):
     except:
         return None
 
-def get_iterator(db_path, json_path=SPEC_A_JSON_FILENAME):
+def parse_name_pattern(name_pattern, keys):
+    """
+    Split a name pattern into its literal text and its argument fields, 
+    as name_pattern.format(**kwargs) would, where kwargs are the *keys*.
+
+    arguments:
+        name_pattern : string
+            the format string of the filenames, with the argument names as
+            fields, e.g., "{phi}/{theta}.png"
+        keys : tuple of strings
+            the argument names, in the order of the values
+
+    returns:
+        a list of (literal, position, tail), where literal is the text 
+        before a field (with "{{" and "}}" unescaped), position is the 
+        index of its argument in *keys*, and tail is the rest of the field
+        after the argument name, i.e., an index or attribute, conversion 
+        and format spec, so that "{0" + tail + "}" formats the value of 
+        the argument. position and tail are None for the literal text at
+        the end, if there is any
+
+    raises:
+        ValueError if the name pattern is malformed, a field isn't an 
+        argument, or it has a nested field
+    """
+
+    positions = {k: i for i, k in enumerate(keys)}
+    fields = []
+    text = ""
+    for literal, field, spec, conversion in \
+            string.Formatter().parse(name_pattern):
+        text = text + literal
+        if field is None:
+            continue
+        name = __FIELD_NAME.match(field).group(0)
+        if name not in positions or "{" in spec:
+            raise ValueError("Can't parse \"{0}\".".format(field))
+        fields.append((text, positions[name], field[len(name):] +
+                       ("!" + conversion if conversion else "") +
+                       (":" + spec if spec else "")))
+        text = ""
+    if text:
+        fields.append((text, None, None))
+    return fields
+
+def compile_name_pattern(name_pattern, keys):
+    """
+    Compile a name pattern into a function of the argument values, which
+    returns the same filename as name_pattern.format(**kwargs), where 
+    kwargs are the *keys* and the values, without creating the kwargs. 
+    The named fields are replaced with positional fields.
+
+    arguments:
+        name_pattern : string
+            the format string of the filenames, with the argument names as
+            fields, e.g., "{phi}/{theta}.png"
+        keys : tuple of strings
+            the argument names, in the order of the values
+
+    returns:
+        a function(*values) that returns the filename of the values
+    """
+
+    parts = []
+    try:
+        # nested fields, and fields that aren't arguments (which are 
+        # errors), use the name pattern
+        for literal, position, tail in parse_name_pattern(name_pattern, 
+                                                          keys):
+            parts.append(literal.replace("{", "{{").replace("}", "}}"))
+            if position is not None:
+                parts.append("{" + str(position) + tail + "}")
+    except ValueError:
+        return lambda *values: name_pattern.format(**dict(zip(keys, 
+                                                              values)))
+    return "".join(parts).format
+
+def select_values(values, condition):
+    """
+    Select the values of an argument that match a condition, keeping 
+    their order.
+
+    arguments:
+        values : list
+            the values of an argument
+        condition : value, list, tuple, set, slice or function
+            a list, tuple or set selects the values in it, a slice(lo, hi)
+            selects lo <= value <= hi (either can be None, for no bound),
+            a function(value) => boolean selects the values it returns True
+            for, and anything else selects the values equal to it. values
+            are compared as they are in the JSON, i.e., 90 is not "90"
+
+    returns:
+        a list of the selected values
+    """
+
+    if callable(condition):
+        return [v for v in values if condition(v)]
+    elif isinstance(condition, slice):
+        lo, hi = condition.start, condition.stop
+        selected = []
+        for v in values:
+            try:
+                if (lo is None or v >= lo) and (hi is None or v <= hi):
+                    selected.append(v)
+            except TypeError:
+                pass
+        return selected
+    elif isinstance(condition, (list, tuple, set, frozenset)):
+        return [v for v in values if v in condition]
+    return [v for v in values if v == condition]
+
+def get_iterator(db_path, json_path=SPEC_A_JSON_FILENAME, selection=None):
     """
     Return a row iterator, assuming a valid Spec A database. Does
     not validate that it is a proper Spec A database. 
@@ -67,14 +185,25 @@ def get_iterator(db_path, json_path=SPEC_A_JSON_FILENAME):
             POSIX path to Cinema database
         json_path : string = SPEC_A_JSON_FILENAME
             POSIX relative path to Cinema JSON 
+        selection : dictionary = None
+            if not None, only return the rows in a sub-space of the 
+            database, given by a dictionary of argument name to a 
+            condition on its values (see select_values), e.g., 
+            {"phi": [0, 90], "time": slice(10, 20)}. the sub-space is the
+            product of the selected values, and the rest are never 
+            enumerated
 
     returns:
         an iterator that returns a tuple of data per row if the json_path 
-        file can be opened, otherwise returns None
+        file can be opened, otherwise returns None (also if an argument
+        in *selection* doesn't exist)
 
         the first row will be the header (column identifiers), which are
         the arguments in the JSON file. The last column, will be FILE,
         i.e., the list of files.
+
+    side effects:
+        logs error messages to the logger, if *selection* is invalid
     """
     db = get_dictionary(db_path, json_path)
     if db == None:
@@ -82,17 +211,326 @@ def get_iterator(db_path, json_path=SPEC_A_JSON_FILENAME):
 
     try:
         keylist = tuple(sorted(db[KEY_ARGUMENTS].keys()))
+        selection = {} if selection is None else selection
+        for k in selection:
+            if k not in keylist:
+                log.error("Argument \"{0}\" is not in \"{1}\".".format(
+                    k, json_path))
+                return None
         def filelist():
             yield keylist + (d.FILE_HEADER_KEYWORD,)
-            for row in product(*[db[KEY_ARGUMENTS][k][KEY_ARG_VALUES] 
-                                 for k in keylist]):
-                kv = {k: v for k, v in zip(keylist, row)}
-                yield row + (db[KEY_NAME_PATTERN].format(**kv),)
+            values = [select_values(db[KEY_ARGUMENTS][k][KEY_ARG_VALUES],
+                                    selection[k]) if k in selection else 
+                      db[KEY_ARGUMENTS][k][KEY_ARG_VALUES] for k in keylist]
+            filename = compile_name_pattern(db[KEY_NAME_PATTERN], keylist)
+            for row in product(*values):
+                yield row + (filename(*row),)
         return filelist()
     except:
         return None
 
-def check_database(db_path, json_path=SPEC_A_JSON_FILENAME, quick=False):
+def get_filenames(db_path, json_path=SPEC_A_JSON_FILENAME):
+    """
+    Return an iterator of the filenames of a Spec A database, in the 
+    same order as the rows of get_iterator, assuming a valid Spec A 
+    database. Does not validate that it is a proper Spec A database. 
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        json_path : string = SPEC_A_JSON_FILENAME
+            POSIX relative path to Cinema JSON 
+
+    returns:
+        an iterator of filenames if the json_path file can be opened, 
+        otherwise returns None
+    """
+
+    view = get_view(db_path, json_path)
+    if view == None:
+        return None
+    return view.filenames()
+
+def get_columns(db_path, columns=None, json_path=SPEC_A_JSON_FILENAME):
+    """
+    Expand a Spec A database into NumPy arrays, one per column, in the
+    same order as the rows of get_iterator. Each argument's values are
+    repeated and tiled by its stride in the parameter space, and the 
+    filenames are formatted with the compiled name pattern. Does not 
+    validate that it is a proper Spec A database. Requires numpy.
+
+    Integer arguments are numpy.int64, float arguments are numpy.float64 
+    and the rest (and FILE) are numpy.str_, as in spec.d.get_columns.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        columns : iterator of strings = None
+            the column names (arguments or d.FILE_HEADER_KEYWORD) to 
+            materialize, if None, all of the columns are materialized
+        json_path : string = SPEC_A_JSON_FILENAME
+            POSIX relative path to Cinema JSON 
+
+    returns:
+        an OrderedDict of column name to numpy.ma.MaskedArray, in the 
+        order of the header (or of *columns*), or None if the json_path
+        file can't be opened or a column does not exist
+
+    side effects:
+        logs error and info messages to the logger
+    """
+
+    import numpy as np
+    from ... import check_numpy_version
+    check_numpy_version(np)
+
+    log.info("Expanding columns of \"{0}/{1}\".".format(db_path, json_path))
+    view = get_view(db_path, json_path)
+    if view == None:
+        log.error("Error opening \"{0}\".".format(json_path))
+        return None
+    if columns == None:
+        columns = view.header
+    for c in columns:
+        if c not in view.header:
+            log.error("Column {0} is not in the header {1}.".format(
+                c, view.header))
+            return None
+
+    result = OrderedDict()
+    for c in columns:
+        if c == d.FILE_HEADER_KEYWORD:
+            data = np.array(list(view.filenames()), dtype=np.str_)
+        else:
+            k = view.keys.index(c)
+            values = np.array(view.values[k])
+            if values.dtype.kind in "iu":
+                values = values.astype(np.int64)
+            elif values.dtype.kind == "f":
+                values = values.astype(np.float64)
+            else:
+                values = values.astype(np.str_)
+            stride = view.strides[k]
+            data = np.tile(np.repeat(values, stride), 
+                           len(view) // (len(values) * stride) 
+                           if len(values) > 0 else 0)
+        result[c] = np.ma.MaskedArray(data)
+        log.info("Column \"{0}\" is {1} with {2} rows.".format(
+            c, data.dtype, len(data)))
+
+    return result
+
+class View(object):
+    """
+    A read-only sequence of the rows of a Spec A database, in the same
+    order as get_iterator (without the header). The parameter space isn't
+    enumerated: the length is the product of the number of values of the
+    arguments, a row is decoded from its index as a mixed radix number
+    (the last argument varies fastest), and a row's index is encoded from 
+    its argument values.
+
+    attributes:
+        header : tuple of strings
+            the sorted argument names and the FILE column, as the first 
+            row of get_iterator
+        keys : tuple of strings
+            the sorted argument names
+        values : tuple of tuples
+            the values of each argument, in the order of *keys*
+        name_pattern : string
+            the format string of the filenames
+        strides : tuple of integers
+            the number of rows between consecutive values of each argument
+    """
+
+    def __init__(self, db):
+        self.keys = tuple(sorted(db[KEY_ARGUMENTS].keys()))
+        self.header = self.keys + (d.FILE_HEADER_KEYWORD,)
+        self.values = tuple([tuple(db[KEY_ARGUMENTS][k][KEY_ARG_VALUES])
+                             for k in self.keys])
+        self.name_pattern = db[KEY_NAME_PATTERN]
+        self.__filename = compile_name_pattern(self.name_pattern, self.keys)
+
+        strides = []
+        n = 1
+        for values in reversed(self.values):
+            strides.append(n)
+            n = n * len(values)
+        self.strides = tuple(reversed(strides))
+        self.__len = n
+        # the first index of each (hashable) value, for reverse lookups
+        self.__positions = [{} for k in self.keys]
+        for positions, values in zip(self.__positions, self.values):
+            for i, v in enumerate(values):
+                try:
+                    positions.setdefault(v, i)
+                except TypeError:
+                    pass
+
+    def __len__(self):
+        return self.__len
+
+    def select(self, selection):
+        """
+        Return a View of a sub-space of the database, which is the product
+        of the selected values of the arguments. The row indices of the
+        sub-space View are its own.
+
+        arguments:
+            selection : dictionary
+                argument name to a condition on its values (see 
+                select_values), e.g., {"phi": [0, 90], "time": slice(10, 
+                20)}
+
+        raises:
+            KeyError if an argument isn't in the database
+        """
+
+        for k in selection:
+            if k not in self.keys:
+                raise KeyError("Argument \"{0}\" is not in the "
+                               "database.".format(k))
+        return View({KEY_NAME_PATTERN: self.name_pattern,
+                     KEY_ARGUMENTS: {k: {KEY_ARG_VALUES: 
+                         select_values(v, selection[k]) if k in selection
+                         else v} for k, v in zip(self.keys, self.values)}})
+
+    def __iter__(self):
+        for row in product(*self.values):
+            yield row + (self.__filename(*row),)
+
+    def __reversed__(self):
+        for i in range(self.__len - 1, -1, -1):
+            yield self.row(i)
+
+    def __contains__(self, row):
+        try:
+            self.index(row[:len(self.keys)])
+        except (ValueError, TypeError):
+            return False
+        return len(row) == len(self.keys) or \
+               (len(row) == len(self.header) and 
+                row[-1] == self.filename(row[:-1]))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(j) for j in range(self.__len)[i]]
+        return self.row(i)
+
+    def row(self, i):
+        """
+        Return the row at index *i*, which may be negative.
+
+        returns:
+            a tuple of the argument values and the filename
+    
+        raises:
+            IndexError if *i* is out of range
+        """
+
+        n = i + self.__len if i < 0 else i
+        if n < 0 or n >= self.__len:
+            raise IndexError("Row index {0} is out of range.".format(i))
+        row = []
+        for values, stride in zip(self.values, self.strides):
+            j, n = divmod(n, stride)
+            row.append(values[j])
+        row = tuple(row)
+        return row + (self.filename(row),)
+
+    def filename(self, values):
+        """
+        Return the filename of the argument *values*, a tuple of a value
+        for each argument in the order of *keys*.
+        """
+
+        return self.__filename(*values)
+
+    def filenames(self):
+        """
+        Return an iterator of the filenames of all of the rows.
+        """
+
+        return starmap(self.__filename, product(*self.values))
+
+    def index(self, values):
+        """
+        Return the index of the row of the argument *values*, a tuple of 
+        a value for each argument in the order of *keys*. If a value is 
+        repeated in an argument, the first one is used.
+
+        raises:
+            ValueError if the values aren't in the database
+        """
+
+        if len(values) != len(self.keys):
+            raise ValueError("Expected {0} values, not {1}.".format(
+                len(self.keys), len(values)))
+        n = 0
+        for k, v, positions, stride in zip(self.keys, values, 
+                                           self.__positions, self.strides):
+            if v not in positions:
+                raise ValueError("{0} is not a value of \"{1}\".".format(
+                    repr(v), k))
+            n = n + positions[v] * stride
+        return n
+
+    def lookup(self, values):
+        """
+        Return the index and the filename of the row of the argument 
+        *values* (see index).
+
+        returns:
+            a tuple of (index, filename)
+
+        raises:
+            ValueError if the values aren't in the database
+        """
+
+        return (self.index(values), self.filename(values))
+
+def get_view(db_path, json_path=SPEC_A_JSON_FILENAME, selection=None):
+    """
+    Return a random access View of the rows of a Spec A database, 
+    assuming it is valid. Does not validate that it is a proper Spec A
+    database. 
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        json_path : string = SPEC_A_JSON_FILENAME
+            POSIX relative path to Cinema JSON 
+        selection : dictionary = None
+            if not None, return a View of a sub-space of the database (see
+            View.select)
+
+    returns:
+        a View of the database if the json_path file can be opened, 
+        otherwise returns None (also if an argument in *selection* 
+        doesn't exist)
+
+    side effects:
+        logs error messages to the logger, if *selection* is invalid
+    """
+
+    db = get_dictionary(db_path, json_path)
+    if db == None:
+        return None
+
+    try:
+        view = View(db)
+    except:
+        return None
+    if selection is not None:
+        try:
+            return view.select(selection)
+        except KeyError as e:
+            log.error("{0}".format(e.args[0]))
+            return None
+    return view
+
+def check_database(db_path, json_path=SPEC_A_JSON_FILENAME, quick=False,
+                   verify=None, list_workers=d.LIST_WORKERS):
     """
     Validate a Spec A database.
 
@@ -104,6 +542,12 @@ def check_database(db_path, json_path=SPEC_A_JSON_FILENAME, quick=False):
         quick : boolean = False
             if True, perform a quick check, which means only checking
             validating the JSON, and not the files
+        verify : string = None
+            if d.VERIFY_SIZE, also check that files aren't empty, or if 
+            d.VERIFY_CHECKSUM, that they aren't empty and can be read
+        list_workers : integer = d.LIST_WORKERS
+            number of threads to check the files with (see 
+            spec.d.FileListing)
 
     returns:
         True if it is valid, False otherwise
@@ -205,15 +649,22 @@ def check_database(db_path, json_path=SPEC_A_JSON_FILENAME, quick=False):
         if not quick:
             n_files = 0
             total_files = 0
-            files = get_iterator(db_path, json_path)
-            next(files)
-            for row in files:
-                total_files = total_files + 1
-                if not os.path.isfile(os.path.join(db_path, row[-1])):
-                    log.error("File \"{0}\" is missing.".format(row[-1]))
-                    file_error = True
-                else:
-                    n_files = n_files + 1
+            files = get_filenames(db_path, json_path)
+            # list the directories of the files, rather than stat them,
+            # and check them in batches
+            listing = d.FileListing(db_path, list_workers)
+            while True:
+                batch = list(islice(files, d.CHECK_BATCH_SIZE))
+                if len(batch) == 0:
+                    break
+                for fn, error in zip(batch, listing.check(batch, verify)):
+                    total_files = total_files + 1
+                    if error is not None:
+                        log.error("File \"{0}\" {1}.".format(fn, error))
+                        file_error = True
+                    else:
+                        n_files = n_files + 1
+            listing.report()
 
             if n_files != total_files:
                 log.error("Only {0} files out of {1} were found.".format(
@@ -4,11 +4,33 @@ Cinema Spec D utility functions for reading and validating databases.
 
 import sqlite3
 import os
+import stat
 import logging as log
 import csv
-from functools import reduce
+from functools import reduce, partial
 import hashlib
 import time
+import re
+import math
+import random
+from itertools import islice, chain, count
+import operator
+from collections import OrderedDict, deque
+from array import array
+from bisect import bisect_left
+import io
+import struct
+import json
+import zlib
+import sys
+import multiprocessing
+import multiprocessing.pool
+import gzip
+import bz2
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
 SPEC_D_CSV_FILENAME = "data.csv"
 FILE_HEADER_KEYWORD = "FILE"
@@ -26,103 +48,485 @@ SQLITE3_TO_CDB = {
     "REAL": TYPE_FLOAT,
     "TEXT": TYPE_STRING
     }
+READ_BLOCK_SIZE = 1 << 20
+SIGNATURE_BLOCK_SIZE = 1 << 16
+INDEX_EXT = ".idx"
+INDEX_MAGIC = b"CDBIDX1\n"
+CACHE_EXT = ".cache"
+CACHE_MAGIC = b"CDBCACHE2\n"
+CHECKPOINT_EXT = ".check"
+CHECKPOINT_MAGIC = b"CDBCHECK2\n"
+SQLITE3_EXT = ".sqlite"
+SQLITE3_SIDECAR_TABLE = "cinema_sidecar"
+PARALLEL_CHUNK_SIZE = 1 << 24
+PARALLEL_MIN_CHUNK_SIZE = 1 << 20
+FOLLOW_POLL_INTERVAL = 1.0
+CHECK_BATCH_SIZE = 4096
+SQLITE3_CHUNK_SIZE = 65536
+SQLITE3_INDEX_SELECTIVITY = 0.1
+INFER_ALL = "all"
+INFER_SAMPLE = "sample"
+INFER_SAMPLE_ROWS = 1024
+LIST_WORKERS = 8
+VERIFY_SIZE = "size"
+VERIFY_CHECKSUM = "checksum"
+SAMPLE_CONFIDENCE = 0.95
+SAMPLE_BLOCK_SIZE = 1 << 16
+IMAGE_HEADER = "header"
+IMAGE_DECODE = "decode"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8"
+IMAGE_EXTS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG"
+    }
+COMPRESSION_EXTS = {
+    "gz": ".gz",
+    "bz2": ".bz2",
+    "xz": ".xz"
+    }
+__DELIMITERS = re.compile('[,\n"]')
+__PREDICATE_TOKEN = re.compile(r"""\s*(?:
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![\w.]))|
+    (?P<string>"(?:[^"]|"")*"|'(?:[^']|'')*')|
+    (?P<quoted_name>`[^`]*`)|
+    (?P<op>==|!=|<=|>=|<|>|=|\(|\))|
+    (?P<name>[^\s()=!<>"'`]+))""", re.VERBOSE)
+# searched in a column of values joined and surrounded by NUL, these match
+# the values (without whitespace) that int() or float() might accept, or 
+# a float that int() might accept
+__NUMBER_LIKE = re.compile(r"\0[-+]?(?:\d|\.\d|inf|nan)", re.IGNORECASE)
+__INTEGER_LIKE = re.compile(r"\0[^\0.eEiInN]*\0")
+# PNG (bit depths, channels) by color type
+__PNG_COLOR_TYPES = {
+    0: ((1, 2, 4, 8, 16), 1),
+    2: ((8, 16), 3),
+    3: ((1, 2, 4, 8), 3),
+    4: ((8, 16), 2),
+    6: ((8, 16), 4)
+    }
+# JPEG start of frame markers
+__JPEG_SOF = frozenset(range(0xc0, 0xd0)) - frozenset((0xc4, 0xc8, 0xcc))
+# the files checked with a verification are also checked with the weaker 
+# ones
+__VERIFY_ORDER = {None: 0, VERIFY_SIZE: 1, VERIFY_CHECKSUM: 2}
+# the values of infinite floats
+__INFINITE = ("inf", "+inf", "-inf", "infinity", "+infinity", "-infinity")
+__PREDICATE_OPS = {
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+    }
+
+def __compression(fn):
+    # return the compression of a file from its magic number: "gz", "bz2",
+    # "xz" or None
+    with open(fn, "rb") as f:
+        magic = f.read(6)
+    if magic[:2] == b"\x1f\x8b":
+        return "gz"
+    elif magic[:3] == b"BZh":
+        return "bz2"
+    elif magic == b"\xfd7zXZ\x00":
+        return "xz"
+    return None
+
+def __csv_filename(db_path, csv_path):
+    # return the full filename of a CSV, which may be compressed, i.e., 
+    # csv_path with a COMPRESSION_EXTS extension, or None if it doesn't 
+    # exist
+    fn = os.path.join(db_path, csv_path)
+    if os.path.isfile(fn):
+        return fn
+    for ext in sorted(COMPRESSION_EXTS.values()):
+        if os.path.isfile(fn + ext):
+            return fn + ext
+    return None
+
+def __open_compressed(fn, mode, compression):
+    # open a file with a compression from COMPRESSION_EXTS
+    if compression == "gz":
+        return gzip.open(fn, mode)
+    elif compression == "bz2":
+        return bz2.open(fn, mode)
+    elif compression == "xz" and lzma is not None:
+        return lzma.open(fn, mode)
+    raise ValueError("Unsupported compression \"{0}\".".format(compression))
+
+def __open_csv(fn, compression=False):
+    # open a CSV for reading text, decompressing it as a stream if it is 
+    # compressed (pass the compression, if it is known)
+    if compression is False:
+        compression = __compression(fn)
+    if compression is None:
+        return open(fn, "r", encoding="utf-8")
+    return io.TextIOWrapper(__open_compressed(fn, "rb", compression), 
+                            encoding="utf-8")
+
+def __split_lines(text):
+    # split complete lines without any quotes
+    for line in text.split('\n'):
+        # only yield a row if there is content
+        if len(line) > 0:
+            yield [c or None for c in line.split(',')]
+
+def __split_quoted_line(line):
+    # split a complete line with well-formed quoted fields, or return None
+    # if it has to go through the scanner (malformed or multi-line quotes)
+    segments = line.split('"')
+    n = len(segments)
+    if n % 2 == 0:
+        return None
+
+    # the unquoted text before the first quote
+    pieces = segments[0].split(',')
+    if pieces[-1] != '':
+        return None
+    row = [c or None for c in pieces[:-1]]
+
+    k = 1
+    while k < n:
+        column = segments[k]
+        k = k + 1
+        # escaped double quotes
+        while k + 1 < n and segments[k] == '':
+            column = column + '"' + segments[k + 1]
+            k = k + 2
+        row.append(column)
+
+        # the unquoted text after the closing quote
+        rest = segments[k]
+        k = k + 1
+        if rest == '':
+            break
+        if rest[0] != ',':
+            return None
+        pieces = rest[1:].split(',')
+        if k < n:
+            if pieces[-1] != '':
+                return None
+            pieces.pop()
+        row.extend([c or None for c in pieces])
+
+    return row
+
+def __row_generator(f, strict=False, block_size=None):
+    # block-buffered RFC-4180 tokenizer: reads *block_size* characters at a
+    # time and splits runs of unquoted lines in bulk, falling back to a
+    # scanner (that jumps between delimiters) for any line with quotes
+    if block_size is None:
+        block_size = READ_BLOCK_SIZE
 
-def __row_generator(f, strict=False):
     row = [] 
     quote_count = 0
     quoted = False
     column = ""
     any_quotes = False
 
-    ch = f.read(1)
-    while ch != '':
-        # if we are in quoting mode
-        if quoted:
-            # if it's a double quote, toggle
-            if ch == '"':
-                if quote_count == 1:
+    buf = f.read(block_size)
+    while buf != '':
+        i = 0
+        n = len(buf)
+        while i < n:
+            # if we are in quoting mode
+            if quoted:
+                # consume everything up to the next double quote
+                if quote_count == 0:
+                    j = buf.find('"', i)
+                    if j < 0:
+                        column = column + buf[i:]
+                        i = n
+                        continue
+                    column = column + buf[i:j]
+                    quote_count = 1
+                    i = j + 1
+                    if i == n:
+                        continue
+
+                ch = buf[i]
+                i = i + 1
+                # if it's a double quote, it's escaped
+                if ch == '"':
                     quote_count = 0
                     column = column + ch
-                else:
-                    quote_count = 1
-            else:
                 # dangling quote
-                if quote_count == 1:
+                else:
                     # if it's a newline
                     if ch == '\n':
-                        row.append(None) if len(column) == 0 and not any_quotes else row.append(column)
+                        row.append(column if len(column) > 0 or any_quotes 
+                                   else None)
                         yield row
                         row = []
                         column = ""
                         any_quotes = False
                     # if it's a comma
                     elif ch == ',':
-                        row.append(None) if len(column) == 0 and not any_quotes else row.append(column)
+                        row.append(column if len(column) > 0 or any_quotes 
+                                   else None)
                         column = ""
                         any_quotes = False
                     # error, there's an odd number of quotes
-                    else:
-                        if strict:
-                            raise Exception("String found after closing quote.")
-                        else:
-                            pass
+                    elif strict:
+                        raise Exception("String found after closing quote.")
 
                     # clear the quote
                     quote_count = 0
                     quoted = False
-                # append whatever character it is
-                else:
-                    column = column + ch
-        # quote previously seen
-        elif quote_count == 1:
-            # we enter into quoting mode
-            if len(column) == 0:
-                quoted = True
-                # append the character
-                if ch != '"':
-                    quote_count = 0
-                    column = column + ch
-                # if we have another quote, keep track
-                #else:
-                    #quote_count = 1
-            # error, we can't start quoting after existing string
-            else:
+                continue
+
+            # quote previously seen after existing string
+            if quote_count == 1:
                 if strict:
                     raise Exception("String found before opening quote.")
-                else:
+                # every remaining character is discarded
+                while f.read(block_size) != '':
                     pass
-        # if it's a double-quote
-        elif ch == '"':
-            quote_count = 1
-            any_quotes = True
-        # if it's a newline
-        elif ch == '\n':
-            # only yield a row if there is content
-            if len(column) > 0 or len(row) > 0:
-                row.append(None) if len(column) == 0 and not any_quotes else row.append(column)
-                yield row
-            row = []
-            column = ""
-            any_quotes = False
-        # if it's a comma
-        elif ch == ',':
-            row.append(None) if len(column) == 0 and not any_quotes else row.append(column)
-            column = ""
-            any_quotes = False
-        # otherwise
-        else:
-            column = column + ch
+                buf = ''
+                break
+
+            # at the start of a line, split whole lines at once
+            if len(row) == 0 and len(column) == 0 and not any_quotes:
+                k = buf.rfind('\n', i)
+                if k >= i:
+                    q = buf.find('"', i, k)
+                    if q < 0:
+                        yield from __split_lines(buf[i:k])
+                        i = k + 1
+                        continue
+                    e = buf.rfind('\n', i, q)
+                    if e >= i:
+                        yield from __split_lines(buf[i:e])
+                        i = e + 1
+                    e = buf.find('\n', q)
+                    split = __split_quoted_line(buf[i:e])
+                    if split is not None:
+                        yield split
+                        i = e + 1
+                        continue
+
+            # otherwise, consume everything up to the next delimiter
+            m = __DELIMITERS.search(buf, i)
+            if m is None:
+                column = column + buf[i:]
+                i = n
+                continue
+
+            j = m.start()
+            ch = buf[j]
+            column = column + buf[i:j]
+            i = j + 1
+            # if it's a double-quote
+            if ch == '"':
+                any_quotes = True
+                # we enter into quoting mode
+                if len(column) == 0:
+                    quoted = True
+                # error, we can't start quoting after existing string
+                else:
+                    quote_count = 1
+            # if it's a newline
+            elif ch == '\n':
+                # only yield a row if there is content
+                if len(column) > 0 or len(row) > 0:
+                    row.append(column if len(column) > 0 or any_quotes 
+                               else None)
+                    yield row
+                row = []
+                column = ""
+                any_quotes = False
+            # if it's a comma
+            else:
+                row.append(column if len(column) > 0 or any_quotes else None)
+                column = ""
+                any_quotes = False
 
         # top of iteration
-        ch = f.read(1)
+        if buf != '':
+            buf = f.read(block_size)
 
     # if there are any leftovers
     if len(row) > 0:
         if len(column) > 0:
-            row.append(None) if len(column) == 0 and not any_quotes else row.append(column)
+            row.append(column)
         yield row
 
-def get_iterator(db_path, csv_path=SPEC_D_CSV_FILENAME, strict=False):
+def __predicate_tokens(where):
+    # split a predicate into a list of (kind, value) tokens
+    tokens = []
+    position = 0
+    where = where.rstrip()
+    while position < len(where):
+        m = __PREDICATE_TOKEN.match(where, position)
+        if m is None:
+            raise ValueError("Unexpected \"{0}\" in predicate.".format(
+                where[position:].strip()))
+        position = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "number":
+            tokens.append((kind, float(value)))
+        elif kind == "string":
+            q = value[0]
+            tokens.append((kind, value[1:-1].replace(q + q, q)))
+        elif kind == "name" and value.lower() in ("and", "or", "not"):
+            tokens.append(("keyword", value.lower()))
+        elif kind == "quoted_name":
+            tokens.append(("name", value[1:-1]))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+def __parse_predicate(where, header):
+    # parse a predicate into nested tuples of ("or", a, b), ("and", a, b),
+    # ("not", a) and ("compare", column index, operator, value)
+    tokens = __predicate_tokens(where)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def take(kind, value=None):
+        nonlocal position
+        token = peek()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise ValueError("Expected {0} in predicate, found {1}.".format(
+                value if value is not None else 
+                {"name": "a column", "op": "an operator"}.get(kind, kind), 
+                "end" if token[0] is None else "\"{0}\"".format(token[1])))
+        position = position + 1
+        return token[1]
+
+    def disjunction():
+        node = conjunction()
+        while peek() == ("keyword", "or"):
+            take("keyword")
+            node = ("or", node, conjunction())
+        return node
+
+    def conjunction():
+        node = negation()
+        while peek() == ("keyword", "and"):
+            take("keyword")
+            node = ("and", node, negation())
+        return node
+
+    def negation():
+        if peek() == ("keyword", "not"):
+            take("keyword")
+            return ("not", negation())
+        if peek() == ("op", "("):
+            take("op")
+            node = disjunction()
+            take("op", ")")
+            return node
+        name = take("name")
+        if name not in header:
+            raise ValueError("Column \"{0}\" is not in the header.".format(
+                name))
+        op = take("op")
+        if op not in __PREDICATE_OPS:
+            raise ValueError("Expected comparison in predicate, found "
+                             "\"{0}\".".format(op))
+        kind, value = peek()
+        if kind not in ("number", "string"):
+            raise ValueError("Expected a number or string in predicate.")
+        take(kind)
+        return ("compare", header.index(name), op, value)
+
+    node = disjunction()
+    if position != len(tokens):
+        raise ValueError("Unexpected \"{0}\" in predicate.".format(
+            peek()[1]))
+    return node
+
+def __compile_predicate(node):
+    # turn a parsed predicate into a function of a row (list of strings)
+    kind = node[0]
+    if kind == "or":
+        a = __compile_predicate(node[1])
+        b = __compile_predicate(node[2])
+        return lambda row: a(row) or b(row)
+    elif kind == "and":
+        a = __compile_predicate(node[1])
+        b = __compile_predicate(node[2])
+        return lambda row: a(row) and b(row)
+    elif kind == "not":
+        a = __compile_predicate(node[1])
+        return lambda row: not a(row)
+
+    i, op, value = node[1], __PREDICATE_OPS[node[2]], node[3]
+    if isinstance(value, float):
+        def compare(row):
+            try:
+                return op(float(row[i]), value)
+            except (IndexError, TypeError, ValueError):
+                return False
+    else:
+        def compare(row):
+            try:
+                v = row[i]
+            except IndexError:
+                return False
+            return v is not None and op(v, value)
+    return compare
+
+def __selection(fn, strict, columns, where):
+    # read the header, and return (projected header, column indices or 
+    # None, parsed predicate or None), or None on an error
+    with __open_csv(fn) as f:
+        header = next(__row_generator(f, strict), None)
+    if header is None:
+        header = []
+
+    indices = None
+    if columns is not None:
+        indices = []
+        for column in columns:
+            if column not in header:
+                log.error("Column \"{0}\" is not in \"{1}\".".format(
+                    column, fn))
+                return None
+            indices.append(header.index(column))
+
+    node = None
+    if where is not None:
+        try:
+            node = __parse_predicate(where, header)
+        except ValueError as e:
+            log.error("Invalid predicate \"{0}\": {1}".format(where, e))
+            return None
+
+    if indices is None:
+        return (tuple(header), None, node)
+    return (tuple(header[i] for i in indices), indices, node)
+
+def __select_rows(rows, indices, node):
+    # filter and project the rows (lists of strings) to tuples
+    test = __compile_predicate(node) if node is not None else None
+    if indices is None:
+        project = tuple
+    else:
+        getter = operator.itemgetter(*indices)
+        if len(indices) == 1:
+            project = lambda row: (getter(row),)
+        else:
+            project = getter
+    for row in rows:
+        if test is None or test(row):
+            try:
+                yield project(row)
+            except IndexError:
+                yield tuple(row[i] if i < len(row) else None 
+                            for i in indices)
+
+def get_iterator(db_path, csv_path=SPEC_D_CSV_FILENAME, strict=False,
+                 workers=1, columns=None, where=None, follow=False,
+                 from_offset=None, cache=False):
     """
     Return a row iterator, assuming a valid Spec D database. Does
     not validate that it is a proper Spec D database, unless *strict*
@@ -138,12 +542,45 @@ def get_iterator(db_path, csv_path=SPEC_D_CSV_FILENAME, strict=False):
         strict : boolean = False
             enable strict checking mode, and raise an error if it
             does not match RFC-4180
+        workers : integer = 1
+            if greater than 1, split the file into chunks on row boundaries
+            and parse them in a pool of *workers* processes, returning the
+            rows in order (see get_chunks)
+        columns : list of strings = None
+            if not None, only return these columns, in this order
+        where : string = None
+            if not None, only return the rows that match this predicate, 
+            e.g., "time > 10 and phi == 90". A predicate compares columns
+            to numbers or quoted strings with ==, !=, <, <=, > and >=, 
+            combined with and, or, not and parentheses. Column names that 
+            aren't simple words can be quoted with backticks. Comparing to
+            a number is numeric, and values that aren't numbers don't 
+            match. Comparing to a string is textual. Empty values never 
+            match.
+        follow : boolean = False
+            if True, wait for rows to be appended to the file at the end, 
+            and only return complete rows (see Cursor)
+        from_offset : integer = None
+            if not None, only return the complete data rows after this 
+            byte offset, which must be the start of a row, e.g., 
+            Cursor.offset (see get_offset_iterator)
+        cache : boolean = False
+            if True, read the rows from the binary cache, creating it if 
+            it is missing or out of date (see get_cache)
 
     returns:
         an iterator that returns a tuple of data per row if the csv_path 
-        file can be opened, otherwise returns None
+        file can be opened, otherwise returns None (also if *columns* or
+        *where* are invalid)
 
-        the first row will be the header (column identifiers)
+        the first row will be the header (column identifiers), unless 
+        *from_offset* is not None
+
+        if csv_path doesn't exist, but a compressed csv_path does (with an
+        extension in COMPRESSION_EXTS), it is read as a stream, and the
+        number of bytes read and decoded are logged when it has been read
+        (*workers*, *follow* and *from_offset* don't apply to compressed
+        files)
 
     raises:
         an exception during iteration if the file does not match the
@@ -153,19 +590,1005 @@ def get_iterator(db_path, csv_path=SPEC_D_CSV_FILENAME, strict=False):
         properly type the exception as the same exception that csv.reader uses
     """
 
-    fn = os.path.join(db_path, csv_path)
-    if os.path.isfile(fn):
+    fn = __csv_filename(db_path, csv_path)
+    if fn is not None:
+        # rows that don't match and columns that aren't selected are never
+        # made into tuples
+        selection = None
+        if columns is not None or where is not None:
+            selection = __selection(fn, strict, columns, where)
+            if selection is None:
+                return None
+            header, indices, node = selection
+
+        compression = __compression(fn)
+        if compression is not None and \
+           (follow or from_offset is not None):
+            log.error("Can't follow compressed \"{0}\".".format(fn))
+            return None
+        table = get_cache(db_path, csv_path) if cache and not follow and \
+                from_offset is None else None
+        if table is not None:
+            columns = [__uncache_column(c) for c in table[1]]
+            rows = zip(*columns) if len(columns) > 0 else iter(())
+            if selection is None:
+                return chain((table[0],), rows)
+            return chain((header,), __select_rows(rows, indices, node))
+
+        if follow or from_offset is not None:
+            cursor = Cursor(db_path, csv_path, from_offset, strict=strict)
+            if follow:
+                rows = cursor.follow(from_offset is None)
+            else:
+                rows = cursor.rows(from_offset is None)
+            if selection is None:
+                return rows
+            def __selected(rows):
+                if from_offset is None:
+                    next(rows)
+                    yield header
+                yield from __select_rows(rows, indices, node)
+            return __selected(rows)
+
+        chunks = get_chunks(db_path, csv_path, workers) if workers > 1 \
+                 else None
+        if chunks is not None and len(chunks) > 1:
+            if selection is None:
+                tasks = [(fn, start, stop, strict, 0, None, None) 
+                         for start, stop in chunks]
+            else:
+                tasks = [(fn, start, stop, strict, 1 if i == 0 else 0, 
+                          indices, node) 
+                         for i, (start, stop) in enumerate(chunks)]
+            def __parallel(fn):
+                if selection is not None:
+                    yield header
+                # at most 2 chunks per worker are parsed ahead of the 
+                # rows being consumed, so a slow consumer doesn't fill 
+                # the memory with parsed chunks
+                with multiprocessing.Pool(workers) as pool:
+                    pending = deque()
+                    for task in tasks:
+                        if len(pending) >= 2 * workers:
+                            yield from pending.popleft().get()
+                        pending.append(pool.apply_async(__chunk_rows, 
+                                                        (task,)))
+                    while len(pending) > 0:
+                        yield from pending.popleft().get()
+            return __parallel(fn)
+
         # by default the Python CSV reader implements RFC-4180
         # with the exception that it doesn't detect double-quote after
         # comma and white-space (which is an error according to the spec)
         def __wrapped(fn):
-            with open(fn, "r", encoding="utf-8") as f:
-                for row in __row_generator(f, strict):
-                    yield tuple(row)
+            with __open_csv(fn, compression) as f:
+                rows = __row_generator(f, strict)
+                if selection is None:
+                    for row in rows:
+                        yield tuple(row)
+                else:
+                    yield header
+                    next(rows, None)
+                    yield from __select_rows(rows, indices, node)
+                if compression is not None:
+                    log.info("Read {0} bytes and decoded {1} bytes of "
+                             "\"{2}\".".format(os.path.getsize(fn), 
+                                                f.buffer.tell(), fn))
         return __wrapped(fn)
     else:
         return None
 
+def __file_signature(fn):
+    # identify the contents of a file by its size, modification time and 
+    # a hash of its first and last blocks, so that checking it is cheap
+    st = os.stat(fn)
+    h = hashlib.md5()
+    with open(fn, "rb") as f:
+        h.update(f.read(SIGNATURE_BLOCK_SIZE))
+        if st.st_size > SIGNATURE_BLOCK_SIZE:
+            f.seek(max(SIGNATURE_BLOCK_SIZE, 
+                       st.st_size - SIGNATURE_BLOCK_SIZE))
+            h.update(f.read(SIGNATURE_BLOCK_SIZE))
+    return (st.st_size, st.st_mtime_ns, h.digest())
+
+def __has_bare_cr(b, last_cr):
+    # True if the block of bytes has a carriage return that isn't part of
+    # \r\n, where last_cr is True if the previous block ended with \r
+    return (last_cr and b[0] != 10) or \
+           b.count(b'\r') - b.count(b'\r\n') - (1 if b[-1] == 13 else 0) > 0
+
+def __scan_row_offsets(f, block_size=None):
+    # scan a binary CSV file for the byte offsets where rows end, i.e., 
+    # after newlines that are not in quotes and end a line with content;
+    # the first offset is the end of the header. returns None if the file
+    # uses bare carriage returns as newlines
+    if block_size is None:
+        block_size = READ_BLOCK_SIZE
+
+    ends = []
+    in_quotes = False
+    content = False
+    position = 0
+    last_cr = False
+    b = f.read(block_size)
+    while b != b'':
+        # only \n and \r\n newlines are indexed
+        if __has_bare_cr(b, last_cr):
+            return None
+        last_cr = b[-1] == 13
+
+        i = 0
+        n = len(b)
+        while i < n:
+            if in_quotes:
+                j = b.find(b'"', i)
+                if j < 0:
+                    break
+                in_quotes = False
+                i = j + 1
+                continue
+
+            q = b.find(b'"', i)
+            stop = q if q >= 0 else n
+            nl = b.find(b'\n', i, stop)
+            while nl >= 0:
+                if content or nl - i > 1 or (nl - i == 1 and b[i] != 13):
+                    ends.append(position + nl + 1)
+                content = False
+                i = nl + 1
+                nl = b.find(b'\n', i, stop)
+            if stop - i > 1 or (stop - i == 1 and b[i] != 13):
+                content = True
+            if q < 0:
+                break
+            content = True
+            in_quotes = True
+            i = q + 1
+
+        position = position + n
+        b = f.read(block_size)
+
+    # a trailing row without a newline is only a row if the tokenizer 
+    # thinks so
+    if content or in_quotes:
+        start = ends[-1] if len(ends) > 0 else 0
+        f.seek(start)
+        text = io.TextIOWrapper(f, encoding="utf-8")
+        if len(list(__row_generator(text))) > 0:
+            ends.append(position)
+        text.detach()
+    return ends
+
+def __index_filename(db_path, csv_path):
+    return os.path.join(db_path, csv_path + INDEX_EXT)
+
+def __read_index(db_path, csv_path, signature):
+    # read the row offsets from the index, if it matches the signature
+    try:
+        with open(__index_filename(db_path, csv_path), "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None
+            size, mtime, n = struct.unpack("<QqQ", f.read(24))
+            digest = f.read(16)
+            if (size, mtime, digest) != signature:
+                return None
+            offsets = array("Q")
+            offsets.fromfile(f, n)
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            return offsets
+    except Exception:
+        return None
+
+def __write_index(db_path, csv_path, signature, offsets):
+    # write the row offsets, atomically replacing an old index
+    fn = __index_filename(db_path, csv_path)
+    tmp = fn + "." + str(os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack("<QqQ", signature[0], signature[1], 
+                                len(offsets)))
+            f.write(signature[2])
+            if sys.byteorder != "little":
+                offsets = array("Q", offsets)
+                offsets.byteswap()
+            offsets.tofile(f)
+        os.replace(tmp, fn)
+        return True
+    except Exception as e:
+        log.warning("Unable to write row index \"{0}\": {1}".format(fn, e))
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        return False
+
+def get_row_index(db_path, csv_path=SPEC_D_CSV_FILENAME, rebuild=False):
+    """
+    Return the byte offsets of the rows in a Spec D database. The offsets 
+    are kept in an index file next to the CSV (csv_path + INDEX_EXT), which 
+    is rebuilt if the size, modification time or hash of the CSV has 
+    changed. Quoted fields are accounted for, assuming the CSV adheres to 
+    RFC-4180.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        rebuild : boolean = False
+            if True, always rebuild the index
+
+    returns:
+        an array of unsigned integers, where element n is the byte offset 
+        of the data row n (0-based, not counting the header) and the last
+        element is the end of the last row, or None if the csv_path file
+        can't be opened or indexed (the CSV is compressed or uses bare 
+        carriage returns as newlines)
+
+    side effects:
+        writes out an index file at csv_path + INDEX_EXT if it is missing 
+        or out of date
+    """
+
+    fn = os.path.join(db_path, csv_path)
+    if not os.path.isfile(fn):
+        return None
+    if __compression(fn) is not None:
+        log.warning("Unable to index compressed \"{0}\".".format(fn))
+        return None
+
+    try:
+        signature = __file_signature(fn)
+        if not rebuild:
+            offsets = __read_index(db_path, csv_path, signature)
+            if offsets is not None:
+                return offsets
+
+        log.info("Indexing rows of \"{0}\".".format(fn))
+        with open(fn, "rb") as f:
+            ends = __scan_row_offsets(f)
+        if ends is None:
+            log.warning("Unable to index \"{0}\", it has bare carriage "
+                        "returns.".format(fn))
+            return None
+        offsets = array("Q", ends)
+        log.info("Indexed {0} rows.".format(max(0, len(offsets) - 1)))
+
+        # only keep the index if the file didn't change while we read it
+        if signature == __file_signature(fn):
+            __write_index(db_path, csv_path, signature, offsets)
+        return offsets
+    except Exception as e:
+        log.error("Error indexing \"{0}\": {1}".format(fn, e))
+        return None
+
+def __offset_rows(fn, start, stop, strict=False):
+    # tokenize the rows between the byte offsets start and stop
+    with open(fn, "rb") as f:
+        f.seek(start)
+        text = io.TextIOWrapper(f, encoding="utf-8")
+        for row in __row_generator(text, strict, 
+                                   max(1, min(READ_BLOCK_SIZE, stop - start))):
+            yield tuple(row)
+
+def get_row(db_path, n, csv_path=SPEC_D_CSV_FILENAME, strict=False):
+    """
+    Return a row from a Spec D database, by seeking to it using the row 
+    index (see get_row_index).
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        n : integer
+            0-based index of the data row (not counting the header), 
+            negative indices count from the end
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        strict : boolean = False
+            enable strict checking mode, and raise an error if it
+            does not match RFC-4180
+
+    returns:
+        a tuple of data for the row, or None if the row doesn't exist or
+        the csv_path file can't be opened
+
+    side effects:
+        writes out an index file, if it is missing or out of date
+    """
+
+    offsets = get_row_index(db_path, csv_path)
+    if offsets is None:
+        return None
+    n_rows = max(0, len(offsets) - 1)
+    if n < 0:
+        n = n + n_rows
+    if n < 0 or n >= n_rows:
+        return None
+
+    for row in __offset_rows(os.path.join(db_path, csv_path), 
+                             offsets[n], offsets[n + 1], strict):
+        return row
+    return None
+
+def get_rows(db_path, start, stop, csv_path=SPEC_D_CSV_FILENAME, 
+             strict=False):
+    """
+    Return an iterator over a range of rows from a Spec D database, by 
+    seeking to the first row using the row index (see get_row_index). 
+    *start* and *stop* behave like a Python slice.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        start : integer
+            0-based index of the first data row (not counting the header)
+        stop : integer
+            0-based index of the data row after the last one
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        strict : boolean = False
+            enable strict checking mode, and raise an error if it
+            does not match RFC-4180
+
+    returns:
+        an iterator that returns a tuple of data per row, or None if the 
+        csv_path file can't be opened (there is no header row)
+
+    side effects:
+        writes out an index file, if it is missing or out of date
+    """
+
+    offsets = get_row_index(db_path, csv_path)
+    if offsets is None:
+        return None
+    start, stop, step = slice(start, stop).indices(max(0, len(offsets) - 1))
+    if start >= stop:
+        return iter(())
+    return islice(__offset_rows(os.path.join(db_path, csv_path), 
+                                offsets[start], offsets[stop], strict),
+                  stop - start)
+
+def get_reverse_iterator(db_path, csv_path=SPEC_D_CSV_FILENAME, 
+                         strict=False):
+    """
+    Return a row iterator that returns the rows from last to first, by 
+    reading the CSV backwards in blocks using the row index (see 
+    get_row_index). Does not validate that it is a proper Spec D database.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        strict : boolean = False
+            enable strict checking mode, and raise an error if it
+            does not match RFC-4180
+
+    returns:
+        an iterator that returns a tuple of data per row if the csv_path 
+        file can be opened, otherwise returns None
+
+        the first row will be the header (column identifiers), followed
+        by the data rows in reverse order
+
+    side effects:
+        writes out an index file, if it is missing or out of date
+    """
+
+    offsets = get_row_index(db_path, csv_path)
+    if offsets is None:
+        return None
+
+    fn = os.path.join(db_path, csv_path)
+    def __reversed(fn):
+        if len(offsets) == 0:
+            return
+        for row in __offset_rows(fn, 0, offsets[0], strict):
+            yield row
+            break
+        stop = len(offsets) - 1
+        while stop > 0:
+            start = min(stop - 1, bisect_left(offsets, 
+                offsets[stop] - READ_BLOCK_SIZE, 0, stop))
+            rows = list(islice(__offset_rows(fn, offsets[start], 
+                                             offsets[stop], strict),
+                               stop - start))
+            rows.reverse()
+            yield from rows
+            stop = start
+    return __reversed(fn)
+
+def __remove_sidecars(db_path, csv_path):
+    # remove the index, cache, checkpoint and SQLite3 sidecar of a CSV 
+    # that has been rewritten
+    for ext in (INDEX_EXT, CACHE_EXT, CHECKPOINT_EXT, SQLITE3_EXT):
+        fn = os.path.join(db_path, csv_path + ext)
+        if os.path.exists(fn):
+            os.unlink(fn)
+
+def __cache_column(values):
+    # convert a column of strings (or None) to a (kind, numbers, strings, 
+    # mask) tuple. kind is the type of the whole column, as get_columns 
+    # types it: "q" (int64) or "d" (float64), where numbers are the packed
+    # numbers (0 and NaN for empty values), "s" if it is text and "e" if 
+    # every value is empty, where numbers are empty. strings are the 
+    # values joined by NUL (or a tuple if a value has a NUL), and mask is
+    # bytes that are 1 for empty values
+    mask = bytes(v is None for v in values)
+    strings = [v if v is not None else "" for v in values]
+    if any("\0" in v for v in strings):
+        strings = tuple(values)
+    else:
+        strings = "\0".join(strings)
+
+    present = [v for v in values if v is not None]
+    if len(present) == 0:
+        return ("e", b'', strings, mask)
+    try:
+        numbers = [int(v) for v in present]
+        if min(numbers) >= -(1 << 63) and max(numbers) < (1 << 63):
+            data = array("q", [int(v) if v is not None else 0 
+                               for v in values])
+            return ("q", data.tobytes(), strings, mask)
+    except ValueError:
+        pass
+    try:
+        data = array("d", [float(v) if v is not None else float("nan") 
+                           for v in values])
+        return ("d", data.tobytes(), strings, mask)
+    except ValueError:
+        pass
+    return ("s", b'', strings, mask)
+
+def __uncache_column(column):
+    # return the list of strings (or None) of a cached column
+    kind, numbers, strings, mask = column
+    if not isinstance(strings, str):
+        return list(strings)
+    if len(mask) == 0:
+        return []
+    values = strings.split("\0")
+    i = mask.find(1)
+    while i >= 0:
+        values[i] = None
+        i = mask.find(1, i + 1)
+    return values
+
+def __pack_bytes(b):
+    # a length prefixed byte string
+    return struct.pack("<Q", len(b)) + b
+
+def __unpack_bytes(b, offset):
+    # return (the length prefixed byte string at offset, the offset after
+    # it)
+    n = struct.unpack_from("<Q", b, offset)[0]
+    offset = offset + 8
+    if offset + n > len(b):
+        raise ValueError("truncated cache")
+    return (b[offset:offset + n], offset + n)
+
+def __read_cache(db_path, csv_path, signature):
+    # read the (header, columns) from the cache, if it matches the 
+    # signature. the cache is only data (lengths, packed little endian 
+    # numbers and UTF-8 strings), that is checked as it is read
+    try:
+        with open(os.path.join(db_path, csv_path + CACHE_EXT), "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            size, mtime = struct.unpack("<Qq", f.read(16))
+            digest = f.read(16)
+            if (size, mtime, digest) != signature:
+                return None
+            b = f.read()
+
+        n_columns, n_rows = struct.unpack_from("<QQ", b, 0)
+        offset = 16
+        header = []
+        for i in range(0, n_columns):
+            name, offset = __unpack_bytes(b, offset)
+            header.append(name.decode("utf-8"))
+        columns = []
+        for i in range(0, n_columns):
+            kind = b[offset:offset + 2].decode("ascii")
+            numbers, offset = __unpack_bytes(b, offset + 2)
+            strings, offset = __unpack_bytes(b, offset)
+            mask, offset = __unpack_bytes(b, offset)
+            if kind[0] not in "qdse" or len(mask) != n_rows or \
+               len(numbers) != (8 * n_rows if kind[0] in "qd" else 0):
+                return None
+            if sys.byteorder != "little" and kind[0] in "qd":
+                data = array(kind[0], numbers)
+                data.byteswap()
+                numbers = data.tobytes()
+            strings = strings.decode("utf-8")
+            if kind[1] == "t":
+                # values with a NUL, as their lengths and the values 
+                # concatenated
+                lengths, offset = __unpack_bytes(b, offset)
+                lengths = array("q", lengths)
+                if sys.byteorder != "little":
+                    lengths.byteswap()
+                if len(lengths) != n_rows or sum(lengths) != len(strings):
+                    return None
+                values = []
+                start = 0
+                for n, m in zip(lengths, mask):
+                    values.append(strings[start:start + n] if m == 0 
+                                  else None)
+                    start = start + n
+                strings = tuple(values)
+            elif strings.count("\0") + 1 != max(n_rows, 1):
+                return None
+            columns.append((kind[0], numbers, strings, mask))
+        if offset != len(b):
+            return None
+        return (tuple(header), columns)
+    except Exception:
+        return None
+
+def __write_cache(db_path, csv_path, signature, header, columns):
+    # write the (header, columns), atomically replacing an old cache
+    fn = os.path.join(db_path, csv_path + CACHE_EXT)
+    tmp = fn + "." + str(os.getpid())
+    try:
+        n_rows = len(columns[0][3]) if len(columns) > 0 else 0
+        with open(tmp, "wb") as f:
+            f.write(CACHE_MAGIC)
+            f.write(struct.pack("<Qq", signature[0], signature[1]))
+            f.write(signature[2])
+            f.write(struct.pack("<QQ", len(header), n_rows))
+            for name in header:
+                f.write(__pack_bytes(name.encode("utf-8")))
+            for kind, numbers, strings, mask in columns:
+                if sys.byteorder != "little" and kind in "qd":
+                    data = array(kind, numbers)
+                    data.byteswap()
+                    numbers = data.tobytes()
+                joined = isinstance(strings, str)
+                f.write((kind + ("j" if joined else "t")).encode("ascii"))
+                f.write(__pack_bytes(numbers))
+                if joined:
+                    f.write(__pack_bytes(strings.encode("utf-8")))
+                    f.write(__pack_bytes(mask))
+                else:
+                    values = [v if v is not None else "" for v in strings]
+                    lengths = array("q", [len(v) for v in values])
+                    if sys.byteorder != "little":
+                        lengths.byteswap()
+                    f.write(__pack_bytes("".join(values).encode("utf-8")))
+                    f.write(__pack_bytes(mask))
+                    f.write(__pack_bytes(lengths.tobytes()))
+        os.replace(tmp, fn)
+        return True
+    except Exception as e:
+        log.warning("Unable to write cache \"{0}\": {1}".format(fn, e))
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        return False
+
+def get_cache(db_path, csv_path=SPEC_D_CSV_FILENAME, rebuild=False):
+    """
+    Return the parsed and typed table of a Spec D database from a binary
+    cache next to the CSV (csv_path + CACHE_EXT). The cache is rebuilt if 
+    the size, modification time or hash of the CSV has changed (the hash
+    is of the first and last blocks of the CSV). The values are stored as 
+    strings, and integer and float columns (typed by the whole column, as
+    get_columns types them) are also stored as packed arrays, so that 
+    get_columns doesn't convert them again. The cache only has data, 
+    that is checked as it is read, and can't run code.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        rebuild : boolean = False
+            if True, always rebuild the cache
+
+    returns:
+        a tuple of (header, list of columns), where each column is a tuple
+        of (kind, numbers, strings, mask). kind is "q" if numbers are the 
+        bytes of int64 (0 for empty values), "d" if they are the bytes of 
+        float64 (NaN for empty values), "s" if the column is text, or "e"
+        if every value is empty (there aren't any numbers for "s" and 
+        "e"). strings are the values joined by NUL (or a tuple of the 
+        values), and mask is bytes that are 1 for empty values. 
+        returns None if the csv_path file can't be opened or cached (it 
+        isn't valid RFC-4180, or the rows have an unequal number of 
+        columns)
+
+    side effects:
+        writes out a cache file at csv_path + CACHE_EXT if it is missing 
+        or out of date
+    """
+
+    fn = __csv_filename(db_path, csv_path)
+    if fn is None:
+        return None
+
+    try:
+        signature = __file_signature(fn)
+        if not rebuild:
+            table = __read_cache(db_path, csv_path, signature)
+            if table is not None:
+                return table
+
+        log.info("Caching \"{0}\".".format(fn))
+        rows = list(get_iterator(db_path, csv_path, True))
+        if len(rows) == 0:
+            return None
+        header = rows[0]
+        if any(len(row) != len(header) for row in rows):
+            log.warning("Unable to cache \"{0}\", the rows have an unequal "
+                        "number of columns.".format(fn))
+            return None
+        columns = [__cache_column(values) 
+                   for values in zip(*rows[1:])] if len(rows) > 1 else \
+                  [("e", b'', "", b'') for column in header]
+        del rows
+
+        # only keep the cache if the file didn't change while we read it
+        if signature == __file_signature(fn):
+            __write_cache(db_path, csv_path, signature, header, columns)
+        return (header, columns)
+    except Exception as e:
+        log.warning("Unable to cache \"{0}\": {1}".format(fn, e))
+        return None
+
+def __update_digest(fn, start, stop, md5=None):
+    # update (or create) an MD5 with the bytes between the offsets start
+    # and stop
+    md5 = hashlib.md5() if md5 is None else md5
+    with open(fn, "rb") as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            b = f.read(min(READ_BLOCK_SIZE, remaining))
+            if len(b) == 0:
+                break
+            md5.update(b)
+            remaining = remaining - len(b)
+    return md5
+
+def __read_checkpoint(db_path, csv_path):
+    # read the checkpoint (offset, digest, next row number, number of 
+    # files, types, file verification), or None
+    try:
+        with open(os.path.join(db_path, csv_path + CHECKPOINT_EXT), 
+                  "rb") as f:
+            if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+                return None
+            checkpoint = json.loads(f.read().decode("utf-8"))
+        types = [str(t) for t in checkpoint["types"]]
+        if any(t not in __TYPE_ORDER for t in types) or \
+           checkpoint["verify"] not in __VERIFY_ORDER:
+            return None
+        return (int(checkpoint["offset"]), 
+                bytes.fromhex(checkpoint["digest"]), 
+                int(checkpoint["rows"]), int(checkpoint["files"]), types,
+                checkpoint["verify"])
+    except Exception:
+        return None
+
+def __write_checkpoint(db_path, csv_path, checkpoint):
+    # write the checkpoint, atomically replacing an old one
+    fn = os.path.join(db_path, csv_path + CHECKPOINT_EXT)
+    tmp = fn + "." + str(os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(CHECKPOINT_MAGIC)
+            f.write(json.dumps({"offset": checkpoint[0], 
+                                "digest": checkpoint[1].hex(),
+                                "rows": checkpoint[2], 
+                                "files": checkpoint[3],
+                                "types": list(checkpoint[4]),
+                                "verify": checkpoint[5]}).encode(
+                                    "utf-8"))
+        os.replace(tmp, fn)
+        return True
+    except Exception as e:
+        log.warning("Unable to write checkpoint \"{0}\": {1}".format(fn, e))
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        return False
+
+def __last_row_end(b):
+    # return the index after the last newline in the bytes that isn't in 
+    # quotes, assuming b starts on a row boundary, or 0 if there is none
+    k = b.rfind(b'\n')
+    after = b.count(b'"', k) if k >= 0 else 0
+    total = after + (b.count(b'"', 0, k) if k >= 0 else 0)
+    while k >= 0 and (total - after) % 2 == 1:
+        j = b.rfind(b'\n', 0, k)
+        after = after + b.count(b'"', max(j, 0), k)
+        k = j
+    return k + 1
+
+def get_offset_iterator(db_path, offset=0, csv_path=SPEC_D_CSV_FILENAME,
+                        strict=False):
+    """
+    Return an iterator over the complete rows after a byte offset in a 
+    Spec D CSV, along with the byte offset after each row, which can be
+    used to resume reading later. A row is complete if it ends with a 
+    newline that isn't in quotes, so that a partially written last row is 
+    left for later. The CSV must use \\n or \\r\\n newlines.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        offset : integer = 0
+            byte offset to start reading, which must be the start of a row,
+            e.g., 0 or an offset returned by a previous iteration
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        strict : boolean = False
+            enable strict checking mode, and raise an error if it
+            does not match RFC-4180
+
+    returns:
+        an iterator that returns a tuple of (tuple of data for the row, 
+        byte offset after the row) if the csv_path file can be opened 
+        and isn't compressed, otherwise returns None
+
+        the first row will be the header if *offset* is 0
+    """
+
+    fn = os.path.join(db_path, csv_path)
+    if not os.path.isfile(fn) or __compression(fn) is not None:
+        return None
+
+    def __complete(fn, offset):
+        with open(fn, "rb") as f:
+            f.seek(offset)
+            buffer = b''
+            while True:
+                b = f.read(READ_BLOCK_SIZE)
+                if b == b'':
+                    return
+                buffer = buffer + b
+                k = __last_row_end(buffer)
+                if k == 0:
+                    continue
+                chunk = buffer[:k]
+                buffer = buffer[k:]
+
+                rows = list(__row_generator(
+                    io.StringIO(chunk.decode("utf-8"), newline=None), strict))
+                ends = __scan_row_offsets(io.BytesIO(chunk))
+                if ends is None or len(ends) != len(rows):
+                    # not RFC-4180, so resume after the chunk
+                    ends = [len(chunk)] * len(rows)
+                for row, end in zip(rows, ends):
+                    yield (tuple(row), offset + end)
+                offset = offset + k
+    return __complete(fn, offset)
+
+class Cursor(object):
+    """
+    A resumable position in a Spec D CSV, for reading the rows that are 
+    appended to it, e.g., by a running simulation. Only complete rows are
+    read (see get_offset_iterator). The position can be saved, by keeping 
+    *offset* and *n_rows*, and restored by passing them to the 
+    constructor.
+
+    attributes:
+        db_path : string
+            POSIX path to Cinema database
+        csv_path : string
+            POSIX relative path to Cinema CSV
+        offset : integer
+            byte offset after the last row read, or None if the header
+            hasn't been read
+        n_rows : integer
+            the number of data rows read
+        header : tuple of strings
+            the header, or None if it hasn't been read
+        strict : boolean
+            enable strict checking mode, and raise an error if it
+            does not match RFC-4180
+    """
+
+    def __init__(self, db_path, csv_path=SPEC_D_CSV_FILENAME, offset=None,
+                 n_rows=0, strict=False):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self.offset = offset
+        self.n_rows = n_rows
+        self.header = None
+        self.strict = strict
+
+    def __iter__(self):
+        return self.rows()
+
+    def rows(self, header=False):
+        """
+        Return an iterator over the complete data rows after the cursor,
+        advancing it as the rows are returned. Stops at the end of the 
+        file. If the file is shorter than the cursor, it was rewritten, and
+        it is read from the start.
+
+        arguments:
+            header : boolean = False
+                if True, and the header hasn't been read, return it first
+        """
+
+        fn = os.path.join(self.db_path, self.csv_path)
+        if not os.path.isfile(fn):
+            return
+        if self.offset is not None and os.path.getsize(fn) < self.offset:
+            log.warning("\"{0}\" is shorter than the cursor, reading it "
+                        "from the start.".format(fn))
+            self.offset = None
+            self.n_rows = 0
+
+        rows = get_offset_iterator(self.db_path, 0, self.csv_path, 
+                                   self.strict)
+        if rows is None:
+            log.error("Unable to read rows from \"{0}\".".format(fn))
+            return
+
+        if self.offset is None:
+            for row, end in rows:
+                self.header = row
+                self.offset = end
+                break
+            if self.offset is None:
+                return
+            if header:
+                yield self.header
+        elif self.header is None:
+            self.header = next(get_iterator(self.db_path, self.csv_path, 
+                                            self.strict), None)
+
+        for row, end in get_offset_iterator(self.db_path, self.offset, 
+                                            self.csv_path, self.strict):
+            self.offset = end
+            self.n_rows = self.n_rows + 1
+            yield row
+
+    def follow(self, header=False, poll_interval=FOLLOW_POLL_INTERVAL, 
+               timeout=None):
+        """
+        Return an iterator over the data rows after the cursor, like rows,
+        that waits for new rows to be appended at the end of the file.
+
+        arguments:
+            header : boolean = False
+                if True, and the header hasn't been read, return it first
+            poll_interval : float = FOLLOW_POLL_INTERVAL
+                seconds to wait before checking the file for new rows
+            timeout : float = None
+                if not None, stop after this many seconds without new rows
+        """
+
+        last = time.time()
+        while True:
+            for row in self.rows(header):
+                last = time.time()
+                yield row
+            if timeout is not None and time.time() - last >= timeout:
+                return
+            time.sleep(poll_interval)
+
+def __chunk_boundaries(f, chunk_size, block_size=None):
+    # find the byte offsets that split a binary CSV file into chunks of 
+    # about chunk_size bytes, on newlines preceded by an even number of 
+    # quotes. returns None if the file uses bare carriage returns
+    if block_size is None:
+        block_size = READ_BLOCK_SIZE
+
+    bounds = [0]
+    target = chunk_size
+    position = 0
+    quotes = 0
+    last_cr = False
+    b = f.read(block_size)
+    while b != b'':
+        if __has_bare_cr(b, last_cr):
+            return None
+        last_cr = b[-1] == 13
+
+        n = len(b)
+        i = 0
+        q = quotes
+        while target < position + n:
+            j = max(i, target - position)
+            q = q + b.count(b'"', i, j)
+            nl = b.find(b'\n', j)
+            while nl >= 0:
+                q = q + b.count(b'"', j, nl)
+                j = nl
+                if q % 2 == 0:
+                    break
+                nl = b.find(b'\n', j + 1)
+            if nl < 0:
+                break
+            i = nl + 1
+            bounds.append(position + i)
+            target = position + i + chunk_size
+        quotes = quotes + b.count(b'"')
+        position = position + n
+        b = f.read(block_size)
+
+    if bounds[-1] == position and len(bounds) > 1:
+        bounds.pop()
+    return bounds
+
+def get_chunks(db_path, csv_path=SPEC_D_CSV_FILENAME, workers=1):
+    """
+    Split a Spec D CSV into byte ranges that start and end on row 
+    boundaries, for parsing in parallel. The chunks are about 
+    *size / (4 * workers)* bytes, but no smaller than 
+    PARALLEL_MIN_CHUNK_SIZE and no bigger than PARALLEL_CHUNK_SIZE. The 
+    boundaries come from the row index, if there is a current one (see 
+    get_row_index), otherwise by scanning the file, assuming it adheres to 
+    RFC-4180. The first chunk includes the header.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        workers : integer = 1
+            number of processes that will parse the chunks
+
+    returns:
+        a list of (start, stop) byte offsets, or None if the csv_path file 
+        can't be opened or split (the CSV is compressed or uses bare 
+        carriage returns as newlines)
+    """
+
+    fn = os.path.join(db_path, csv_path)
+    if not os.path.isfile(fn) or __compression(fn) is not None:
+        return None
+
+    try:
+        signature = __file_signature(fn)
+        size = signature[0]
+        chunk_size = max(PARALLEL_MIN_CHUNK_SIZE, 
+                         min(PARALLEL_CHUNK_SIZE, 
+                             -(-size // (4 * max(1, workers)))))
+
+        offsets = __read_index(db_path, csv_path, signature)
+        if offsets is not None:
+            bounds = [0]
+            while True:
+                k = bisect_left(offsets, bounds[-1] + chunk_size)
+                if k >= len(offsets) - 1:
+                    break
+                bounds.append(offsets[k])
+        else:
+            with open(fn, "rb") as f:
+                bounds = __chunk_boundaries(f, chunk_size)
+            if bounds is None:
+                return None
+        return list(zip(bounds, bounds[1:] + [size]))
+    except Exception as e:
+        log.error("Error splitting \"{0}\": {1}".format(fn, e))
+        return None
+
+def __chunk_lists(fn, start, stop, strict=False, skip=0):
+    # tokenize the rows between the byte offsets start and stop, which 
+    # must be row boundaries, skipping the first *skip* rows
+    with open(fn, "rb") as f:
+        f.seek(start)
+        text = io.StringIO(f.read(stop - start).decode("utf-8"), 
+                           newline=None)
+    return islice(__row_generator(text, strict), skip, None)
+
+def __chunk_iterator(fn, start, stop, strict=False, skip=0):
+    for row in __chunk_lists(fn, start, stop, strict, skip):
+        yield tuple(row)
+
+def __chunk_rows(task):
+    # process pool worker for get_iterator, which filters and projects 
+    # the rows before sending them back
+    fn, start, stop, strict, skip, indices, node = task
+    rows = __chunk_lists(fn, start, stop, strict, skip)
+    if indices is None and node is None:
+        return [tuple(row) for row in rows]
+    return list(__select_rows(rows, indices, node))
+
 def typecheck(values, nans=[]):
     """
     Return a tuple of Spec D types given an iterator of strings.
@@ -212,50 +1635,992 @@ def typematch(row, types):
          new list of types, updated if one was TYPE_EMPTY in header)
 
     """
-    new_types = typecheck(row)
-    def pick_fixed_from_empty(a, b):
-        if a == TYPE_EMPTY and b != TYPE_EMPTY:
-            return b
-        else:
-            return a
-    new_types = [pick_fixed_from_empty(i, j) for i, j in zip(types, new_types)]
-
-    return (reduce(lambda x, y: x and y, 
-                   [(t == TYPE_EMPTY) or 
-                   (t == h) or (v.lower() == "nan" and h == TYPE_STRING)
-                    for v, t, h in zip(row, typecheck(row), new_types)],
-                   True),
-            reduce(lambda x, y: x or y[0] != y[1],
-                   zip(types, new_types), False),
+    row_types = typecheck(row)
+    new_types = [b if a == TYPE_EMPTY and b != TYPE_EMPTY else a
+                 for a, b in zip(types, row_types)]
+
+    return (all((t == TYPE_EMPTY) or
+                (t == h) or (v.lower() == "nan" and h == TYPE_STRING)
+                for v, t, h in zip(row, row_types, new_types)),
+            any(a != b for a, b in zip(types, new_types)),
             types,
             new_types)
 
 
-def is_file_column(column):
-    if len(column) < 4:
-        return False
-    else:
-        return (column[:4] == FILE_HEADER_KEYWORD)
+def is_file_column(column):
+    if len(column) < 4:
+        return False
+    else:
+        return (column[:4] == FILE_HEADER_KEYWORD)
+
+
+def file_columns(header):
+    """
+    Given a header row, return the list of FILE column indices. Does
+    not validate that they are in the right order, nor does it validate
+    rows if they are strings or files.
+
+    arguments:
+        row : iterator of header identifiers
+
+    returns:
+        tuple of column indices that are FILEs
+    """
+
+    return [i for i, h in zip(range(0, len(header)), header) if
+            is_file_column(h)]
+
+class FileListing(object):
+    """
+    Check if files in a database exist by listing each directory they
+    are in once, rather than a stat call per file. isfile(path) is the
+    same as os.path.isfile(os.path.join(db_path, path)), but a file that
+    is listed is a set lookup. A file that isn't listed is checked with
+    os.path.isfile, in case the directory can't be listed or the path
+    isn't spelled the same as the listing (e.g., on a case insensitive
+    file system).
+
+    check(paths) checks many files in parallel, and can also verify that
+    they aren't empty or can be read.
+
+    attributes:
+        db_path : string
+            POSIX path to Cinema database
+        workers : integer
+            number of threads to list directories with
+        n_directories : integer
+            number of directories listed
+        n_checks : integer
+            number of files checked
+        n_stats : integer
+            number of files checked with a stat call
+    """
+
+    def __init__(self, db_path, workers=LIST_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self.directories = {}
+        self.n_directories = 0
+        self.n_checks = 0
+        self.n_stats = 0
+        self.checked = {}
+
+    def __names(self, directory):
+        # the set of file names in a directory, or None if it can't be 
+        # listed
+        try:
+            with os.scandir(os.path.join(self.db_path, directory)) as it:
+                return frozenset(e.name for e in it if e.is_file())
+        except OSError:
+            return None
+
+    def list(self, paths):
+        """
+        List the directories of *paths* that haven't been listed, in 
+        parallel with *workers* threads.
+
+        arguments:
+            paths : iterator of strings
+                POSIX relative paths of files in the database
+        """
+
+        directories = set(os.path.dirname(p) for p in paths).difference(
+            self.directories)
+        if len(directories) == 0:
+            return
+        directories = sorted(directories)
+        if self.workers > 1 and len(directories) > 1:
+            with multiprocessing.pool.ThreadPool(
+                    min(self.workers, len(directories))) as pool:
+                names = pool.map(self.__names, directories)
+        else:
+            names = [self.__names(i) for i in directories]
+        self.directories.update(zip(directories, names))
+        self.n_directories = self.n_directories + len(directories)
+
+    def isfile(self, path):
+        """
+        Return True if *path* is a file in the database, like
+        os.path.isfile.
+
+        arguments:
+            path : string
+                POSIX relative path of a file in the database
+        """
+
+        self.n_checks = self.n_checks + 1
+        self.list((path,))
+        if self.__listed(path):
+            return True
+        self.n_stats = self.n_stats + 1
+        return os.path.isfile(os.path.join(self.db_path, path))
+
+    def __listed(self, path):
+        # True if path is in the listing of its directory
+        directory, name = os.path.split(path)
+        names = self.directories.get(directory)
+        return names is not None and name in names
+
+    def __verify(self, path, verify=None):
+        # check a file with a stat call, returns None or the reason it
+        # failed
+        fn = os.path.join(self.db_path, path)
+        try:
+            st = os.stat(fn)
+        except (OSError, ValueError):
+            return "is missing"
+        if not stat.S_ISREG(st.st_mode):
+            return "is missing"
+        if verify is None:
+            return None
+        if st.st_size == 0:
+            return "is empty"
+        if verify == VERIFY_CHECKSUM:
+            try:
+                md5 = hashlib.md5()
+                with open(fn, "rb") as f:
+                    for b in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+                        md5.update(b)
+            except OSError as e:
+                return "can't be read ({0})".format(e)
+        return None
+
+    def check(self, paths, verify=None):
+        """
+        Check files in parallel, with *workers* threads for the files 
+        that need a stat call. The results are also kept until the next 
+        call to check, to be returned by error.
+
+        arguments:
+            paths : iterator of strings
+                POSIX relative paths of files in the database
+            verify : string = None
+                if VERIFY_SIZE, also check that the files aren't empty,
+                or if VERIFY_CHECKSUM, that they aren't empty and can
+                be read through (computing an MD5). Either needs a stat 
+                call per file
+
+        returns:
+            list of None if the file is OK, or the reason it isn't, e.g.,
+            "is missing", in the same order as paths
+        """
+
+        if verify not in (None, VERIFY_SIZE, VERIFY_CHECKSUM):
+            raise ValueError("Unknown file verification \"{0}\".".format(
+                verify))
+        paths = list(paths)
+        results = [None] * len(paths)
+        if verify is None:
+            self.list(paths)
+            todo = [i for i, p in enumerate(paths) if not self.__listed(p)]
+        else:
+            todo = list(range(0, len(paths)))
+        self.n_checks = self.n_checks + len(paths)
+        self.n_stats = self.n_stats + len(todo)
+
+        if self.workers > 1 and len(todo) > 1:
+            with multiprocessing.pool.ThreadPool(
+                    min(self.workers, len(todo))) as pool:
+                errors = pool.map(partial(self.__verify, verify=verify), 
+                                  [paths[i] for i in todo])
+        else:
+            errors = [self.__verify(paths[i], verify) for i in todo]
+        for i, e in zip(todo, errors):
+            results[i] = e
+        self.checked = dict(zip(paths, results))
+        return results
+
+    def error(self, path, verify=None):
+        """
+        Return None if the file *path* is OK, or the reason it isn't. 
+        Uses the results of the last call to check if *path* was in it.
+
+        arguments:
+            path : string
+                POSIX relative path of a file in the database
+            verify : string = None
+                see check
+        """
+
+        if path in self.checked:
+            return self.checked[path]
+        if verify is None:
+            return None if self.isfile(path) else "is missing"
+        self.n_checks = self.n_checks + 1
+        self.n_stats = self.n_stats + 1
+        return self.__verify(path, verify)
+
+    def stats_avoided(self):
+        """
+        Return the number of stat calls avoided, i.e., the number of files
+        checked less the number of directories listed and stat calls, or 0
+        if listing the directories took more calls than it saved.
+        """
+
+        return max(0, self.n_checks - self.n_directories - self.n_stats)
+
+    def report(self):
+        """
+        Log the number of stat calls avoided.
+        """
+
+        if self.n_checks > 0:
+            log.info("Checked {0} files with {1} directory listings and "
+                     "{2} stat calls, {3} stat calls avoided.".format(
+                     self.n_checks, self.n_directories, self.n_stats, 
+                     self.stats_avoided()))
+
+
+# promotion order of column types, as the columns are read
+__TYPE_ORDER = {TYPE_EMPTY: 0, TYPE_INTEGER: 1, TYPE_FLOAT: 2, TYPE_STRING: 3}
+
+def __typed_chunk(np, values, column_type):
+    # convert a chunk of strings (or None) to a (data, mask, type) tuple,
+    # trying the types in promotion order from the current column type
+    mask = np.fromiter((v is None for v in values), dtype=bool, 
+                       count=len(values))
+    if mask.all() and column_type != TYPE_STRING:
+        return (None, mask, TYPE_EMPTY)
+
+    if __TYPE_ORDER[column_type] <= __TYPE_ORDER[TYPE_INTEGER]:
+        try:
+            return (np.array([v if v is not None else "0" for v in values],
+                             dtype=np.int64), mask, TYPE_INTEGER)
+        except (ValueError, OverflowError):
+            pass
+    if __TYPE_ORDER[column_type] <= __TYPE_ORDER[TYPE_FLOAT]:
+        try:
+            return (np.array([v if v is not None else "nan" 
+                              for v in values], dtype=np.float64), 
+                    mask, TYPE_FLOAT)
+        except ValueError:
+            pass
+    return (np.array([v if v is not None else "" for v in values], 
+                     dtype=str), mask, TYPE_STRING)
+
+def __promote_chunk(np, data, mask, from_type, to_type):
+    # convert a previously typed chunk to a higher type (numbers are never
+    # converted to strings)
+    if data is None or from_type == TYPE_EMPTY:
+        if to_type == TYPE_INTEGER:
+            return np.zeros(len(mask), dtype=np.int64)
+        elif to_type == TYPE_FLOAT:
+            return np.full(len(mask), np.nan, dtype=np.float64)
+        else:
+            return np.full(len(mask), "", dtype=str)
+    else:
+        data = data.astype(np.float64)
+        data[mask] = np.nan
+        return data
+
+def __column_chunks(np, rows, header, indices, types, chunk_size):
+    # read the rows in chunks, returning the list of typed chunks per
+    # column, the column types, and the columns that were promoted from
+    # numbers to strings
+    n_columns = len(header)
+    chunks = [[] for i in indices]
+    reread = []
+    n_rows = 0
+    while True:
+        block = list(islice(rows, chunk_size))
+        if len(block) == 0:
+            break
+        n_rows = n_rows + len(block)
+
+        # pad or truncate rows that don't have the right number of columns
+        if any(len(r) != n_columns for r in block):
+            log.warning("Rows {0} to {1} have an unequal number of columns."
+                        .format(n_rows - len(block) + 1, n_rows))
+            block = [r[:n_columns] + (None,) * (n_columns - len(r)) 
+                     for r in block]
+
+        values = list(zip(*block))
+        for k, i in enumerate(indices):
+            if k in reread:
+                continue
+            data, mask, t = __typed_chunk(np, values[i], types[k])
+            if __TYPE_ORDER[t] > __TYPE_ORDER[types[k]]:
+                if types[k] != TYPE_EMPTY:
+                    log.warning(
+                        "Column \"{0}\" type promoted from {1} to {2} on "
+                        "rows {3} to {4}.".format(header[i], types[k], t,
+                            n_rows - len(block) + 1, n_rows))
+                if t == TYPE_STRING and \
+                   any(c[0] is not None for c in chunks[k]):
+                    reread.append(k)
+                    chunks[k] = []
+                else:
+                    chunks[k] = [(__promote_chunk(np, c[0], c[1], types[k],
+                                                  t), c[1]) 
+                                 for c in chunks[k]]
+                types[k] = t
+            elif __TYPE_ORDER[t] < __TYPE_ORDER[types[k]]:
+                data = __promote_chunk(np, data, mask, t, types[k])
+            chunks[k].append((data, mask))
+
+    return (chunks, types, reread)
+
+def __cached_chunks(np, table, header, indices, chunk_size):
+    # return the typed chunks and types of the columns from the cache,
+    # which are typed by the whole column, as they are from the CSV
+    chunks = []
+    types = []
+    for i in indices:
+        kind, data, strings, mask = table[1][i]
+        if kind == "e":
+            chunks.append([(None, np.ones(len(mask), dtype=bool))])
+            types.append(TYPE_EMPTY)
+        elif kind == "s":
+            # empty values are already empty strings, when they are joined
+            values = strings.split("\0") if isinstance(strings, str) else \
+                     [v if v is not None else "" for v in strings]
+            chunks.append([(np.array(values, dtype=str), 
+                            np.frombuffer(mask, dtype=np.uint8).astype(bool))])
+            types.append(TYPE_STRING)
+        else:
+            chunks.append([(np.frombuffer(data, dtype=np.int64 if kind == "q"
+                                          else np.float64).copy(), 
+                            np.frombuffer(mask, dtype=np.uint8).astype(bool))])
+            types.append(TYPE_INTEGER if kind == "q" else TYPE_FLOAT)
+    return (chunks, types)
+
+def get_columns(db_path, columns=None, csv_path=SPEC_D_CSV_FILENAME,
+                chunk_size=65536, cache=False):
+    """
+    Parse a Spec D database into typed NumPy arrays, one per column. 
+    Rows are read in chunks of *chunk_size*, so only one chunk of strings
+    is in memory at any time. Does not validate that it is a proper Spec D
+    database. Requires numpy.
+
+    Column types are determined by the whole column, and are promoted as
+    they are read: TYPE_INTEGER columns are numpy.int64, TYPE_FLOAT 
+    columns are numpy.float64 (NaN is a valid float), and TYPE_STRING 
+    columns are numpy.str_. A column that is only TYPE_EMPTY is numpy.float64.
+    
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        columns : iterator of strings or integers = None
+            the column names (or 0-based column indices) to materialize, 
+            if None, all of the columns are materialized
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        chunk_size : integer = 65536
+            number of rows to convert at once
+        cache : boolean = False
+            if True, read the columns from the binary cache, creating it if
+            it is missing or out of date (see get_cache)
+
+    returns:
+        an OrderedDict of column name to numpy.ma.MaskedArray, in the
+        order of the header (or of *columns*), where TYPE_EMPTY values are 
+        masked (and are NaN in float columns), or None if the csv_path file
+        can't be opened or a column does not exist
+
+    side effects:
+        logs error and info messages to the logger
+    """
+
+    import numpy as np
+    from ... import check_numpy_version
+    check_numpy_version(np)
+
+    log.info("Reading columns of \"{0}/{1}\".".format(db_path, csv_path))
+    cdb = get_iterator(db_path, csv_path)
+    if cdb == None:
+        log.error("Error opening \"{0}\".".format(csv_path))
+        return None
+    header = next(cdb, None)
+    if header == None:
+        log.error("Error reading the header of \"{0}\".".format(csv_path))
+        return None
+
+    # figure out which columns to read
+    if columns == None:
+        indices = list(range(0, len(header)))
+    else:
+        indices = []
+        for c in columns:
+            if isinstance(c, int) and c >= 0 and c < len(header):
+                indices.append(c)
+            elif c in header:
+                indices.append(header.index(c))
+            else:
+                log.error("Column {0} is not in the header {1}.".format(
+                    c, header))
+                return None
+    log.info("Reading column indices {0}.".format(indices))
+
+    table = get_cache(db_path, csv_path) if cache else None
+    if table is not None:
+        chunks, types = __cached_chunks(np, table, header, indices, 
+                                        chunk_size)
+        reread = []
+    else:
+        chunks, types, reread = __column_chunks(np, cdb, header, indices, 
+                                                [TYPE_EMPTY] * len(indices),
+                                                chunk_size)
+
+    # numeric columns that turned out to be strings are read again, so
+    # that the strings are exactly what is in the file
+    if len(reread) > 0:
+        cdb = get_iterator(db_path, csv_path)
+        next(cdb)
+        rechunks, retypes, ignore = __column_chunks(np, cdb, header, 
+            [indices[k] for k in reread], [TYPE_STRING] * len(reread), 
+            chunk_size)
+        for k, c in zip(reread, rechunks):
+            chunks[k] = c
+
+    # create the columns
+    result = OrderedDict()
+    for k, i in enumerate(indices):
+        if types[k] == TYPE_EMPTY:
+            chunks[k] = [(__promote_chunk(np, c[0], c[1], types[k], 
+                                          TYPE_FLOAT), c[1]) 
+                         for c in chunks[k]]
+        if len(chunks[k]) == 0:
+            data = np.zeros(0, dtype=np.float64)
+            mask = np.zeros(0, dtype=bool)
+        else:
+            data = np.concatenate([c[0] for c in chunks[k]])
+            mask = np.concatenate([c[1] for c in chunks[k]])
+        chunks[k] = None
+        result[header[i]] = np.ma.MaskedArray(data, mask=mask)
+        log.info("Column \"{0}\" is {1} with {2} rows.".format(
+            header[i], types[k], len(data)))
+
+    return result
+
+def __check_row(db_path, header, files, types, row, n_rows, listing=None,
+                verify=None):
+    # check a data row, returns (True if there is an error, updated types,
+    # number of files found, number of files). files are checked with 
+    # a FileListing if *listing* isn't None
+    row_error = False
+    n_files = 0
+    total_files = 0
+    if len(header) != len(row):
+        log.error("On row #{0}: {1}".format(n_rows, row)) 
+        log.error("Unequal number of columns.")
+        row_error = True
+    # check and update row types
+    result, is_new, old_types, types = typematch(row, types)
+    if is_new:
+        log.info("Types updated on row#{0} from {1} to {2}".format(n_rows, old_types, types))
+    if not result:
+        log.error("On row #{0}: {1}".format(n_rows, row)) 
+        log.error("Types do not match: {0}".format(typecheck(row)))
+        row_error = True
+
+    # check if there is whitespace
+    if any(i is not None and i != i.strip() for i in row):
+        log.warning("On row #{0}: {1}".format(n_rows, row))
+        log.warning("There are whitespace(s) preceeding or following a comma(s).")
+
+    # check the files
+    for i in files:
+        if i < len(row):
+            if row[i] is not None:
+                total_files = total_files + 1
+                fn = os.path.join(db_path, row[i])
+                if listing is None:
+                    error = None if os.path.isfile(fn) else "is missing"
+                else:
+                    error = listing.error(row[i], verify)
+                if error is not None:
+                    log.error("Error on row #{0}: {1}".format(n_rows, row)) 
+                    log.error("File \"{0}\" {1}.".format(fn, error))
+                    row_error = True
+                else:
+                    n_files = n_files + 1
+        else:
+            log.error("Unable to check file on row #{0}, not enough columns.".format(n_rows))
+            row_error = True
+
+    return (row_error, types, n_files, total_files)
+
+def __check_batch(db_path, header, files, types, batch, listing, 
+                  verify=None):
+    # check a list of data rows a column at a time, with the same result 
+    # as __check_row for each row. returns the number of files found if 
+    # none of the rows would have an error, warning or type update, 
+    # otherwise None, and the rows need to be checked with __check_row to 
+    # log them
+    n_columns = len(header)
+    if len(types) != n_columns or \
+       any(len(row) != n_columns for row in batch):
+        return None
+    n_files = 0
+    for i, (column_type, values) in enumerate(zip(types, zip(*batch))):
+        if None in values:
+            values = tuple(v for v in values if v is not None)
+            if len(values) == 0:
+                continue
+        # whitespace, str.strip returns the same string if there is none
+        if tuple(map(str.strip, values)) != values:
+            return None
+        try:
+            if column_type == TYPE_INTEGER:
+                list(map(int, values))
+            elif column_type == TYPE_FLOAT:
+                # float is case insensitive, like float(v.lower())
+                list(map(float, values))
+                if __INTEGER_LIKE.search("\0" + "\0".join(values) + "\0"):
+                    return None
+            elif column_type == TYPE_STRING:
+                if __NUMBER_LIKE.search("\0" + "\0".join(values)):
+                    for v in values:
+                        if v.lower() != "nan" and \
+                           typecheck((v,))[0] != TYPE_STRING:
+                            return None
+            else:
+                # the type of an empty column will be updated
+                return None
+        except ValueError:
+            return None
+        if i in files:
+            # the files were checked for the whole batch (see 
+            # check_database), so these are lookups
+            if any(listing.error(v, verify) is not None 
+                   for v in set(values)):
+                return None
+            n_files = n_files + len(values)
+    return n_files
+
+def __png_header(f, crc):
+    # returns (width, height, channels, bit depth) of a PNG, walking the 
+    # chunks to the IEND chunk, and checking their CRCs if *crc* is True
+    if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise ValueError("not a PNG signature")
+    size = os.fstat(f.fileno()).st_size
+    header = None
+    has_data = False
+    while True:
+        b = f.read(8)
+        if len(b) < 8:
+            raise ValueError("truncated, no IEND chunk")
+        length, kind = struct.unpack(">I4s", b)
+        if length > 0x7fffffff:
+            raise ValueError("invalid {0} chunk length".format(
+                kind.decode("latin-1")))
+        if header is None and kind != b"IHDR":
+            raise ValueError("the first chunk isn't IHDR")
+        if f.tell() + length + 4 > size:
+            raise ValueError("truncated {0} chunk".format(
+                kind.decode("latin-1")))
+        if crc or kind == b"IHDR":
+            data = f.read(length) if kind == b"IHDR" else b""
+            value = zlib.crc32(kind + data)
+            remaining = length - len(data)
+            while remaining > 0:
+                b = f.read(min(READ_BLOCK_SIZE, remaining))
+                value = zlib.crc32(b, value)
+                remaining = remaining - len(b)
+            if (crc and struct.unpack(">I", f.read(4))[0] != value & 
+                    0xffffffff):
+                raise ValueError("CRC mismatch in {0} chunk".format(
+                    kind.decode("latin-1")))
+            elif not crc:
+                f.seek(4, io.SEEK_CUR)
+        else:
+            f.seek(length + 4, io.SEEK_CUR)
+
+        if kind == b"IHDR":
+            if header is not None or length != 13:
+                raise ValueError("invalid IHDR chunk")
+            width, height, depth, color = struct.unpack(">IIBB", data[:10])
+            if width == 0 or height == 0:
+                raise ValueError("zero width or height")
+            if color not in __PNG_COLOR_TYPES or \
+               depth not in __PNG_COLOR_TYPES[color][0]:
+                raise ValueError("invalid bit depth {0} for color type "
+                                 "{1}".format(depth, color))
+            header = (width, height, __PNG_COLOR_TYPES[color][1], depth)
+        elif kind == b"IDAT":
+            has_data = True
+        elif kind == b"IEND":
+            break
+    if not has_data:
+        raise ValueError("no IDAT chunk")
+    return header
 
+def __jpeg_header(f):
+    # returns (width, height, channels, bit depth) of a JPEG, walking the
+    # segments to the start of scan, and checking it ends with EOI
+    if f.read(len(JPEG_SIGNATURE)) != JPEG_SIGNATURE:
+        raise ValueError("not a JPEG signature")
+    header = None
+    while True:
+        b = f.read(2)
+        if len(b) < 2 or b[0] != 0xff:
+            raise ValueError("truncated or invalid marker")
+        marker = b[1]
+        while marker == 0xff:
+            b = f.read(1)
+            if len(b) == 0:
+                raise ValueError("truncated marker")
+            marker = b[0]
+        if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+            continue
+        if marker == 0xd9:
+            raise ValueError("no image data")
+        b = f.read(2)
+        if len(b) < 2 or struct.unpack(">H", b)[0] < 2:
+            raise ValueError("truncated or invalid segment")
+        length = struct.unpack(">H", b)[0] - 2
+        data = f.read(length)
+        if len(data) < length:
+            raise ValueError("truncated segment")
+        if marker in __JPEG_SOF:
+            if length < 6:
+                raise ValueError("invalid start of frame")
+            depth, height, width, channels = struct.unpack(">BHHB", 
+                                                           data[:6])
+            if width == 0 or height == 0 or channels == 0:
+                raise ValueError("zero width, height or components")
+            header = (width, height, channels, depth)
+        elif marker == 0xda:
+            break
+    if header is None:
+        raise ValueError("no start of frame")
+    # trailing padding is allowed after the end of image
+    f.seek(max(f.tell(), os.fstat(f.fileno()).st_size - SAMPLE_BLOCK_SIZE))
+    if not f.read().rstrip(b"\0").endswith(b"\xff\xd9"):
+        raise ValueError("truncated, no EOI marker")
+    return header
 
-def file_columns(header):
+def get_image_header(fn, crc=True):
     """
-    Given a header row, return the list of FILE column indices. Does
-    not validate that they are in the right order, nor does it validate
-    rows if they are strings or files.
+    Parse and check the header of a PNG or JPEG image, without decoding
+    the pixels. A PNG is checked to have a valid signature and IHDR, and 
+    the chunks through IEND are walked (and their CRCs checked if *crc*
+    is True). A JPEG is checked to have a valid start of image, the 
+    segments through start of scan are walked, and it has to end with an
+    end of image marker.
 
     arguments:
-        row : iterator of header identifiers
+        fn : string
+            POSIX path of an image
+        crc : boolean = True
+            if True, read every PNG chunk to check its CRC, otherwise only
+            seek over them
 
     returns:
-        tuple of column indices that are FILEs
+        tuple of (format "PNG" or "JPEG", width, height, number of 
+        channels, bit depth per channel)
+
+    raises:
+        ValueError if it isn't a PNG or JPEG or it is truncated or invalid,
+        and OSError if it can't be read
     """
 
-    return [i for i, h in zip(range(0, len(header)), header) if
-            is_file_column(h)]
+    with open(fn, "rb") as f:
+        signature = f.read(len(PNG_SIGNATURE))
+        f.seek(0)
+        if signature == PNG_SIGNATURE:
+            return ("PNG",) + __png_header(f, crc)
+        elif signature.startswith(JPEG_SIGNATURE):
+            return ("JPEG",) + __jpeg_header(f)
+    raise ValueError("not a PNG or JPEG signature")
+
+def __check_image(task):
+    # process pool worker for check_database, returns (row number, column,
+    # path, (width, height, channels) or None, error or None)
+    db_path, n_rows, column, path, images = task
+    fn = os.path.join(db_path, path)
+    try:
+        image_format, width, height, channels, depth = get_image_header(fn)
+        if image_format != IMAGE_EXTS[os.path.splitext(path)[1].lower()]:
+            raise ValueError("it is a {0}".format(image_format))
+        if images == IMAGE_DECODE:
+            from skimage import io as skio
+            shape = skio.imread(fn).shape
+            if shape[:2] != (height, width):
+                raise ValueError("decoded as {0}".format(shape))
+            channels = shape[2] if len(shape) > 2 else 1
+        return (n_rows, column, path, (width, height, channels), None)
+    except ImportError as e:
+        return (n_rows, column, path, None, 
+                "unable to decode ({0})".format(e))
+    except Exception as e:
+        return (n_rows, column, path, None, str(e))
+
+def __check_images(db_path, header, files, rows, images, workers=1):
+    # check the images in the FILE columns of (row number, row), in a pool
+    # of *workers* processes, reporting invalid images in row order, and
+    # images that don't have the same dimensions and channels as the first
+    # image in their column. returns True if all of the images are valid
+    def tasks():
+        for n_rows, row in rows:
+            for i in files:
+                if i < len(row) and row[i] is not None and \
+                   os.path.splitext(row[i])[1].lower() in IMAGE_EXTS and \
+                   os.path.isfile(os.path.join(db_path, row[i])):
+                    yield (db_path, n_rows, i, row[i], images)
+
+    start = time.perf_counter()
+    first = {}
+    n_images = 0
+    n_invalid = 0
+    n_mismatched = 0
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        results = pool.imap(__check_image, tasks(), 16) if pool is not None \
+                  else map(__check_image, tasks())
+        for n_rows, i, path, shape, error in results:
+            n_images = n_images + 1
+            if error is not None:
+                log.error("On row #{0}: image \"{1}\" is invalid: {2}.".format(
+                    n_rows, path, error))
+                n_invalid = n_invalid + 1
+            elif i not in first:
+                first[i] = (path, shape)
+            elif first[i][1] != shape:
+                log.warning("On row #{0}: image \"{1}\" is {2}x{3} with {4} "
+                            "channel(s), but \"{5}\" in column \"{6}\" is "
+                            "{7}x{8} with {9} channel(s).".format(n_rows, 
+                            path, shape[0], shape[1], shape[2], first[i][0],
+                            header[i], first[i][1][0], first[i][1][1], 
+                            first[i][1][2]))
+                n_mismatched = n_mismatched + 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    log.info("Checked {0} images in {1:.3f} s, {2} are invalid and {3} "
+             "don't match the first image in their column.".format(n_images,
+             time.perf_counter() - start, n_invalid, n_mismatched))
+    return n_invalid == 0
+
+def __upper_bound(k, n, confidence=SAMPLE_CONFIDENCE):
+    # one-sided upper confidence bound of a proportion, given k out of n
+    # samples, exact if k is 0, otherwise the Wilson score bound
+    if n == 0:
+        return 1.0
+    if k == 0:
+        return 1.0 - (1.0 - confidence) ** (1.0 / n)
+    low, high = 0.0, 10.0
+    for i in range(0, 64):
+        z = (low + high) / 2
+        if 0.5 * (1.0 + math.erf(z / math.sqrt(2.0))) < confidence:
+            low = z
+        else:
+            high = z
+    p = k / n
+    centre = p + z * z / (2 * n)
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return min(1.0, (centre + margin) / (1 + z * z / n))
+
+def __sample_rows(db_path, csv_path, fn, sample, sample_rows, seed):
+    # choose a reproducible random sample of data rows by their byte 
+    # offsets, using the row index if it is up to date. otherwise, rows
+    # are found after random offsets (which assumes values don't have
+    # newlines). returns (number of data rows, True if it is estimated, 
+    # iterator of (row label, row or None if it can't be parsed))
+    rng = random.Random(seed)
+    offsets = __read_index(db_path, csv_path, __file_signature(fn))
+    if offsets is not None:
+        total = len(offsets) - 1
+        n = sample_rows if sample_rows is not None else \
+            int(math.ceil(sample * total))
+        picks = sorted(rng.sample(range(0, total), min(max(n, 0), total)))
+        def indexed():
+            for i in picks:
+                try:
+                    row = next(__offset_rows(fn, offsets[i], offsets[i + 1],
+                                             True))
+                except Exception:
+                    row = None
+                yield (i + 1, row)
+        return (total, False, indexed())
+
+    size = os.path.getsize(fn)
+    with open(fn, "rb") as f:
+        block = f.read(SAMPLE_BLOCK_SIZE)
+    header_end = block.find(b"\n") + 1
+    if header_end == 0 or header_end == size:
+        return (0, True, iter(()))
+    last = block.rfind(b"\n")
+    n_lines = block.count(b"\n", header_end)
+    average = (last + 1 - header_end) / n_lines if n_lines > 0 and \
+              last + 1 > header_end else len(block)
+    total = max(1, int(round((size - header_end) / average)))
+    n = min(sample_rows if sample_rows is not None else 
+            int(math.ceil(sample * total)), total)
+    def row_at(f, position):
+        # return (start, row) of the row after the next newline after a 
+        # position, or None if there isn't one
+        f.seek(position)
+        b = b""
+        while b.find(b"\n") < 0:
+            more = f.read(SAMPLE_BLOCK_SIZE)
+            if len(more) == 0:
+                break
+            b = b + more
+        k = b.find(b"\n")
+        start = position + k + 1
+        if k < 0 or start >= size:
+            return None
+        b = b[k + 1:]
+        while b.find(b"\n") < 0:
+            more = f.read(SAMPLE_BLOCK_SIZE)
+            if len(more) == 0:
+                break
+            b = b + more
+        k = b.find(b"\n")
+        try:
+            text = io.StringIO(b[:k + 1 if k >= 0 else len(b)].decode(
+                "utf-8"), newline=None)
+            row = tuple(next(__row_generator(text, True)))
+        except Exception:
+            row = None
+        return (start, row)
+    def sampled():
+        # positions that find a row that was already sampled are drawn 
+        # again, until there are n rows, or 8 rounds of positions in a 
+        # row don't find any new rows (there are fewer rows than 
+        # estimated)
+        starts = set()
+        misses = 0
+        with open(fn, "rb") as f:
+            while len(starts) < n and misses < 8:
+                positions = sorted(rng.randrange(header_end - 1, size - 1) 
+                                   for i in range(0, n - len(starts)))
+                found = False
+                for position in positions:
+                    found_row = row_at(f, position)
+                    if found_row is None or found_row[0] in starts:
+                        continue
+                    start, row = found_row
+                    starts.add(start)
+                    found = True
+                    yield ("~{0} (byte {1})".format(
+                        1 + int((start - header_end) / average), start), row)
+                misses = 0 if found else misses + 1
+    return (total, True, sampled())
+
+def __check_sample(db_path, csv_path, header, files, types, sample, 
+                   sample_rows, seed, verify, list_workers=LIST_WORKERS):
+    # check a random sample of rows, see check_database. returns True if
+    # there were no errors
+    fn = os.path.join(db_path, csv_path)
+    total, estimated, rows = __sample_rows(db_path, csv_path, fn, sample, 
+                                           sample_rows, seed)
+    listing = FileListing(db_path, list_workers)
+    n_rows = 0
+    n_errors = 0
+    n_files = 0
+    total_files = 0
+    while True:
+        batch = list(islice(rows, CHECK_BATCH_SIZE))
+        if len(batch) == 0:
+            break
+        listing.check(set(row[i] for label, row in batch if row is not None 
+                          for i in files 
+                          if i < len(row) and row[i] is not None), verify)
+        for label, row in batch:
+            n_rows = n_rows + 1
+            if row is None:
+                log.error("Unable to parse row #{0}.".format(label))
+                n_errors = n_errors + 1
+                continue
+            error, types, found, checked = __check_row(
+                db_path, header, files, types, row, label, listing, verify)
+            n_errors = n_errors + (1 if error else 0)
+            n_files = n_files + found
+            total_files = total_files + checked
+    listing.report()
 
+    log.info("Sampled {0} of {1}{2} data rows with seed {3}.".format(
+        n_rows, "about " if estimated else "", total, seed))
+    log.info("{0} of {1} sampled rows have errors. With {2:.0%} confidence, "
+             "at most {3:.4%} of the rows have errors.".format(
+             n_errors, n_rows, SAMPLE_CONFIDENCE, 
+             __upper_bound(n_errors, n_rows)))
+    if total_files > 0:
+        log.info("{0} of {1} files in the sampled rows were found. With "
+                 "{2:.0%} confidence, at most {3:.4%} of the files are "
+                 "missing.".format(n_files, total_files, SAMPLE_CONFIDENCE,
+                 __upper_bound(total_files - n_files, total_files)))
+    return n_errors == 0
 
-def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False):
+def __checked_files(rows, files, listing, verify):
+    # return the rows, checking the files in the FILE columns of each 
+    # batch of CHECK_BATCH_SIZE rows at once with the listing, so that 
+    # listing.error is a lookup for them
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, CHECK_BATCH_SIZE))
+        if len(batch) == 0:
+            break
+        listing.check(set(row[i] for row in batch for i in files 
+                          if i < len(row) and row[i] is not None), verify)
+        yield from batch
+
+def __check_chunk(task):
+    # process pool worker for check_database. the rows are grouped into 
+    # runs that typematch the same way, i.e., that have the same types and
+    # NaNs. returns (number of rows, [(row number in chunk, row) for the
+    # first row of each run], number of files, True if there were no
+    # other errors or warnings, (number of directories listed, files
+    # checked, stat calls)) or None if the chunk couldn't be parsed
+    db_path, fn, start, stop, skip, n_columns, files, verify, \
+        list_workers = task
+    listing = FileListing(db_path, list_workers)
+    try:
+        n_rows = 0
+        runs = []
+        n_files = 0
+        clean = True
+        last = None
+        for row in __checked_files(__chunk_iterator(fn, start, stop, True, 
+                                                    skip), 
+                                   files, listing, verify):
+            types = typecheck(row)
+            key = (types, tuple(i for i, t in enumerate(types) 
+                                if t == TYPE_FLOAT and row[i].lower() == "nan"))
+            if key != last:
+                runs.append((n_rows, row))
+                last = key
+            if clean:
+                if len(row) != n_columns:
+                    clean = False
+                elif reduce(lambda x, y: x or 
+                            (y is not None and y != y.strip()), row, False):
+                    clean = False
+                for i in files:
+                    if i < len(row) and row[i] is not None:
+                        if listing.error(row[i], verify) is None:
+                            n_files = n_files + 1
+                        else:
+                            clean = False
+            n_rows = n_rows + 1
+        return (n_rows, runs, n_files, clean, (listing.n_directories,
+                listing.n_checks, listing.n_stats))
+    except Exception:
+        return None
+
+def __merge_chunk(result, types, n_rows):
+    # given the result of __check_chunk, and the types and row number 
+    # before the chunk, return (updated types, log messages), or None if
+    # the chunk has to be checked serially to report errors
+    if result is None or not result[3]:
+        return None
+    messages = []
+    for n, row in result[1]:
+        match, is_new, old_types, types = typematch(row, types)
+        if is_new:
+            messages.append("Types updated on row#{0} from {1} to {2}".format(
+                n_rows + n, old_types, types))
+        if not match:
+            return None
+    return (types, messages)
+
+def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False,
+                   index=False, workers=1, cache=False, verify=None,
+                   incremental=False, sample=None, sample_rows=None, 
+                   sample_seed=0, images=None, list_workers=LIST_WORKERS):
     """
     Validate a Spec D database.
 
@@ -267,19 +2632,82 @@ def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False):
         quick : boolean = False
             if True, perform a quick check, which means only checking
             the first two lines
+        index : boolean = False
+            if True, and it is a full check that succeeds, build the row 
+            index (see get_row_index)
+        workers : integer = 1
+            if greater than 1, check the rows in chunks in a pool of 
+            *workers* processes (see get_chunks)
+        cache : boolean = False
+            if True, read the rows from the binary cache, creating it if
+            it is missing or out of date (see get_cache), instead of 
+            checking in parallel
+        verify : string = None
+            if VERIFY_SIZE, also check that files aren't empty, or if 
+            VERIFY_CHECKSUM, that they aren't empty and can be read
+        incremental : boolean = False
+            if True, only check the rows after the checkpoint saved by the
+            last successful check with *incremental*, if the rows before 
+            it are unchanged, and save a new checkpoint if it succeeds. 
+            The checkpoint has the byte offset after the last row checked,
+            the column types, the *verify* the files were checked with, 
+            and an MD5 of the bytes before the offset. It isn't used if 
+            its files weren't verified as much as *verify* asks
+        sample : float = None
+            if not None, only check a random sample of this fraction of 
+            the rows, and the files in them, and report the confidence of 
+            the error rate. The rows are chosen by their byte offsets, 
+            from the row index if it is up to date (see get_row_index), 
+            otherwise at the next newline after random offsets. Without
+            the index, a row is chosen in proportion to the length of the
+            row before it, so the sample is biased towards rows after long
+            rows, and the number of rows is estimated
+        sample_rows : integer = None
+            if not None, only check a random sample of this number of
+            rows (or all of them, if there are fewer), instead of a 
+            fraction
+        sample_seed : integer = 0
+            seed of the random sample, so it is reproducible
+        images : string = None
+            if IMAGE_HEADER, also check the headers of the PNG and JPEG 
+            images in the FILE columns (see get_image_header), in a pool 
+            of *workers* processes, and report images that don't have the
+            same dimensions and channels as the first image in their 
+            column. If IMAGE_DECODE, also decode the pixels, which needs
+            scikit-image. Only the rows that are checked are included, 
+            e.g., only the rows after the checkpoint if *incremental*
+        list_workers : integer = LIST_WORKERS
+            number of threads to check the files of a batch of rows with
+            (see FileListing), in each of the *workers* processes
 
     returns:
         True if it is valid, False otherwise
 
+    raises:
+        ValueError if *sample* isn't in (0, 1], or *sample_rows* isn't 
+        positive
+
     side effects:
         logs error and info messages to the logger
+
+        writes out an index file at csv_path + INDEX_EXT if *index* is True
+
+        writes out a checkpoint file at csv_path + CHECKPOINT_EXT if 
+        *incremental* is True
     """
 
+    if sample is not None and not 0 < sample <= 1:
+        raise ValueError("Sample fraction {0} isn't in (0, 1].".format(
+            sample))
+    if sample_rows is not None and sample_rows <= 0:
+        raise ValueError("Number of sampled rows {0} isn't positive.".format(
+            sample_rows))
+
     log.info("Checking database \"{0}\" as Spec D.".format(db_path))
     try:
         # get the reader
         log.info("Opening CSV file \"{0}\".".format(csv_path))
-        reader = get_iterator(db_path, csv_path, True)
+        reader = get_iterator(db_path, csv_path, True, cache=cache)
         if reader == None:
             log.error("Error opening \"{0}\".".format(csv_path))
             raise Exception("Error opening \"{0}\".".format(csv_path))
@@ -297,8 +2725,7 @@ def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False):
         types = typecheck(header)
 
         # check the types of the first line
-        header_error = reduce(lambda x, y: x or (y != TYPE_STRING), 
-                              types, False)
+        header_error = any(t != TYPE_STRING for t in types)
 
         if header_error:
             log.error("Column header(s) are not all type string: {0}.".format(
@@ -310,19 +2737,14 @@ def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False):
             header_error = True
 
         # check if there is whitespace
-        warn_whitespace = reduce(lambda x, y: x or (y[0] != y[1]),
-                                 zip(header, [i.strip() if i is not None else None for i in header]),
-                                 False)
-        if warn_whitespace:
+        stripped = [i.strip() if i is not None else None for i in header]
+        if any(i != j for i, j in zip(header, stripped)):
             log.warning(
               "There are whitespace(s) preceding or following a comma(s) in the header: {0}.".format(header))
 
         # check if there is FILE with whitespace
-        warn_file_whitespace = reduce(lambda x, y: x or 
-                                      (is_file_column(y[1]) and (y[0] != y[1])),
-                                      zip(header, [i.strip() if i is not None else None for i in header]),
-                                      False)
-        if warn_file_whitespace:
+        if any(is_file_column(j) and i != j 
+               for i, j in zip(header, stripped)):
             log.warning(
               "There are whitespace(s) for FILE column(s) in the header. These will not be detected as proper FILEs: {0}.".format(header))
 
@@ -340,7 +2762,7 @@ def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False):
 
         # removed validation of types in first row -- v1.2 tool
         # now report if we find one is EMPTY
-        if reduce(lambda x, y: x or y == TYPE_EMPTY, types, False):
+        if TYPE_EMPTY in types:
             log.info("The first line of the columns is TYPE_EMPTY. Can't determine column type, yet.")
 
         if len(types) != len(header):
@@ -373,69 +2795,169 @@ def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False):
                     header_error = True
         # delay the raise, because we can try to check rows
 
-        # check the rows if we aren't doing a quick check
-        if not quick:
-            # reopen the reader because we are lazy and skip the header
-            reader = get_iterator(db_path, csv_path, True)
-            next(reader)
-
+        # check a sample of the rows, or all of them if we aren't doing a
+        # quick check
+        sampling = not quick and \
+                   (sample is not None or sample_rows is not None)
+        if sampling and \
+           __compression(__csv_filename(db_path, csv_path)) is not None:
+            log.warning("Unable to sample compressed \"{0}\", checking all "
+                        "rows.".format(csv_path))
+            sampling = False
+        if sampling:
+            if not __check_sample(db_path, csv_path, header, files, types,
+                                  sample, sample_rows, sample_seed, verify,
+                                  list_workers):
+                raise Exception("Error checking sampled rows.")
+        elif not quick:
             row_error = False
             n_rows = 1
             n_files = 0
             total_files = 0
-            try:
-                for row in reader:
-                    if len(header) != len(row):
-                        log.error("On row #{0}: {1}".format(n_rows, row)) 
-                        log.error("Unequal number of columns.")
-                        row_error = True
-                    # check and update row types
-                    result, is_new, old_types, types = typematch(row, types)
-                    if is_new:
-                        log.info("Types updated on row#{0} from {1} to {2}".format(n_rows, old_types, types))
-                    if not result:
-                        log.error("On row #{0}: {1}".format(n_rows, row)) 
-                        log.error("Types do not match: {0}".format(typecheck(row)))
-                        row_error = True
-
-                    # check if there is whitespace
-                    warn_whitespace = reduce(lambda x, y: x or (y[0] != y[1]),
-                                             zip(row, 
-                                                 [i.strip() if i is not None else None for i in row]),
-                                             False)
-                    if warn_whitespace:
-                        log.warning("On row #{0}: {1}".format(n_rows, row))
-                        log.warning("There are whitespace(s) preceeding or following a comma(s).")
-
-                    # check the files
-                    for i in files:
-                        if i < len(row):
-                            if row[i] is not None:
-                                total_files = total_files + 1
-                                fn = os.path.join(db_path, row[i])
-                                if not os.path.isfile(fn):
-                                    log.error("Error on row #{0}: {1}".format(n_rows, row)) 
-                                    log.error("File \"{0}\" is missing.".format(fn))
-                                    row_error = True
-                                else:
-                                    n_files = n_files + 1
-                        else:
-                            log.error("Unable to check file on row #{0}, not enough columns.".format(n_rows))
-                            row_error = True
+            listing = FileListing(db_path, list_workers)
+            def check_rows(rows):
+                nonlocal row_error, n_rows, n_files, total_files, types
+                rows = iter(rows)
+                while True:
+                    # rows read before a parsing error are still checked
+                    batch = []
+                    try:
+                        batch.extend(islice(rows, CHECK_BATCH_SIZE))
+                    except Exception as e:
+                        check_batch(batch)
+                        raise e
+                    if len(batch) == 0:
+                        break
+                    check_batch(batch)
+            def check_batch(batch):
+                nonlocal row_error, n_rows, n_files, total_files, types
+                # check the files of every FILE column at once, so that 
+                # __check_batch and __check_row look them up
+                listing.check(set(row[i] for row in batch for i in files 
+                                  if i < len(row) and row[i] is not None), 
+                              verify)
+                found = __check_batch(db_path, header, files, types, batch,
+                                      listing, verify)
+                if found is not None:
+                    # typematch returns a list of types
+                    types = list(types)
+                    n_files = n_files + found
+                    total_files = total_files + found
+                    n_rows = n_rows + len(batch)
+                    return
+                for row in batch:
+                    error, types, found, total = __check_row(
+                        db_path, header, files, types, row, n_rows, listing,
+                        verify)
+                    row_error = row_error or error
+                    n_files = n_files + found
+                    total_files = total_files + total
 
                     # increment
                     n_rows = n_rows + 1
+
+            fn = __csv_filename(db_path, csv_path)
+            checkpoint = None
+            if incremental and __compression(fn) is not None:
+                log.warning("Unable to check compressed \"{0}\" "
+                            "incrementally.".format(fn))
+                incremental = False
+            elif incremental:
+                size = os.path.getsize(fn)
+                checkpoint = __read_checkpoint(db_path, csv_path)
+                md5 = None
+                if checkpoint is None:
+                    log.info("No checkpoint, checking all rows.")
+                else:
+                    if checkpoint[0] <= size:
+                        md5 = __update_digest(fn, 0, checkpoint[0])
+                    if md5 is None or md5.digest() != checkpoint[1]:
+                        log.info("Rows before the checkpoint changed, "
+                                 "checking all rows.")
+                        checkpoint = None
+                        md5 = None
+                    elif __VERIFY_ORDER[checkpoint[5]] < \
+                         __VERIFY_ORDER[verify]:
+                        log.info("The files before the checkpoint were "
+                                 "verified with {0}, not {1}, checking all "
+                                 "rows.".format(checkpoint[5], verify))
+                        checkpoint = None
+                        md5 = None
+
+            chunks = get_chunks(db_path, csv_path, workers) \
+                     if workers > 1 and not cache and checkpoint is None \
+                     else None
+            try:
+                if checkpoint is not None:
+                    offset, digest, n_rows, n_files, types, checked = \
+                        checkpoint
+                    total_files = n_files
+                    log.info("Checking rows after row #{0} at byte {1}, "
+                             "from the checkpoint.".format(n_rows - 1, 
+                                                           offset))
+                    check_rows(__chunk_iterator(fn, offset, size, True))
+                elif chunks is None or len(chunks) < 2:
+                    # continue with the first row, in the same pass
+                    check_rows(chain((row,), reader))
+                else:
+                    log.info("Checking rows in {0} chunks with {1} "
+                             "workers.".format(len(chunks), workers))
+                    fn = os.path.join(db_path, csv_path)
+                    tasks = [(db_path, fn, start, stop, 1 if i == 0 else 0,
+                              len(header), files, verify, list_workers)
+                             for i, (start, stop) in enumerate(chunks)]
+                    with multiprocessing.Pool(workers) as pool:
+                        for task, result in zip(tasks, 
+                                                pool.imap(__check_chunk, 
+                                                          tasks)):
+                            merged = __merge_chunk(result, types, n_rows)
+                            if merged is None:
+                                # redo the chunk to log the errors, as if 
+                                # it was checked serially
+                                check_rows(__chunk_iterator(fn, task[2], 
+                                    task[3], True, task[4]))
+                            else:
+                                types, messages = merged
+                                for message in messages:
+                                    log.info(message)
+                                n_rows = n_rows + result[0]
+                                n_files = n_files + result[2]
+                                total_files = total_files + result[2]
+                            if result is not None:
+                                listing.n_directories = \
+                                    listing.n_directories + result[4][0]
+                                listing.n_checks = \
+                                    listing.n_checks + result[4][1]
+                                listing.n_stats = \
+                                    listing.n_stats + result[4][2]
             except Exception as e:
                 log.error("Fatal error parsing row #{0}.".format(n_rows))
                 raise e
 
             log.info("Number of data rows are {0}.".format(n_rows - 1))
+            listing.report()
             if n_files != total_files:
                 log.error("Only {0} files out of {1} were found.".format(
                     n_files, total_files))
             else:
                 log.info("{0} files validated to be present.".format(n_files))
 
+            # check the images, in another pass over the rows
+            if images is not None:
+                if images not in (IMAGE_HEADER, IMAGE_DECODE):
+                    raise ValueError("Unknown image check \"{0}\".".format(
+                        images))
+                if checkpoint is not None:
+                    rows = zip(count(checkpoint[2]), __chunk_iterator(fn, 
+                               checkpoint[0], size, True))
+                else:
+                    rows = get_iterator(db_path, csv_path, True, cache=cache)
+                    next(rows)
+                    rows = enumerate(rows, 1)
+                if not __check_images(db_path, header, files, rows, images,
+                                      workers):
+                    row_error = True
+
             if row_error:
                 raise Exception("Error checking rows.")
         else:
@@ -444,6 +2966,37 @@ def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False):
         # raise is delayed
         if header_error:
             raise Exception("Error checking header and types.")
+
+        # save the checkpoint, if the rows that were checked end on a row
+        # boundary at the end of the file
+        if incremental and not quick and not sampling:
+            with open(fn, "rb") as f:
+                f.seek(max(size - 1, 0))
+                last = f.read(1)
+            if checkpoint is None:
+                offset = 0
+            if os.path.getsize(fn) != size:
+                log.info("\"{0}\" changed while checking, not saving "
+                         "a checkpoint.".format(fn))
+            elif last != b"\n":
+                log.info("\"{0}\" doesn't end with a newline, not saving "
+                         "a checkpoint.".format(fn))
+            else:
+                digest = __update_digest(fn, offset, size, md5).digest()
+                # a checkpoint is as strong as the weakest verification
+                # of its rows
+                if checkpoint is not None and \
+                   __VERIFY_ORDER[checked] < __VERIFY_ORDER[verify]:
+                    verify = checked
+                if __write_checkpoint(db_path, csv_path, (size, digest, 
+                        n_rows, n_files, list(types), verify)):
+                    log.info("Saved checkpoint at row #{0}.".format(
+                        n_rows - 1))
+
+        if index and not quick and not sampling:
+            offsets = get_row_index(db_path, csv_path)
+            if offsets is not None:
+                log.info("Row index has {0} rows.".format(len(offsets) - 1))
     except Exception as e:
         log.error("Check failed. \"{0}\" is invalid. {1}".format(db_path, e))
         return False
@@ -451,7 +3004,158 @@ def check_database(db_path, csv_path=SPEC_D_CSV_FILENAME, quick=False):
     log.info("Check succeeded.")
     return True
 
-def get_sqlite3(db_path, csv_path=SPEC_D_CSV_FILENAME, where=":memory:"):
+def infer_type(values, column_type=TYPE_EMPTY):
+    """
+    Promote the type of a column, in the order of empty, integer, float 
+    and string, so that all of the values convert to it, as typecheck 
+    would type them, and as get_sqlite3 infers the column types. Integers
+    are limited to the range of SQLite integers.
+
+    arguments:
+        values : list of strings
+            the values of the column, without empty values (None)
+        column_type : string = TYPE_EMPTY
+            the type of the column before the values
+
+    returns:
+        TYPE_INTEGER, TYPE_FLOAT or TYPE_STRING, or *column_type* if there
+        are no values
+    """
+
+    if len(values) == 0:
+        return column_type
+    if __TYPE_ORDER[column_type] <= __TYPE_ORDER[TYPE_INTEGER]:
+        try:
+            numbers = list(map(int, values))
+            if min(numbers) >= -(1 << 63) and max(numbers) < (1 << 63):
+                return TYPE_INTEGER
+        except ValueError:
+            pass
+    if __TYPE_ORDER[column_type] <= __TYPE_ORDER[TYPE_FLOAT]:
+        try:
+            list(map(float, values))
+            return TYPE_FLOAT
+        except ValueError:
+            pass
+    return TYPE_STRING
+
+def __infer_types(rows, types, chunk_size):
+    # promote the types of the columns over chunks of rows
+    types = list(types)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if len(chunk) == 0:
+            break
+        for i, values in enumerate(zip(*chunk)):
+            if i < len(types) and types[i] != TYPE_STRING:
+                values = [v for v in values if v is not None]
+                if len(values) > 0:
+                    types[i] = infer_type(values, types[i])
+    return types
+
+def __inferred_rows(rows, types, chunk_size):
+    # yield the rows, promoting the *types* list in place over chunks of 
+    # rows as they are yielded
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if len(chunk) == 0:
+            break
+        types[:] = __infer_types(iter(chunk), types, chunk_size)
+        yield from chunk
+
+def create_sqlite3_table(connection, name, header, types):
+    """
+    Create a table for the rows of a Spec D database, as get_sqlite3 does,
+    with a column of the SQLite3 type (see CDB_TO_SQLITE3) of each Spec D
+    type. 
+
+    arguments:
+        connection : SQLite3 connection or cursor object
+            a connection to a SQLite3 database
+        name : string
+            the name of the table
+        header : tuple of strings
+            the names of the columns
+        types : tuple of strings
+            the Spec D types of the columns, other than TYPE_EMPTY
+    """
+
+    create = "CREATE TABLE \"{0}\" (".format(name)
+    for h, t in zip(header, types):
+        create = create + "\"" + h + "\" " + CDB_TO_SQLITE3[t] + ","
+    create = create[:-1] + ")"
+    log.info("Create table string is \"{0}\".".format(create))
+    connection.execute(create)
+
+def __retype_table(connection, name, header, types):
+    # change the types of the columns of a table, by copying it
+    tmp = name + " (" + str(os.getpid()) + ")"
+    create_sqlite3_table(connection, tmp, header, types)
+    connection.execute("INSERT INTO {0} SELECT * FROM {1}".format(
+        __quote_identifier(tmp), __quote_identifier(name)))
+    connection.execute("DROP TABLE {0}".format(__quote_identifier(name)))
+    connection.execute("ALTER TABLE {0} RENAME TO {1}".format(
+        __quote_identifier(tmp), __quote_identifier(name)))
+    connection.commit()
+
+def __convert_infinite(connection, name, header, types, after=0):
+    # SQLite converts the values in integer and real columns to numbers,
+    # except NaN and infinity, so convert infinity to floats, in one pass
+    # over the rows after the rowid *after*. NaN is kept as text, as 
+    # SQLite stores a NaN float as NULL
+    columns = ["\"{0}\"".format(h.replace("\"", "\"\"")) 
+               for h, t in zip(header, types) 
+               if t in (TYPE_INTEGER, TYPE_FLOAT)]
+    if len(columns) == 0:
+        return
+    connection.create_function("cdb_float", 1, float)
+    test = "typeof({0}) = 'text' AND lower(trim({0})) IN ({1})"
+    values = ",".join(["'{0}'".format(v) for v in __INFINITE])
+    connection.execute("UPDATE \"{0}\" SET {1} WHERE rowid > ? AND "
+        "({2})".format(name, 
+        ",".join(["{0} = CASE WHEN {1} THEN cdb_float({0}) ELSE {0} END".format(
+                  c, test.format(c, values)) for c in columns]),
+        " OR ".join(["typeof({0}) = 'text'".format(c) for c in columns])),
+        (after,))
+    connection.commit()
+
+def __bulk_load(connection, name, header, rows, chunk_size, journal=True):
+    # insert the rows in transactions of *chunk_size* rows, with 
+    # synchronous writes off (and the journal, if *journal* is False, 
+    # which is only for a database that is discarded if it fails, as 
+    # a rollback without a journal is undefined), and restore them. the 
+    # table is dropped if it fails. returns the number of rows
+    insert = "INSERT INTO \"{0}\" VALUES ({1})".format(name, 
+        ",".join("?" * len(header)))
+    journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+    synchronous = connection.execute("PRAGMA synchronous").fetchone()[0]
+    if not journal:
+        connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    n_rows = 0
+    try:
+        cursor = connection.cursor()
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if len(chunk) == 0:
+                break
+            cursor.executemany(insert, chunk)
+            connection.commit()
+            n_rows = n_rows + len(chunk)
+    except Exception:
+        if journal:
+            connection.rollback()
+        connection.execute("DROP TABLE \"{0}\"".format(name))
+        connection.commit()
+        raise
+    finally:
+        connection.execute("PRAGMA journal_mode={0}".format(journal_mode))
+        connection.execute("PRAGMA synchronous={0}".format(synchronous))
+    return n_rows
+
+def get_sqlite3(db_path, csv_path=SPEC_D_CSV_FILENAME, where=":memory:",
+                cache=False, bulk=False, chunk_size=SQLITE3_CHUNK_SIZE,
+                index=False, infer=INFER_ALL):
     """
     Returns a SQLite3 database that backs a Spec D database. Does not check 
     that the database is valid. By default, will open an in-memory SQLite3,
@@ -465,7 +3169,38 @@ def get_sqlite3(db_path, csv_path=SPEC_D_CSV_FILENAME, where=":memory:"):
         where : string = ":memory:"
             where to back the SQLite3 on disk; ":memory:" is temporary in 
             memory
-            
+        cache : boolean = False
+            if True, read the rows from the binary cache, creating it if
+            it is missing or out of date (see get_cache)
+        bulk : boolean = False
+            if True, load the rows in transactions of *chunk_size* rows, 
+            with synchronous writes off. a new database on disk is built 
+            in memory, with the journal off, and then copied to *where* 
+            with sqlite3.Connection.backup (so the whole database needs 
+            to fit in memory)
+        chunk_size : integer = SQLITE3_CHUNK_SIZE
+            number of rows per transaction, if *bulk* is True, and the 
+            number of rows the types are first inferred from
+        index : boolean or list of strings = False
+            if True, index the parameter columns with enough distinct 
+            values, or if a list, index those columns, after the rows are
+            loaded (see create_sqlite3_indexes)
+        infer : string = INFER_ALL
+            how the column types are chosen. INFER_ALL infers them from 
+            the first *chunk_size* rows, promoting them in the order of 
+            empty, integer, float and string, and keeps promoting them 
+            over every chunk of rows as they are loaded. If a column 
+            needs to be promoted, its type is changed, and if a column of 
+            numbers needs to be text, the rows are loaded again (SQLite 
+            has converted the numbers). INFER_SAMPLE infers them from the first *chunk_size* 
+            rows and INFER_SAMPLE_ROWS random rows (see check_database), 
+            without checking them. None types them by the first row 
+            (with typecheck), which fails if it has an empty value. 
+            Unless it is None, and *bulk* is False, infinity is converted
+            to a number in the integer and real columns (SQLite converts
+            the rest). NaN is kept as text, as SQLite stores a NaN float 
+            as NULL
+
     returns:
         a SQLite3 database if successful, None if not. The table that
         backs the sqlite3 will be named by the base filename of *db_path*,
@@ -473,32 +3208,61 @@ def get_sqlite3(db_path, csv_path=SPEC_D_CSV_FILENAME, where=":memory:"):
         named "bar".
 
         strings will be text columns, floats will be real columns, and
-        integers will be integer columns. Column names will be determined
-        by the CSV headers.
+        integers will be integer columns, and columns without values are
+        text columns. Column names will be determined by the CSV headers.
 
     side-effects:
         will open a file on disk at *where* if given a POSIX path or URI
 
-        logs results to the logger for information and debugging
+        logs results to the logger for information and debugging, and 
+        the load throughput if *bulk* is True
     """
 
     log.info("Converting \"{0}/{1}\" into a SQLite database at \"{2}\".".
         format(db_path, csv_path, where))
 
     try:
+        start = time.perf_counter()
+        # a new database on disk is built in memory, and backed up to disk
+        backup = bulk and where != ":memory:" and \
+                 not where.startswith("file:") and \
+                 hasattr(sqlite3.Connection, "backup") and \
+                 (not os.path.exists(where) or os.path.getsize(where) == 0)
+
         # open the sqlite3
-        db = sqlite3.connect(where)
+        db = sqlite3.connect(":memory:" if backup else where)
         cursor = db.cursor()
 
         # open the cinema db
-        cdb = get_iterator(db_path, csv_path)
+        cdb = get_iterator(db_path, csv_path, cache=cache)
 
-        # get the header and first row
+        # get the header and the column types
         header = next(cdb)
         log.info("Header is {0}.".format(header))
-        first = next(cdb)
-        log.info("First row is {0}.".format(first))
-        types = typecheck(first)
+        if infer is None:
+            first = next(cdb)
+            log.info("First row is {0}.".format(first))
+            types = typecheck(first)
+            cdb = chain((first,), cdb)
+        elif infer in (INFER_ALL, INFER_SAMPLE):
+            first = list(islice(cdb, chunk_size))
+            types = __infer_types(iter(first), [TYPE_EMPTY] * len(header), 
+                                  chunk_size)
+            fn = __csv_filename(db_path, csv_path)
+            if infer == INFER_SAMPLE and len(first) == chunk_size and \
+               __compression(fn) is None:
+                sample = __sample_rows(db_path, csv_path, fn, None, 
+                                       INFER_SAMPLE_ROWS, 0)[2]
+                types = __infer_types((row for label, row in sample 
+                                       if row is not None), types, 
+                                      chunk_size)
+            # the types of all of the rows are inferred as they are loaded
+            if infer == INFER_ALL:
+                inferred = list(types)
+                cdb = __inferred_rows(cdb, inferred, chunk_size)
+            cdb = chain(first, cdb)
+        else:
+            raise ValueError("unknown type inference \"{0}\"".format(infer))
         log.info("Types are {0}.".format(types))
 
         # figure out the table name
@@ -506,21 +3270,58 @@ def get_sqlite3(db_path, csv_path=SPEC_D_CSV_FILENAME, where=":memory:"):
                 os.path.split(os.path.normpath(db_path))[1])[0]
         log.info("Table name is \"{0}\".".format(name))
 
-        # create the table
-        create = "CREATE TABLE \"{0}\" (".format(name)
-        for h, t in zip(header, types):
-            create = create + "\"" + h + "\" " + CDB_TO_SQLITE3[t] + ","
-        create = create[:-1] + ")"
-        log.info("Create table string is \"{0}\".".format(create))
-        cursor.execute(create)
+        # create the table, where a column without values is an integer
+        # column until all of the values are checked, or a text column
+        empty = TYPE_INTEGER if infer == INFER_ALL else TYPE_STRING
+        declared = [t if t != TYPE_EMPTY or infer is None else empty 
+                    for t in types]
+        create_sqlite3_table(cursor, name, header, declared)
 
         # insert the data
         insert = "INSERT INTO \"{0}\" VALUES (%s)".format(name) % \
-                 ",".join("?"*len(first))
+                 ",".join("?"*len(header))
         log.info("Insert string is \"{0}\".".format(insert))
-        cursor.execute(insert, first)
-        cursor.executemany(insert, cdb)
-        db.commit()
+        def load(rows):
+            if bulk:
+                return __bulk_load(db, name, header, rows, chunk_size, 
+                                   not (backup or where == ":memory:"))
+            cursor.executemany(insert, rows)
+            db.commit()
+            return max(cursor.rowcount, 0)
+        n_rows = load(cdb)
+
+        # promote the types by all of the values, reloading the rows if
+        # numbers need to be text
+        if infer == INFER_ALL:
+            types = [t if t != TYPE_EMPTY else TYPE_STRING for t in inferred]
+            if types != declared:
+                log.info("Types of all of the values are {0}.".format(types))
+                if any(t == TYPE_STRING and u != TYPE_STRING 
+                       for t, u in zip(inferred, declared)):
+                    cursor.execute("DROP TABLE \"{0}\"".format(name))
+                    create_sqlite3_table(cursor, name, header, types)
+                    cdb = get_iterator(db_path, csv_path, cache=cache)
+                    next(cdb)
+                    n_rows = load(cdb)
+                else:
+                    __retype_table(db, name, header, types)
+        if bulk or infer is not None:
+            __convert_infinite(db, name, header, types)
+
+        if index and create_sqlite3_indexes(db, name, 
+                None if index is True else index) is None:
+            raise ValueError("unable to index \"{0}\"".format(name))
+        if backup:
+            disk = sqlite3.connect(where)
+            db.backup(disk)
+            db.close()
+            db = disk
+        if bulk:
+            seconds = time.perf_counter() - start
+            log.info("Loaded {0} rows into \"{1}\" in {2:.3f} s, {3:.0f} "
+                     "rows/s.".format(n_rows, name, seconds, 
+                                      n_rows / seconds if seconds > 0 
+                                      else 0))
 
         # done!
         log.info("Insertion of data into \"{0}\" was successful.".format(name))
@@ -529,6 +3330,385 @@ def get_sqlite3(db_path, csv_path=SPEC_D_CSV_FILENAME, where=":memory:"):
         log.error("Error in creating database: {0}.".format(e))
         return None
 
+def __quote_identifier(name):
+    # quote a table or column name for a SQL statement
+    return "\"" + name.replace("\"", "\"\"") + "\""
+
+def __table_columns(connection, table):
+    # return the (names, declared types) of the columns of a table or view,
+    # that is checked to exist with a bound parameter, as a table name 
+    # can't be one
+    if connection.execute("SELECT count(*) FROM sqlite_master WHERE "
+                          "type IN ('table', 'view') AND name = ?", 
+                          (table,)).fetchone()[0] == 0:
+        raise ValueError("no table or view named \"{0}\"".format(table))
+    info = connection.execute("PRAGMA table_info({0})".format(
+        __quote_identifier(table))).fetchall()
+    return ([i[1] for i in info], [i[2] for i in info])
+
+def create_sqlite3_indexes(connection, table, columns=None, 
+                           selectivity=SQLITE3_INDEX_SELECTIVITY):
+    """
+    Create indexes on the parameter (non-FILE) columns of a table, so that
+    selecting rows by them (see query_sqlite3) doesn't scan the table, 
+    and analyze the table, so that SQLite uses the most selective index.
+
+    arguments:
+        connection : SQLite3 connection object
+            a connection to a SQLite3 database
+        table : string
+            the name of the table
+        columns : list of strings = None
+            the columns to index, or None to index the parameter columns
+            where a value matches, on average, at most *selectivity* of 
+            the rows, i.e., that have at least 1 / *selectivity* distinct
+            values
+        selectivity : float = SQLITE3_INDEX_SELECTIVITY
+            the largest average fraction of the rows matching a value of
+            a column that is indexed, if *columns* is None
+
+    returns:
+        a list of the columns that were indexed, or None on error
+
+    side effects:
+        creates indexes named "<table>_<column>" in the database
+
+        logs error and info messages to the logger
+    """
+
+    try:
+        names = __table_columns(connection, table)[0]
+        if columns is None:
+            candidates = [n for n in names if not is_file_column(n)]
+            if len(candidates) == 0:
+                return []
+            counts = connection.execute("SELECT {0} FROM {1}".format(
+                ",".join(["count(DISTINCT {0})".format(__quote_identifier(c)) 
+                          for c in candidates]), 
+                __quote_identifier(table))).fetchone()
+            columns = [c for c, n in zip(candidates, counts) 
+                       if n > 1 and n * selectivity >= 1]
+        else:
+            for c in columns:
+                if c not in names:
+                    raise ValueError("no column named \"{0}\"".format(c))
+
+        start = time.perf_counter()
+        for c in columns:
+            connection.execute("CREATE INDEX IF NOT EXISTS {0} ON {1} "
+                "({2})".format(__quote_identifier(table + "_" + c), 
+                               __quote_identifier(table), 
+                               __quote_identifier(c)))
+        if len(columns) > 0:
+            connection.execute("ANALYZE {0}".format(
+                __quote_identifier(table)))
+        connection.commit()
+        log.info("Indexed columns {0} of \"{1}\" in {2:.3f} s.".format(
+            columns, table, time.perf_counter() - start))
+        return columns
+    except Exception as e:
+        log.error("Error in indexing \"{0}\": {1}.".format(table, e))
+        return None
+
+def query_sqlite3(connection, table, conditions, 
+                  column=FILE_HEADER_KEYWORD, limit=None):
+    """
+    Return the values of a column (by default, the FILE paths) in the rows
+    of a table that match conditions on other columns, with a statement 
+    where the values are bound parameters. The statement is the same for 
+    conditions of the same form, so the sqlite3 module reuses it, prepared.
+
+    arguments:
+        connection : SQLite3 connection object
+            a connection to a SQLite3 database
+        table : string
+            the name of the table
+        conditions : dictionary
+            column name => condition, where a list, tuple or set selects
+            the values in it, a slice(lo, hi) selects lo <= value <= hi 
+            (either can be None, for no bound), None selects empty values,
+            and anything else selects the values equal to it, as in 
+            spec.a.select_values
+        column : string = FILE_HEADER_KEYWORD
+            the column to return, or None to return the whole rows
+        limit : integer = None
+            the largest number of rows to return, or None for all of them
+
+    returns:
+        a list of the values of *column* (or the tuples of the rows, if 
+        *column* is None) in the matching rows, in the order of the rows,
+        or None on error
+
+    side effects:
+        logs error messages to the logger
+    """
+
+    try:
+        names = __table_columns(connection, table)[0]
+        terms = []
+        values = []
+        for c in list(conditions.keys()) + \
+                 ([column] if column is not None else []):
+            if c not in names:
+                raise ValueError("no column named \"{0}\"".format(c))
+        for c, condition in conditions.items():
+            q = __quote_identifier(c)
+            if condition is None:
+                terms.append("{0} IS NULL".format(q))
+            elif isinstance(condition, slice):
+                if condition.start is not None:
+                    terms.append("{0} >= ?".format(q))
+                    values.append(condition.start)
+                if condition.stop is not None:
+                    terms.append("{0} <= ?".format(q))
+                    values.append(condition.stop)
+            elif isinstance(condition, (list, tuple, set, frozenset)):
+                # NULL is never IN a list, so empty values are tested apart
+                non_null = [v for v in condition if v is not None]
+                term = "{0} IN ({1})".format(q, ",".join("?" * len(non_null)))
+                if len(non_null) < len(condition):
+                    term = "({0} OR {1} IS NULL)".format(term, q) \
+                           if len(non_null) > 0 else "{0} IS NULL".format(q)
+                terms.append(term)
+                values.extend(non_null)
+            elif callable(condition):
+                raise ValueError("condition on \"{0}\" is a function".format(
+                    c))
+            else:
+                terms.append("{0} = ?".format(q))
+                values.append(condition)
+        select = "SELECT {0} FROM {1}{2} ORDER BY rowid{3}".format(
+            __quote_identifier(column) if column is not None else "*", 
+            __quote_identifier(table),
+            " WHERE " + " AND ".join(terms) if len(terms) > 0 else "",
+            " LIMIT ?" if limit is not None else "")
+        if limit is not None:
+            values.append(limit)
+        rows = connection.execute(select, values)
+        if column is None:
+            return [tuple(row) for row in rows]
+        return [row[0] for row in rows]
+    except Exception as e:
+        log.error("Error in querying \"{0}\": {1}.".format(table, e))
+        return None
+
+def __sidecar_filename(db_path, csv_path):
+    return os.path.join(db_path, csv_path + SQLITE3_EXT)
+
+def __read_sidecar(connection):
+    # read the (size, mtime, digest, offset, prefix digest) of the CSV that
+    # the sidecar was loaded from, or None
+    try:
+        row = connection.execute("SELECT size, mtime, digest, offset, prefix "
+            "FROM \"{0}\"".format(SQLITE3_SIDECAR_TABLE)).fetchone()
+        return tuple(row) if row is not None else None
+    except Exception:
+        return None
+
+def __write_sidecar(connection, signature, offset, prefix):
+    # record the signature of the CSV that the sidecar was loaded from, 
+    # and the byte offset after the last row and the MD5 of the bytes 
+    # before it (None if rows can't be appended)
+    connection.execute("CREATE TABLE IF NOT EXISTS \"{0}\" (size INTEGER, "
+        "mtime INTEGER, digest BLOB, offset INTEGER, prefix BLOB)".format(
+        SQLITE3_SIDECAR_TABLE))
+    connection.execute("DELETE FROM \"{0}\"".format(SQLITE3_SIDECAR_TABLE))
+    connection.execute("INSERT INTO \"{0}\" VALUES (?,?,?,?,?)".format(
+        SQLITE3_SIDECAR_TABLE), (signature[0], signature[1], signature[2], 
+                                 offset, prefix))
+
+def append_sqlite3(connection, db_path, offset, csv_path=SPEC_D_CSV_FILENAME,
+                   table=None):
+    """
+    Insert the complete rows after a byte offset in a Spec D CSV into the
+    table of a SQLite3 database from get_sqlite3, e.g., the rows that were
+    appended to the CSV since it was loaded. The types of the columns are
+    promoted by the new rows, in chunks of SQLITE3_CHUNK_SIZE rows, as 
+    get_sqlite3 does with INFER_ALL, and if a column would have a wider 
+    type (e.g., a float in an integer column, or a number in a text column
+    without values), it fails, as the table needs to be loaded again. 
+    Does not commit, so the rows inserted before it fails can be rolled 
+    back.
+
+    arguments:
+        connection : SQLite3 connection object
+            a connection to a SQLite3 database from get_sqlite3
+        db_path : string
+            POSIX path to Cinema database
+        offset : integer
+            byte offset of the first row to insert, after the header
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        table : string = None
+            the name of the table, or None for the name get_sqlite3 uses
+
+    returns:
+        (number of rows inserted, byte offset after the last row)
+
+    raises:
+        ValueError if a row doesn't have the same number of columns as 
+        the table, or a column would have a wider type
+    """
+
+    if table is None:
+        table = os.path.splitext(
+            os.path.split(os.path.normpath(db_path))[1])[0]
+    header, declared = __table_columns(connection, table)
+    types = [SQLITE3_TO_CDB.get(t, TYPE_STRING) for t in declared]
+    insert = "INSERT INTO {0} VALUES ({1})".format(__quote_identifier(table), 
+        ",".join("?" * len(header)))
+
+    end = [offset]
+    def __rows(rows):
+        for row, stop in rows:
+            if len(row) != len(header):
+                raise ValueError("row has {0} columns, not {1}".format(
+                    len(row), len(header)))
+            end[0] = stop
+            yield row
+    after = connection.execute("SELECT max(rowid) FROM {0}".format(
+        __quote_identifier(table))).fetchone()[0]
+    cursor = connection.cursor()
+    rows = __rows(get_offset_iterator(db_path, offset, csv_path))
+    # the text columns that are known to have values
+    filled = [t != TYPE_STRING for t in types]
+    n_rows = 0
+    while True:
+        chunk = list(islice(rows, SQLITE3_CHUNK_SIZE))
+        if len(chunk) == 0:
+            break
+        # a text column without values is an empty column
+        chunk_types = list(types)
+        for i, values in enumerate(zip(*chunk)):
+            if not filled[i] and any(v is not None for v in values):
+                filled[i] = True
+                if connection.execute("SELECT NOT EXISTS (SELECT 1 FROM {0} "
+                    "WHERE {1} IS NOT NULL)".format(
+                        __quote_identifier(table), 
+                        __quote_identifier(header[i]))).fetchone()[0]:
+                    chunk_types[i] = TYPE_EMPTY
+        promoted = __infer_types(iter(chunk), chunk_types, SQLITE3_CHUNK_SIZE)
+        for h, t, u in zip(header, types, promoted):
+            if u != t:
+                raise ValueError("column \"{0}\" would be {1}, not "
+                                 "{2}".format(h, u, t))
+        cursor.executemany(insert, chunk)
+        n_rows = n_rows + len(chunk)
+    if n_rows > 0:
+        __convert_infinite(connection, table, header, types, after or 0)
+    return (n_rows, end[0])
+
+def get_sqlite3_sidecar(db_path, csv_path=SPEC_D_CSV_FILENAME, rebuild=False,
+                        cache=False, index=True):
+    """
+    Returns a SQLite3 database that backs a Spec D database, from a 
+    persistent SQLite3 file next to the CSV (csv_path + SQLITE3_EXT). It 
+    is reused as long as the size, modification time and hash of the CSV 
+    haven't changed (see get_cache). If rows have been appended to the CSV,
+    and the bytes before them are unchanged, only the complete new rows 
+    are inserted (see append_sqlite3), otherwise, or if they would widen 
+    the type of a column, it is rebuilt with get_sqlite3 (with *bulk*),
+    and atomically replaces the old one.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        csv_path : string = SPEC_D_CSV_FILENAME
+            POSIX relative path to Cinema CSV
+        rebuild : boolean = False
+            if True, always rebuild the SQLite3 file
+        cache : boolean = False
+            if True, read the rows from the binary cache when it is 
+            rebuilt (see get_sqlite3)
+        index : boolean or list of strings = True
+            the columns to index when it is rebuilt (see get_sqlite3)
+
+    returns:
+        a SQLite3 database if successful, None if not. The table is named
+        as in get_sqlite3, and the signature of the CSV is kept in the 
+        table SQLITE3_SIDECAR_TABLE. Rows can only be appended to a CSV 
+        that isn't compressed.
+
+    side effects:
+        writes out a SQLite3 file at csv_path + SQLITE3_EXT if it is 
+        missing or out of date
+
+        logs error and info messages to the logger
+    """
+
+    fn = __csv_filename(db_path, csv_path)
+    if fn is None:
+        log.error("File \"{0}\" does not exist.".format(
+            os.path.join(db_path, csv_path)))
+        return None
+    sidecar = __sidecar_filename(db_path, csv_path)
+    tmp = sidecar + "." + str(os.getpid())
+    name = os.path.splitext(os.path.split(os.path.normpath(db_path))[1])[0]
+
+    try:
+        signature = __file_signature(fn)
+        if not rebuild and os.path.isfile(sidecar):
+            connection = sqlite3.connect(sidecar)
+            stored = __read_sidecar(connection)
+            if stored is not None and stored[:3] == signature:
+                log.info("Reusing SQLite3 sidecar \"{0}\".".format(sidecar))
+                return connection
+
+            offset = stored[3] if stored is not None else None
+            md5 = None
+            if offset is not None and offset <= signature[0] and \
+               __compression(fn) is None:
+                md5 = __update_digest(fn, 0, offset)
+            if md5 is not None and md5.digest() == stored[4]:
+                try:
+                    start = time.perf_counter()
+                    n_rows, end = append_sqlite3(connection, db_path, 
+                                                 offset, csv_path, name)
+                    __write_sidecar(connection, signature, end, 
+                        __update_digest(fn, offset, end, md5).digest())
+                    connection.commit()
+                    log.info("Appended {0} rows to \"{1}\" in {2:.3f} "
+                             "s.".format(n_rows, sidecar, 
+                                         time.perf_counter() - start))
+                    return connection
+                except Exception as e:
+                    connection.rollback()
+                    log.info("Unable to append rows to \"{0}\": {1}".format(
+                        sidecar, e))
+            connection.close()
+
+        log.info("Building SQLite3 sidecar \"{0}\".".format(sidecar))
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        connection = get_sqlite3(db_path, csv_path, tmp, cache=cache, 
+                                 bulk=True, index=index)
+        if connection is None:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return None
+
+        # rows can be appended if the file didn't change while we read it,
+        # and it ends on a row boundary
+        offset = None
+        prefix = None
+        if __compression(fn) is None and signature == __file_signature(fn):
+            with open(fn, "rb") as f:
+                f.seek(max(signature[0] - 1, 0))
+                if f.read(1) == b"\n":
+                    offset = signature[0]
+                    prefix = __update_digest(fn, 0, offset).digest()
+        __write_sidecar(connection, signature, offset, prefix)
+        connection.commit()
+        connection.close()
+        os.replace(tmp, sidecar)
+        return sqlite3.connect(sidecar)
+    except Exception as e:
+        log.error("Error in creating SQLite3 sidecar \"{0}\": {1}".format(
+            sidecar, e))
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        return None
+
 def move_to_backup(db_path, csv_path=SPEC_D_CSV_FILENAME):
     """
     Rename the CSV in a Spec D database to a backup name.
@@ -543,29 +3723,131 @@ def move_to_backup(db_path, csv_path=SPEC_D_CSV_FILENAME):
         the relative filename of the renamed csv_path
 
     side effects:
-        renames old csv_path to csv_path.<epoch timestamp>.<md5 hash>
+        renames old csv_path to csv_path.<epoch timestamp>.<md5 hash>, 
+        or if it is compressed, csv_path.<ext>.<epoch timestamp>.<md5 hash>
+        where the hash is of the compressed data
     """
 
+    # get the paths
+    full_fn = __csv_filename(db_path, csv_path)
+    if full_fn is None:
+        full_fn = os.path.join(db_path, csv_path)
+    csv_path = csv_path + full_fn[len(os.path.join(db_path, csv_path)):]
+
     # calculate the hash and time stamp
     h = hashlib.md5()
-    with open(os.path.join(db_path, csv_path)) as f:
-        line = f.read(4096)
-        while line != '':
-            h.update(line.encode('utf-8'))
+    if __compression(full_fn) is not None:
+        with open(full_fn, "rb") as f:
+            block = f.read(READ_BLOCK_SIZE)
+            while block != b'':
+                h.update(block)
+                block = f.read(READ_BLOCK_SIZE)
+    else:
+        with open(full_fn) as f:
             line = f.read(4096)
-        h = h.hexdigest()
+            while line != '':
+                h.update(line.encode('utf-8'))
+                line = f.read(4096)
+    h = h.hexdigest()
     t = int(time.time())
 
-    # get the paths
-    full_fn = os.path.join(db_path, csv_path)
     backup = csv_path + '.' + str(t) + '.' + h
     full_backup = os.path.join(db_path, backup) 
     os.rename(full_fn, full_backup)
 
     return backup
 
+def __column_writer(new_header):
+    # return a function that writes a row with new columns, which places 
+    # them immediately before the FILE columns, unless they are FILE columns
+    output_row = [None] * len(new_header)
+
+    # calculate where to put the new columns
+    isnt_file = [not is_file_column(i) for i in new_header]
+    left = 0 # start of non files
+    right = sum(isnt_file) # start of files
+    swizzle = [0] * len(new_header) # index vector (permute)
+    for i in range(0, len(new_header)):
+        if isnt_file[i]:
+            swizzle[i] = left
+            left += 1
+        else:
+            swizzle[i] = right
+            right += 1
+
+    # create a row writing function
+    def write_row(writer, new_row):
+        for i in range(0, len(new_header)):
+            output_row[swizzle[i]] = new_row[i]
+        writer.writerow(output_row)
+    return write_row
+
+def append_columns_by_row_data(db_path, column_names, row_function, cursor,
+                               out_csv_path):
+    """
+    For the rows after a Cursor in a Cinema database, it will evaluate 
+    *row_function* on the database (passing the row data to the function)
+    and append the rows with the new column(s) to another CSV. When the 
+    rows are appended to the database over time, e.g., by a running 
+    simulation, repeating this with the same cursor writes the same CSV 
+    that add_columns_by_row_data would, processing only the new rows each
+    time.
+
+    arguments:
+        db_path : string
+            POSIX path to Cinema database
+        column_names : tuple of strings
+            the header name(s) for the new column(s), placed as in
+            add_columns_by_row_data
+        row_function : function(row: tuple of strings) => tuple of string
+            a function that takes a row tuple, and returns a tuple of strings
+            based on the row tuple. len of the return value must equal the 
+            len of column_names
+        cursor : Cursor
+            the position in the database CSV, which is advanced past the 
+            rows that are processed
+        out_csv_path : string
+            POSIX relative path to the CSV to append to, which must not be
+            the database CSV
+
+    returns:
+        the number of rows appended, or None if *out_csv_path* is the
+        database CSV
+
+    side effects:
+        appends rows to out_csv_path, and writes the header first if it 
+        is empty or doesn't exist
+    """
+
+    full_fn = os.path.join(db_path, out_csv_path)
+    if os.path.abspath(full_fn) == \
+       os.path.abspath(os.path.join(cursor.db_path, cursor.csv_path)):
+        log.error("Can't append new columns to \"{0}\", it is being "
+                  "read.".format(full_fn))
+        return None
+
+    rows = cursor.rows()
+    row = next(rows, None)
+    if cursor.header is None:
+        return 0
+
+    new_header = cursor.header + tuple(column_names)
+    write_row = __column_writer(new_header)
+
+    n_rows = 0
+    new = not os.path.exists(full_fn) or os.path.getsize(full_fn) == 0
+    with open(full_fn, "a") as out:
+        writer = csv.writer(out)
+        if new:
+            write_row(writer, new_header)
+        while row is not None:
+            write_row(writer, row + row_function(row))
+            n_rows = n_rows + 1
+            row = next(rows, None)
+    return n_rows
+
 def add_columns_by_row_data(db_path, column_names, row_function, 
-                           csv_path=SPEC_D_CSV_FILENAME):
+                           csv_path=SPEC_D_CSV_FILENAME, compression=None):
     """
     For every row in a Cinema database, it will evaluate *row_function*
     on the database (passing the row data to the function). This adds new
@@ -585,18 +3867,34 @@ def add_columns_by_row_data(db_path, column_names, row_function,
             row to compute new value(s). len of the return value must
             equal the len of column_names
         csv_path : string = SPEC_D_CSV_FILENAME
-            POSIX relative path to Cinema CSV
+            POSIX relative path to Cinema CSV, which may be compressed (see
+            get_iterator)
+        compression : string = None
+            compress the new csv_path with "gz", "bz2" or "xz", adding the 
+            extension from COMPRESSION_EXTS, or don't compress it if "". 
+            if None, it is compressed the same as the old csv_path
 
     returns:
         the name of the backup (previous version) csv_path
 
+    raises:
+        ValueError if the compression isn't supported
+
     side effects:
         writes a new csv_path and will rename the old csv_path to 
-        csv_path.<epoch timestamp>.<md5 hash>
+        csv_path.<epoch timestamp>.<md5 hash> (see move_to_backup), and
+        removes the index and cache of csv_path
     """
 
+    if compression and (compression not in COMPRESSION_EXTS or 
+                        (compression == "xz" and lzma is None)):
+        raise ValueError("Unsupported compression \"{0}\".".format(
+            compression))
+
     # create a backup
     backup = move_to_backup(db_path, csv_path)
+    if compression is None:
+        compression = __compression(os.path.join(db_path, backup))
     full_fn = os.path.join(db_path, csv_path)
 
     # get the data from the backup
@@ -605,115 +3903,126 @@ def add_columns_by_row_data(db_path, column_names, row_function,
 
     # output data
     new_header = header + column_names
-    output_row = [None] * len(new_header)
-
-    # calculate where to put the new columns
-    isnt_file = [not is_file_column(i) for i in new_header]
-    left = 0 # start of non files
-    right = sum(isnt_file) # start of files
-    swizzle = [0] * len(new_header) # index vector (permute)
-    for i in range(0, len(new_header)):
-        if isnt_file[i]:
-            swizzle[i] = left
-            left += 1
-        else:
-            swizzle[i] = right
-            right += 1
-
-    # create a row writing function
-    def write_row(writer, new_row):
-        for i in range(0, len(new_header)):
-            output_row[swizzle[i]] = new_row[i]
-        writer.writerow(output_row)
+    write_row = __column_writer(new_header)
 
     # write the new column data
-    with open(full_fn, "w") as out:
+    if compression:
+        full_fn = full_fn + COMPRESSION_EXTS[compression]
+        out = io.TextIOWrapper(__open_compressed(full_fn, "wb", compression),
+                               encoding="utf-8")
+    else:
+        out = open(full_fn, "w")
+    with out:
         writer = csv.writer(out)
         # write the new header
         write_row(writer, new_header)
         # write the new rows
         for row in rows:
             write_row(writer, row + row_function(row))
+    __remove_sidecars(db_path, csv_path)
 
     # return the backup filename
     return backup
 
 def get_sqlite3_to_csv(
-        connection, table, db_path, csv_path=SPEC_D_CSV_FILENAME):
+        connection, table, db_path, csv_path=SPEC_D_CSV_FILENAME, 
+        query=None, parameters=(), batch_size=SQLITE3_CHUNK_SIZE):
     """
-    Given a SQLite3 connection, convert the table to a Spec D compliant
-    CSV file. Returns the iterator to the CSV, otherwise it returns None
-    on error.
+    Given a SQLite3 connection, convert the table, view or the rows of a 
+    query to a Spec D compliant CSV file. Returns the iterator to the CSV,
+    otherwise it returns None on error.
+
+    The rows are fetched and written in batches, with the FILE columns 
+    moved to the end, into a temporary file that is renamed to the CSV 
+    when it is complete, so an error leaves the old CSV as it was.
 
     arguments:
         connection : SQLite3 connection object
             a connection to a SQLite3 database
         table : string
-            the name of the table to convert
+            the name of the table or view to convert, if *query* is None
         db_path : string
             POSIX path to Cinema database
         csv_path : string = SPEC_D_CSV_FILENAME
             POSIX relative path to Cinema CSV
+        query : string = None
+            if not None, a SQL query to convert the rows of, instead of 
+            *table*, where the columns are named by the query
+        parameters : sequence or dictionary = ()
+            the parameters bound to the query
+        batch_size : integer = SQLITE3_CHUNK_SIZE
+            the number of rows fetched and written at once
 
     returns:
         an iterator to the Cinema database (from get_iterator)
 
     side effects:
         writes out a csv file that is the conversion of the table
-        from the sqlite3 database
+        from the sqlite3 database, and removes its index and cache. The 
+        old csv file is renamed to a backup (see move_to_backup)
+
+        logs the number of rows written and the throughput to the logger
     """
+
+    fn = os.path.join(db_path, csv_path) 
+    tmp = fn + "." + str(os.getpid())
     try:
-        # backup the file if it exists
-        fn = os.path.join(db_path, csv_path) 
-        if os.path.isfile(fn):
-            move_to_backup(db_path, csv_path)
+        start = time.perf_counter()
 
         # get the header
         cursor = connection.cursor() 
-        header = cursor.execute("pragma table_info(%s)" % table).fetchall()
-        log.info("SQLite header is {0}.".format(header))
-        names = [row[1] for row in header]
+        if query is None:
+            names, declared = __table_columns(connection, table)
+            log.info("SQLite header is {0}.".format(
+                list(zip(names, declared))))
+            types = [SQLITE3_TO_CDB.get(t, TYPE_STRING) for t in declared]
+            log.info("Cinema types are {0}.".format(types))
+            cursor.execute("SELECT * FROM {0}".format(
+                __quote_identifier(table)))
+        else:
+            log.info("Query is \"{0}\".".format(query))
+            cursor.execute(query, parameters)
+            if cursor.description is None:
+                raise ValueError("the query doesn't return rows")
+            names = [c[0] for c in cursor.description]
         log.info("Cinema columns are {0}.".format(names))
-        types = [SQLITE3_TO_CDB[row[2]] for row in header]
-        log.info("Cinema types are {0}.".format(types))
-
-        # calculate where to put the new columns
-        isnt_file = [not is_file_column(i) for i in names]
-        left = 0 # start of non files
-        right = sum(isnt_file) # start of files
-        swizzle = [0] * len(names) # index vector (permute)
-        for i in range(0, len(names)):
-            if isnt_file[i]:
-                swizzle[i] = left
-                left += 1
-            else:
-                swizzle[i] = right
-                right += 1
-        log.info("Column reordering is {0}.".format(swizzle))
-
-        # create a row writing function
-        n_columns = len(swizzle)
-        output_row = [None]*n_columns
-        def write_row(writer, new_row):
-            for i in range(0, len(swizzle)):
-                output_row[swizzle[i]] = new_row[i]
-            writer.writerow(output_row)
-
-        # write the column data
-        with open(fn, "w") as out:
+
+        # the order of the columns, with the files at the end
+        order = [i for i, n in enumerate(names) if not is_file_column(n)] + \
+                [i for i, n in enumerate(names) if is_file_column(n)]
+        log.info("Column order is {0}.".format(order))
+        reorder = operator.itemgetter(*order) if len(order) != 1 else \
+                  (lambda row: (row[0],))
+
+        # write the rows
+        n_rows = 0
+        with open(tmp, "w") as out:
             writer = csv.writer(out)
-            # write the new header
-            write_row(writer, names)
-            # write the new rows
-            for row in cursor.execute("select * from %s" % table):
-                write_row(writer, row)
+            writer.writerow(reorder(names))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                writer.writerows(map(reorder, rows))
+                n_rows = n_rows + len(rows)
+
+        # backup the file if it exists, and replace it
+        if __csv_filename(db_path, csv_path) is not None:
+            move_to_backup(db_path, csv_path)
+        os.replace(tmp, fn)
+        __remove_sidecars(db_path, csv_path)
 
+        seconds = time.perf_counter() - start
+        log.info("Wrote {0} rows to \"{1}\" in {2:.3f} s, {3:.0f} "
+                 "rows/s.".format(n_rows, fn, seconds, 
+                                  n_rows / seconds if seconds > 0 else 0))
         return get_iterator(db_path, csv_path)
     except Exception as e:
         log.error("Error in creating database: {0}.".format(e))
+        if os.path.exists(tmp):
+            os.unlink(tmp)
         return None
 
-
 def add_column_by_row_data(db_path, column_name, row_function, 
                            csv_path=SPEC_D_CSV_FILENAME):
     """
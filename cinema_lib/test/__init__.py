@@ -5,6 +5,7 @@ Unit/regression testing for cinema_lib.
 from ..spec import a
 from ..spec import d
 from .. import spec
+from .. import server
 
 import os
 import logging as log
@@ -14,6 +15,17 @@ import tempfile as temp
 import shutil as sh
 from functools import reduce
 import filecmp
+import io
+import json
+import sqlite3
+import random
+import gzip
+import bz2
+import lzma
+import threading
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor
         
 TEST_PATH = "cinema_lib/test/data"
 
@@ -26,6 +38,94 @@ def unittest_verbosity():
         frame = frame.f_back
     return 0
 
+def reference_row_generator(f, strict=False):
+    """
+    The original character-at-a-time Spec D tokenizer. It is kept as a
+    reference for regression testing and benchmarking the block-buffered
+    tokenizer in cinema_lib.spec.d.
+
+    arguments:
+        f : text file object
+            the open CSV file
+        strict : boolean = False
+            raise an Exception on RFC-4180 parsing errors
+
+    returns:
+        an iterator that returns a list of data per row
+    """
+
+    row = [] 
+    quote_count = 0
+    quoted = False
+    column = ""
+    any_quotes = False
+
+    ch = f.read(1)
+    while ch != '':
+        if quoted:
+            if ch == '"':
+                if quote_count == 1:
+                    quote_count = 0
+                    column = column + ch
+                else:
+                    quote_count = 1
+            else:
+                if quote_count == 1:
+                    if ch == '\n':
+                        row.append(None) if len(column) == 0 and \
+                            not any_quotes else row.append(column)
+                        yield row
+                        row = []
+                        column = ""
+                        any_quotes = False
+                    elif ch == ',':
+                        row.append(None) if len(column) == 0 and \
+                            not any_quotes else row.append(column)
+                        column = ""
+                        any_quotes = False
+                    else:
+                        if strict:
+                            raise Exception(
+                                "String found after closing quote.")
+                    quote_count = 0
+                    quoted = False
+                else:
+                    column = column + ch
+        elif quote_count == 1:
+            if len(column) == 0:
+                quoted = True
+                if ch != '"':
+                    quote_count = 0
+                    column = column + ch
+            else:
+                if strict:
+                    raise Exception("String found before opening quote.")
+        elif ch == '"':
+            quote_count = 1
+            any_quotes = True
+        elif ch == '\n':
+            if len(column) > 0 or len(row) > 0:
+                row.append(None) if len(column) == 0 and \
+                    not any_quotes else row.append(column)
+                yield row
+            row = []
+            column = ""
+            any_quotes = False
+        elif ch == ',':
+            row.append(None) if len(column) == 0 and \
+                not any_quotes else row.append(column)
+            column = ""
+            any_quotes = False
+        else:
+            column = column + ch
+        ch = f.read(1)
+
+    if len(row) > 0:
+        if len(column) > 0:
+            row.append(None) if len(column) == 0 and \
+                not any_quotes else row.append(column)
+        yield row
+
 class SpecA(unittest.TestCase):
     """
     Tests for the cinema_lib.spec.a module.
@@ -66,11 +166,171 @@ class SpecA(unittest.TestCase):
         self.assertTrue(a.check_database(self.SPHERE_DATA, "no_files.json",
                         quick=True)) 
 
+    def test_sphere_workers(self):
+        for verify in (None, d.VERIFY_SIZE, d.VERIFY_CHECKSUM):
+            self.assertTrue(a.check_database(self.SPHERE_DATA, 
+                                             list_workers=4, verify=verify))
+            self.assertFalse(a.check_database(self.SPHERE_DATA, 
+                                              "missing_no.json", 
+                                              list_workers=1, verify=verify))
+        self.assertFalse(a.check_database(self.SPHERE_DATA, verify="nope"))
+
     def test_sphere_iterator(self):
         it = a.get_iterator(self.SPHERE_DATA)
         self.assertEqual(next(it), ("phi", "theta", "FILE"))
         self.assertEqual(len([i for i in it]), 20)
 
+    def test_sphere_view(self):
+        view = a.get_view(self.SPHERE_DATA)
+        rows = list(a.get_iterator(self.SPHERE_DATA))
+        self.assertEqual(view.header, rows[0])
+        rows = rows[1:]
+        self.assertEqual(len(view), 20)
+        self.assertEqual(list(view), rows)
+        self.assertEqual(list(reversed(view)), rows[::-1])
+        for i in range(-len(rows), len(rows)):
+            self.assertEqual(view[i], rows[i])
+        for i in (slice(None), slice(3, 11, 3), slice(-5, None), 
+                  slice(None, None, -2), slice(30, 40)):
+            self.assertEqual(view[i], rows[i])
+        for i, row in enumerate(rows):
+            self.assertEqual(view.index(row[:-1]), i)
+            self.assertEqual(view.lookup(row[:-1]), (i, row[-1]))
+            self.assertTrue(row in view)
+        for i in (20, -21):
+            with self.assertRaises(IndexError):
+                view[i]
+        for values in ((-180, 1), (0,), ("-180", 0)):
+            with self.assertRaises(ValueError):
+                view.index(values)
+            self.assertFalse(values in view)
+        self.assertFalse((-180, 0, "0/-180.png") in view)
+        self.assertIsNone(a.get_view(self.SPHERE_DATA, "nope.json"))
+        self.assertIsNone(a.get_view(self.SPHERE_DATA, "no_data.json"))
+
+        # a large parameter space
+        db = {a.KEY_NAME_PATTERN: "{a}/{b}_{c}_{d}_{e}.png",
+              a.KEY_ARGUMENTS: {k: {a.KEY_ARG_VALUES: list(range(0, 100))} 
+                                for k in "abcde"}}
+        db[a.KEY_ARGUMENTS]["c"][a.KEY_ARG_VALUES] = ["x", "y", "z"]
+        view = a.View(db)
+        self.assertEqual(len(view), 3 * 10 ** 8)
+        self.assertEqual(view[0], (0, 0, "x", 0, 0, "0/0_x_0_0.png"))
+        self.assertEqual(view[-1], (99, 99, "z", 99, 99, "99/99_z_99_99.png"))
+        self.assertEqual(view[123456789], 
+                         (41, 15, "x", 67, 89, "41/15_x_67_89.png"))
+        self.assertEqual(view.index((41, 15, "x", 67, 89)), 123456789)
+        self.assertEqual(view[10 ** 7 - 2:10 ** 7 + 1], 
+            [(3, 33, "x", 99, 98, "3/33_x_99_98.png"), 
+             (3, 33, "x", 99, 99, "3/33_x_99_99.png"),
+             (3, 33, "y", 0, 0, "3/33_y_0_0.png")])
+
+    def test_sphere_selection(self):
+        rows = list(a.get_iterator(self.SPHERE_DATA))
+        for selection, test in (
+                ({"phi": [90, 0, 1]}, lambda r: r[0] in (0, 90)),
+                ({"phi": slice(-36, 36)}, lambda r: -36 <= r[0] <= 36),
+                ({"phi": slice(None, -144), "theta": 0}, 
+                 lambda r: r[0] <= -144),
+                ({"phi": lambda v: v % 36 == 0}, lambda r: r[0] % 36 == 0),
+                ({"phi": "0"}, lambda r: False),
+                ({"phi": slice("a", None)}, lambda r: False),
+                ({}, lambda r: True)):
+            expected = rows[:1] + [r for r in rows[1:] if test(r)]
+            self.assertEqual(list(a.get_iterator(self.SPHERE_DATA, 
+                                                 selection=selection)),
+                             expected)
+            view = a.get_view(self.SPHERE_DATA, selection=selection)
+            self.assertEqual(len(view), len(expected) - 1)
+            self.assertEqual(view[:], expected[1:])
+        self.assertIsNone(a.get_iterator(self.SPHERE_DATA, 
+                                         selection={"nope": 0}))
+        self.assertIsNone(a.get_view(self.SPHERE_DATA, 
+                                     selection={"nope": 0}))
+
+        # a few rows of a large parameter space
+        db = {a.KEY_NAME_PATTERN: "{a}/{b}_{c}_{d}_{e}.png",
+              a.KEY_ARGUMENTS: {k: {a.KEY_ARG_VALUES: list(range(0, 100))} 
+                                for k in "abcde"}}
+        view = a.View(db).select({"a": [50, 10], "c": slice(10, 12), 
+                                  "e": 99, "d": lambda v: v < 2})
+        self.assertEqual(len(view), 2 * 100 * 3 * 2)
+        self.assertEqual(view[0], (10, 0, 10, 0, 99, "10/0_10_0_99.png"))
+        self.assertEqual(view[-1], (50, 99, 12, 1, 99, 
+                                    "50/99_12_1_99.png"))
+
+    def test_sphere_name_pattern(self):
+        keys = ("phi", "theta")
+        for pattern in ("{phi}/{theta}.png", "{phi:04d}_{theta!r}.png",
+                        "{{phi}}/{phi.real}/{theta:>{width}}.png",
+                        "{phi}{}.png", "{nope}.png"):
+            filename = a.compile_name_pattern(pattern, keys)
+            for values in ((-180, 0), (18, "a"), (0, 1.5)):
+                kwargs = dict(zip(keys, values), width=5)
+                try:
+                    expected = pattern.format(**kwargs)
+                except Exception as e:
+                    with self.assertRaises(type(e)):
+                        filename(*values)
+                    continue
+                if "width" not in pattern:
+                    self.assertEqual(filename(*values), expected)
+
+        # the pieces that the converters concatenate
+        self.assertEqual(a.parse_name_pattern("{{a}}{phi:04d}/{theta[0]!r}"
+                                              ".png", keys),
+                         [("{a}", 0, ":04d"), ("/", 1, "[0]!r"), 
+                          (".png", None, None)])
+        for pattern in ("{nope}.png", "{phi:>{theta}}.png", "{phi"):
+            with self.assertRaises(ValueError):
+                a.parse_name_pattern(pattern, keys)
+
+        files = a.get_filenames(self.SPHERE_DATA)
+        self.assertEqual(list(files), 
+                         [row[-1] for row in a.get_iterator(
+                          self.SPHERE_DATA)][1:])
+        self.assertIsNone(a.get_filenames(self.SPHERE_DATA, "nope.json"))
+
+    def test_sphere_columns(self):
+        try:
+            import numpy as np
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        rows = list(a.get_iterator(self.SPHERE_DATA))
+        columns = a.get_columns(self.SPHERE_DATA)
+        self.assertEqual(tuple(columns.keys()), rows[0])
+        self.assertEqual(columns["phi"].dtype, np.int64)
+        self.assertEqual(columns["FILE"].dtype.kind, "U")
+        self.assertEqual(list(zip(*[c.tolist() for c in columns.values()])),
+                         rows[1:])
+        self.assertEqual(tuple(a.get_columns(self.SPHERE_DATA, 
+                                             ["FILE", "theta"]).keys()),
+                         ("FILE", "theta"))
+        self.assertIsNone(a.get_columns(self.SPHERE_DATA, ["nope"]))
+        self.assertIsNone(a.get_columns(self.SPHERE_DATA, 
+                                        json_path="nope.json"))
+
+        # more than two arguments, with floats and strings
+        db = {a.KEY_NAME_PATTERN: "{x}_{y:.1f}_{z}.png",
+              a.KEY_ARGUMENTS: {"x": {a.KEY_ARG_VALUES: [3, 1, 2]},
+                                "y": {a.KEY_ARG_VALUES: [0.5, 1.5]},
+                                "z": {a.KEY_ARG_VALUES: ["a", "b", "c", "d"]}}}
+        path = temp.mkdtemp()
+        try:
+            with open(os.path.join(path, a.SPEC_A_JSON_FILENAME), "w") as f:
+                json.dump(db, f)
+            rows = list(a.get_iterator(path))
+            columns = a.get_columns(path)
+            self.assertEqual(columns["y"].dtype, np.float64)
+            self.assertEqual(columns["z"].dtype.kind, "U")
+            self.assertEqual(list(zip(*[c.tolist() 
+                                        for c in columns.values()])),
+                             rows[1:])
+        finally:
+            sh.rmtree(path)
+
     def test_sphere_wrong_filetype(self):
         self.assertFalse(a.check_database(self.SPHERE_DATA, 
                          d.SPEC_D_CSV_FILENAME))
@@ -276,6 +536,1381 @@ class SpecD(unittest.TestCase):
     def test_example7a(self):
         self.assertTrue(d.check_database(self.EXAMPLE6_DATA, "a.csv"))
 
+    def test_check_batch(self):
+        # the size of the batches of rows doesn't change the log, except
+        # for the number of files checked by the FileListing
+        class Records(log.Handler):
+            def emit(self, record):
+                if "directory listings" not in record.getMessage():
+                    self.records.append((record.levelname, 
+                                         record.getMessage()))
+        handler = Records()
+        logger = log.getLogger()
+        level = logger.level
+        logger.addHandler(handler)
+        logger.setLevel(log.DEBUG)
+        batch_size = d.CHECK_BATCH_SIZE
+        try:
+            for fn in ("data.csv", "files1.csv", "files2.csv", "files3.csv", 
+                       "files4.csv", "files5.csv", "nan.csv", "typecheck.csv",
+                       "whitespace.csv", "wrong_file1.csv", "wrong_num1.csv", 
+                       "wrong_types.csv", "empty_types.csv", 
+                       "improper_quoted_row_1.csv", 
+                       "improper_quoted_row_2.csv"):
+                results = []
+                for n in (1, 2, batch_size):
+                    d.CHECK_BATCH_SIZE = n
+                    handler.records = []
+                    results.append((d.check_database(self.SPHERE_DATA, fn),
+                                    handler.records))
+                self.assertEqual(results[0], results[1], fn)
+                self.assertEqual(results[0], results[2], fn)
+        finally:
+            d.CHECK_BATCH_SIZE = batch_size
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
+    def test_verify(self):
+        # errors are logged in row order with a thread pool
+        class Records(log.Handler):
+            def emit(self, record):
+                self.records.append((record.levelname, record.getMessage()))
+        handler = Records()
+        logger = log.getLogger()
+        level = logger.level
+        logger.addHandler(handler)
+        logger.setLevel(log.ERROR)
+        temp_path = temp.mkdtemp()
+        try:
+            sphere_data = os.path.join(temp_path, "sphere.cdb")
+            sh.copytree(self.SPHERE_DATA, sphere_data)
+            open(os.path.join(sphere_data, "18", "0.png"), "w").close()
+            os.unlink(os.path.join(sphere_data, "0", "0.png"))
+            for verify in (None, d.VERIFY_SIZE, d.VERIFY_CHECKSUM):
+                results = []
+                for workers, list_workers in ((1, 1), (1, 4), (4, 1)):
+                    handler.records = []
+                    results.append((d.check_database(sphere_data, 
+                                    workers=workers, verify=verify,
+                                    list_workers=list_workers), 
+                                    handler.records))
+                self.assertEqual(results[0], results[1])
+                self.assertEqual(results[0], results[2])
+                self.assertFalse(results[0][0])
+                self.assertEqual(len([r for r in results[0][1] 
+                                      if "is empty" in r[1]]), 
+                                 0 if verify is None else 1)
+                self.assertIn(("ERROR", "File \"{0}\" is missing.".format(
+                    os.path.join(sphere_data, "0", "0.png"))), 
+                    results[0][1])
+        finally:
+            sh.rmtree(temp_path)
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
+        listing = d.FileListing(self.SPHERE_DATA, 4)
+        self.assertEqual(listing.check(["0/0.png", "nope.png", "0"], 
+                                       d.VERIFY_CHECKSUM),
+                         [None, "is missing", "is missing"])
+        self.assertEqual(listing.error("nope.png"), "is missing")
+        with self.assertRaises(ValueError):
+            listing.check(["0/0.png"], "nope")
+
+    def test_verify_file_columns(self):
+        # the files of every FILE column are checked once, even when a 
+        # row has to be checked again to report an error
+        class Records(log.Handler):
+            def emit(self, record):
+                self.records.append(record.getMessage())
+        handler = Records()
+        handler.records = []
+        logger = log.getLogger()
+        level = logger.level
+        logger.addHandler(handler)
+        logger.setLevel(log.INFO)
+        temp_path = temp.mkdtemp()
+        try:
+            sphere_data = os.path.join(temp_path, "sphere.cdb")
+            sh.copytree(self.SPHERE_DATA, sphere_data)
+            with open(os.path.join(sphere_data, "two_files.csv"), "w") as f:
+                f.write("phi,FILE a,FILE b\n0,0/0.png,0/18.png\n"
+                        "1,18/0.png,nope.png\n")
+            self.assertFalse(d.check_database(sphere_data, 
+                "two_files.csv", verify=d.VERIFY_SIZE))
+            self.assertIn("Checked 4 files with 0 directory listings and "
+                          "4 stat calls, 0 stat calls avoided.", 
+                          handler.records)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+            sh.rmtree(temp_path)
+
+    def test_file_listing(self):
+        for workers in (1, 4):
+            listing = d.FileListing(self.SPHERE_DATA, workers)
+            paths = ["0/0.png", "0/18.png", "18/0.png", "0/nope.png", 
+                     "nope/0.png", "0", "0/", "", "data.csv", "./data.csv",
+                     "0/../data.csv", os.path.join(self.SPHERE_DATA, "0", 
+                                                   "0.png")]
+            listing.list(paths[:3])
+            self.assertEqual(listing.n_directories, 2)
+            for fn in paths:
+                self.assertEqual(listing.isfile(fn), os.path.isfile(
+                    os.path.join(self.SPHERE_DATA, fn)), fn)
+            self.assertEqual(listing.n_checks, len(paths))
+            self.assertEqual(listing.stats_avoided(), 
+                             max(0, listing.n_checks - listing.n_directories
+                                 - listing.n_stats))
+            self.assertTrue(listing.n_stats < len(paths))
+
+            # listing more directories than files checked avoids nothing
+            listing = d.FileListing(self.SPHERE_DATA, workers)
+            listing.list(paths[:3])
+            listing.isfile(paths[0])
+            listing.isfile(paths[3])
+            self.assertEqual((listing.n_checks, listing.n_directories), 
+                             (2, 2))
+            self.assertEqual(listing.stats_avoided(), 0)
+
+class ColumnsD(unittest.TestCase):
+    """
+    Tests for the columnar (NumPy) loader in the cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        self.SPHERE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+
+    def test_columns(self):
+        try:
+            import numpy as np
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        columns = d.get_columns(self.SPHERE_DATA)
+        self.assertEqual(tuple(columns.keys()), ("theta", "phi", "FILE"))
+        self.assertEqual(columns["theta"].dtype, np.int64)
+        self.assertEqual(columns["phi"].dtype, np.int64)
+        self.assertEqual(columns["FILE"].dtype.kind, "U")
+        rows = d.get_iterator(self.SPHERE_DATA)
+        next(rows)
+        for n, row in enumerate(rows):
+            self.assertEqual(columns["theta"][n], int(row[0]))
+            self.assertEqual(columns["phi"][n], int(row[1]))
+            self.assertEqual(columns["FILE"][n], row[2])
+        self.assertEqual(columns["phi"].sum(), 
+                         sum(range(-180, 180, 18)))
+
+    def test_columns_empty(self):
+        try:
+            import numpy as np
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        for chunk_size in (1, 3, 65536):
+            columns = d.get_columns(self.SPHERE_DATA, ["phi", 0], 
+                                    "empty_data.csv", chunk_size)
+            self.assertEqual(tuple(columns.keys()), ("phi", "theta"))
+            self.assertEqual(columns["phi"].dtype, np.int64)
+            self.assertEqual(columns["phi"].count(), 5)
+            self.assertEqual(columns["theta"].count(), 6)
+            self.assertEqual(columns["phi"].sum(), -180*3 - 162 - 144)
+            self.assertEqual(list(np.ma.getmaskarray(columns["theta"])),
+                [False, False, False, True, False, 
+                 True, True, True, False, False])
+
+    def test_columns_types(self):
+        try:
+            import numpy as np
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        for chunk_size in (1, 65536):
+            columns = d.get_columns(self.SPHERE_DATA, csv_path="nan.csv",
+                                    chunk_size=chunk_size)
+            self.assertEqual(columns["zero"].dtype, np.float64)
+            self.assertTrue(np.isnan(columns["zero"][1]))
+            self.assertEqual(columns["three"].dtype.kind, "U")
+            self.assertEqual(columns["three"][0], "not nan")
+            columns = d.get_columns(self.SPHERE_DATA, csv_path="typecheck.csv",
+                                    chunk_size=chunk_size)
+            self.assertEqual(columns["theta"].dtype, np.float64)
+            columns = d.get_columns(self.SPHERE_DATA, 
+                                    csv_path="wrong_types.csv",
+                                    chunk_size=chunk_size)
+            self.assertEqual(list(columns["theta"]), ["0.0", "0", "text"])
+            self.assertEqual(list(columns["FILE"]), [-180.0, -162.0, 1.0])
+
+    def test_columns_errors(self):
+        try:
+            import numpy as np
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        self.assertEqual(d.get_columns(self.SPHERE_DATA, ["foo"]), None)
+        self.assertEqual(d.get_columns(self.SPHERE_DATA, csv_path="foo.csv"),
+                         None)
+        columns = d.get_columns(self.SPHERE_DATA, csv_path="no_data.csv")
+        self.assertEqual(len(columns["theta"]), 0)
+
+class IndexD(unittest.TestCase):
+    """
+    Tests for the row index (random access) in the cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+        self.d_csv = os.path.join(self.SPHERE_DATA, d.SPEC_D_CSV_FILENAME)
+        self.d_index = self.d_csv + d.INDEX_EXT
+
+    def tearDown(self):
+        sh.rmtree(self.TEMP_PATH)
+
+    def test_rows(self):
+        for fn in ("data.csv", "empty_data.csv", "files4.csv", 
+                   "proper_quoted.csv", "proper_quoted_2.csv", 
+                   "newline_end.csv", "no_data.csv", "nan.csv"):
+            rows = list(d.get_iterator(self.SPHERE_DATA, fn))
+            data = rows[1:]
+            for n in range(0, len(data)):
+                self.assertEqual(d.get_row(self.SPHERE_DATA, n, fn), data[n])
+                self.assertEqual(d.get_row(self.SPHERE_DATA, n - len(data),
+                                           fn), data[n])
+            self.assertEqual(d.get_row(self.SPHERE_DATA, len(data), fn), 
+                             None)
+            self.assertEqual(list(d.get_rows(self.SPHERE_DATA, 0, 1000, fn)),
+                             data)
+            self.assertEqual(list(d.get_rows(self.SPHERE_DATA, 2, -1, fn)),
+                             data[2:-1])
+            reverse = list(d.get_reverse_iterator(self.SPHERE_DATA, fn))
+            self.assertEqual(reverse[0], rows[0])
+            self.assertEqual(reverse[1:], data[::-1])
+
+    def test_crlf_and_quotes(self):
+        fn = os.path.join(self.SPHERE_DATA, "crlf.csv")
+        with open(fn, "wb") as f:
+            f.write(b'a,b,FILE\r\n1,"x\r\ny",0/0.png\r\n\r\n'
+                    b'2,"""q"",r",\r\n3,,1/0.png')
+        data = list(d.get_iterator(self.SPHERE_DATA, "crlf.csv"))[1:]
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0][1], "x\ny")
+        self.assertEqual([d.get_row(self.SPHERE_DATA, n, "crlf.csv") 
+                          for n in range(0, 3)], data)
+
+    def test_index_file(self):
+        self.assertFalse(os.path.exists(self.d_index))
+        self.assertTrue(d.check_database(self.SPHERE_DATA, index=True))
+        self.assertTrue(os.path.exists(self.d_index))
+        self.assertEqual(len(d.get_row_index(self.SPHERE_DATA)), 21)
+        
+        # the index is rebuilt when the file changes
+        with open(self.d_csv, "a") as f:
+            f.write("0,180,180/0.png\n")
+        self.assertEqual(d.get_row(self.SPHERE_DATA, 20), 
+                         ("0", "180", "180/0.png"))
+        self.assertEqual(len(d.get_row_index(self.SPHERE_DATA)), 22)
+
+        # a stale index isn't used
+        os.unlink(self.d_index)
+        sh.copyfile(os.path.join(self.SPHERE_DATA, "files4.csv"), 
+                    self.d_csv)
+        self.assertEqual(d.get_row(self.SPHERE_DATA, 0),
+                         next(d.get_rows(self.SPHERE_DATA, 0, 1)))
+        self.assertEqual(len(d.get_row_index(self.SPHERE_DATA)), 4)
+
+class ParallelD(unittest.TestCase):
+    """
+    Tests for parsing and checking in parallel in the cinema_lib.spec.d 
+    module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # split the test files into many chunks
+        self.MIN_CHUNK_SIZE = d.PARALLEL_MIN_CHUNK_SIZE
+        d.PARALLEL_MIN_CHUNK_SIZE = 32
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+
+    def tearDown(self):
+        d.PARALLEL_MIN_CHUNK_SIZE = self.MIN_CHUNK_SIZE
+        sh.rmtree(self.TEMP_PATH)
+
+    def test_chunks(self):
+        fn = os.path.join(self.SPHERE_DATA, "proper_quoted_2.csv")
+        chunks = d.get_chunks(self.SPHERE_DATA, "proper_quoted_2.csv", 4)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], os.path.getsize(fn))
+        for a, b in zip(chunks[:-1], chunks[1:]):
+            self.assertEqual(a[1], b[0])
+
+        # boundaries are on rows, and the same with an index
+        offsets = d.get_row_index(self.SPHERE_DATA, "proper_quoted_2.csv")
+        for start, stop in chunks[1:]:
+            self.assertTrue(start in offsets)
+        self.assertEqual(
+            d.get_chunks(self.SPHERE_DATA, "proper_quoted_2.csv", 4), chunks)
+
+        self.assertEqual(d.get_chunks(self.SPHERE_DATA, "nope.csv", 4), None)
+
+    def test_iterator(self):
+        for fn in ("data.csv", "proper_quoted.csv", "proper_quoted_2.csv",
+                   "newline_end.csv", "nan.csv", "typecheck.csv"):
+            self.assertEqual(
+                list(d.get_iterator(self.SPHERE_DATA, fn, workers=3)),
+                list(d.get_iterator(self.SPHERE_DATA, fn)))
+        with self.assertRaises(Exception):
+            list(d.get_iterator(self.SPHERE_DATA, 
+                                "improper_quoted_row_1.csv", True, 2))
+
+        # more chunks than are parsed ahead, and the iterator can be 
+        # closed before all of them are consumed
+        self.assertTrue(len(d.get_chunks(self.SPHERE_DATA, "data.csv", 2)) > 4)
+        rows = d.get_iterator(self.SPHERE_DATA, workers=2)
+        self.assertEqual(next(rows), ("theta", "phi", "FILE"))
+        self.assertEqual(next(rows), ("0", "-180", "-180/0.png"))
+        rows.close()
+
+    def test_check(self):
+        for fn in ("data.csv", "files1.csv", "files2.csv", "files3.csv", 
+                   "files4.csv", "files5.csv", "nan.csv", "typecheck.csv",
+                   "whitespace.csv", "wrong_file1.csv", "wrong_num1.csv", 
+                   "wrong_types.csv", "empty_types.csv",
+                   "improper_quoted_row_1.csv", "improper_quoted_row_2.csv"):
+            self.assertEqual(
+                d.check_database(self.SPHERE_DATA, fn, workers=2),
+                d.check_database(self.SPHERE_DATA, fn), fn)
+
+class SelectD(unittest.TestCase):
+    """
+    Tests for column projection and predicates in get_iterator in the 
+    cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+        self.SPHERE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+
+    def select(self, columns=None, where=None, csv_path="data.csv"):
+        rows = d.get_iterator(self.SPHERE_DATA, csv_path, columns=columns,
+                              where=where)
+        return None if rows is None else list(rows)
+
+    def test_columns(self):
+        rows = self.select(["FILE", "phi"])
+        self.assertEqual(rows[0], ("FILE", "phi"))
+        self.assertEqual(rows[1], ("-180/0.png", "-180"))
+        self.assertEqual(len(rows), 21)
+        self.assertEqual(self.select(["phi"])[1], ("-180",))
+        self.assertEqual(self.select(["nope"]), None)
+
+    def test_where(self):
+        self.assertEqual(self.select(["phi"], "theta == 0 and phi > 100"),
+            [("phi",), ("108",), ("126",), ("144",), ("162",)])
+        self.assertEqual(self.select(["phi"], 
+            "phi>=-144 and not (phi>-126 or FILE='-126/0.png')"),
+            [("phi",), ("-144",)])
+        self.assertEqual(self.select(None, "`FILE` = \"-180/0.png\""),
+            [("theta", "phi", "FILE"), ("0", "-180", "-180/0.png")])
+        self.assertEqual(self.select(None, "phi > 1000"), 
+            [("theta", "phi", "FILE")])
+
+        # strings don't match numbers, and empty values don't match
+        self.assertEqual(len(self.select(None, "FILE > 0")), 1)
+        rows = list(d.get_iterator(self.SPHERE_DATA, "empty_data.csv"))
+        self.assertEqual(
+            self.select(None, "phi != 1000", "empty_data.csv"),
+            [rows[0]] + [row for row in rows[1:] if row[1] is not None])
+
+        for where in ("phi >", "phi > 1 xx", "phi ~ 1", "nope == 1", 
+                      "(phi > 1", "phi > theta"):
+            self.assertEqual(self.select(None, where), None, where)
+
+    def test_workers(self):
+        size = d.PARALLEL_MIN_CHUNK_SIZE
+        d.PARALLEL_MIN_CHUNK_SIZE = 32
+        try:
+            self.assertEqual(
+                list(d.get_iterator(self.SPHERE_DATA, workers=3, 
+                                    columns=["FILE", "phi"], 
+                                    where="phi < -100 or phi > 100")),
+                self.select(["FILE", "phi"], "phi < -100 or phi > 100"))
+        finally:
+            d.PARALLEL_MIN_CHUNK_SIZE = size
+
+class FollowD(unittest.TestCase):
+    """
+    Tests for reading rows as they are appended in the cinema_lib.spec.d 
+    module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+        self.TEMP_PATH = temp.mkdtemp()
+        self.d_csv = os.path.join(self.TEMP_PATH, d.SPEC_D_CSV_FILENAME)
+
+    def tearDown(self):
+        sh.rmtree(self.TEMP_PATH)
+
+    def write(self, text, mode="a"):
+        with open(self.d_csv, mode, newline="") as f:
+            f.write(text)
+
+    def test_cursor(self):
+        self.write("a,b,FILE\n1,2,x.png\n3,\"q", "w")
+        cursor = d.Cursor(self.TEMP_PATH)
+        self.assertEqual(list(cursor), [("1", "2", "x.png")])
+        self.assertEqual(cursor.header, ("a", "b", "FILE"))
+        self.assertEqual((cursor.offset, cursor.n_rows), (19, 1))
+
+        # partial rows are read when they are complete
+        self.write(",\n\",y.png\n5,6")
+        self.assertEqual(list(cursor), [("3", "q,\n", "y.png")])
+        self.write(",z.png\r\n\r\n")
+        self.assertEqual(list(cursor), [("5", "6", "z.png")])
+        self.assertEqual(list(cursor), [])
+
+        # resume from a saved position
+        self.write("7,8,w.png\n")
+        resumed = d.Cursor(self.TEMP_PATH, offset=cursor.offset, 
+                           n_rows=cursor.n_rows)
+        self.assertEqual(list(resumed), [("7", "8", "w.png")])
+        self.assertEqual(resumed.header, ("a", "b", "FILE"))
+        self.assertEqual(resumed.n_rows, 4)
+        self.assertEqual(list(d.get_iterator(self.TEMP_PATH, 
+                                             from_offset=cursor.offset)),
+                         [("7", "8", "w.png")])
+
+        # a rewritten file is read from the start
+        self.write("a,b,FILE\n0,0,v.png\n", "w")
+        self.assertEqual(list(resumed.rows(True)), 
+                         [("a", "b", "FILE"), ("0", "0", "v.png")])
+        self.assertEqual(resumed.n_rows, 1)
+
+    def test_random(self):
+        rows = ['1,2\n', '"a\nb",3\n', '"x""y",\n', '\n', '4,"\r\n"\r\n', 
+                'é,ü\n']
+        rng = random.Random(6)
+        for i in range(0, 100):
+            text = "h1,h2\n" + "".join(rng.choice(rows) 
+                                       for j in range(0, rng.randint(0, 20)))
+            self.write("", "w")
+            cursor = d.Cursor(self.TEMP_PATH)
+            result = []
+            position = 0
+            while position < len(text):
+                n = rng.randint(1, 8)
+                self.write(text[position:position + n])
+                position = position + n
+                result = result + list(cursor.rows(True))
+            self.assertEqual(result, list(d.get_iterator(self.TEMP_PATH)))
+
+    def test_follow(self):
+        self.write("a,b,FILE\n1,2,x.png\n", "w")
+        rows = d.get_iterator(self.TEMP_PATH, follow=True)
+        self.assertEqual(next(rows), ("a", "b", "FILE"))
+        self.assertEqual(next(rows), ("1", "2", "x.png"))
+        self.write("3,4,y.png\n")
+        self.assertEqual(next(rows), ("3", "4", "y.png"))
+        rows.close()
+
+        rows = d.get_iterator(self.TEMP_PATH, follow=True, columns=["FILE"],
+                              where="a > 2")
+        self.assertEqual(next(rows), ("FILE",))
+        self.assertEqual(next(rows), ("y.png",))
+        rows.close()
+
+        self.assertEqual(
+            list(d.Cursor(self.TEMP_PATH).follow(poll_interval=0.01, 
+                                                 timeout=0.05)),
+            [("1", "2", "x.png"), ("3", "4", "y.png")])
+
+    def test_append_columns(self):
+        self.write("a,b,FILE\n1,2,x.png\n", "w")
+        cursor = d.Cursor(self.TEMP_PATH)
+        plus_one = lambda row: (str(int(row[0]) + 1),)
+        self.assertEqual(d.append_columns_by_row_data(self.TEMP_PATH, 
+            ("c",), plus_one, cursor, "out.csv"), 1)
+        self.write("3,4,y.png\n")
+        self.assertEqual(d.append_columns_by_row_data(self.TEMP_PATH, 
+            ("c",), plus_one, cursor, "out.csv"), 1)
+        self.assertEqual(d.append_columns_by_row_data(self.TEMP_PATH, 
+            ("c",), plus_one, cursor, "out.csv"), 0)
+        self.assertEqual(d.append_columns_by_row_data(self.TEMP_PATH, 
+            ("c",), plus_one, cursor, d.SPEC_D_CSV_FILENAME), None)
+
+        d.add_columns_by_row_data(self.TEMP_PATH, ("c",), plus_one)
+        self.assertEqual(list(d.get_iterator(self.TEMP_PATH, "out.csv")),
+                         list(d.get_iterator(self.TEMP_PATH)))
+
+class CacheD(unittest.TestCase):
+    """
+    Tests for the binary parse cache in the cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+        self.d_csv = os.path.join(self.SPHERE_DATA, d.SPEC_D_CSV_FILENAME)
+        self.d_cache = self.d_csv + d.CACHE_EXT
+
+    def tearDown(self):
+        sh.rmtree(self.TEMP_PATH)
+
+    def test_rows(self):
+        for fn in ("data.csv", "empty_data.csv", "nan.csv", "typecheck.csv",
+                   "proper_quoted.csv", "proper_quoted_2.csv", "no_data.csv",
+                   "sqlite1.csv"):
+            rows = list(d.get_iterator(self.SPHERE_DATA, fn))
+            self.assertEqual(list(d.get_iterator(self.SPHERE_DATA, fn,
+                                                 cache=True)), rows)
+            self.assertTrue(os.path.isfile(
+                os.path.join(self.SPHERE_DATA, fn + d.CACHE_EXT)))
+            self.assertEqual(list(d.get_iterator(self.SPHERE_DATA, fn,
+                                                 cache=True)), rows)
+            self.assertEqual(list(d.get_iterator(self.SPHERE_DATA, fn,
+                                                 cache=True,
+                                                 columns=[rows[0][-1]])),
+                             [(row[-1],) for row in rows])
+
+        # columns are typed by the whole column, and the strings are kept
+        # exactly as they are written
+        with open(self.d_csv, "w") as f:
+            f.write("a,b,c,e,FILE\n007,1e3,1,,x\n-0,0.5,,,\n"
+                    "1,nan,2,,\"y\"\"\0\"\n")
+        rows = list(d.get_iterator(self.SPHERE_DATA))
+        table = d.get_cache(self.SPHERE_DATA)
+        self.assertEqual([c[0] for c in table[1]], ["q", "d", "q", "e", "s"])
+        self.assertEqual(list(d.get_iterator(self.SPHERE_DATA, cache=True)),
+                         rows)
+        self.assertEqual(d.get_cache(self.SPHERE_DATA), table)
+
+        # a cache that is truncated or altered isn't read
+        with open(self.d_cache, "rb") as f:
+            b = f.read()
+        for altered in (b[:-3], b[:-1] + b"\xff", b + b"\0"):
+            with open(self.d_cache, "wb") as f:
+                f.write(altered)
+            self.assertEqual(list(d.get_iterator(self.SPHERE_DATA, 
+                                                 cache=True)), rows)
+
+        # invalid files aren't cached
+        self.assertEqual(d.get_cache(self.SPHERE_DATA, 
+                                     "improper_quoted_row_1.csv"), None)
+        self.assertEqual(d.get_cache(self.SPHERE_DATA, "wrong_num1.csv"), 
+                         None)
+        self.assertEqual(d.get_cache(self.SPHERE_DATA, "nope.csv"), None)
+
+    def test_columns(self):
+        try:
+            import numpy as np
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        with open(os.path.join(self.SPHERE_DATA, "typed.csv"), "w") as f:
+            f.write("a,b,c,e,FILE\n007,1e3,1,,x\n-0,0.5,,,\n1,nan,2,,y\n")
+        for fn in ("data.csv", "empty_data.csv", "nan.csv", "typecheck.csv",
+                   "no_data.csv", "typed.csv"):
+            columns = d.get_columns(self.SPHERE_DATA, csv_path=fn)
+            d.get_cache(self.SPHERE_DATA, fn)
+            cached = d.get_columns(self.SPHERE_DATA, csv_path=fn, cache=True)
+            self.assertEqual(list(columns.keys()), list(cached.keys()))
+            for k in columns:
+                self.assertEqual(columns[k].dtype, cached[k].dtype)
+                self.assertTrue(np.array_equal(columns[k].mask, 
+                                               cached[k].mask))
+                np.testing.assert_array_equal(columns[k].data, 
+                                              cached[k].data)
+
+    def test_invalidate(self):
+        self.assertTrue(d.check_database(self.SPHERE_DATA, cache=True))
+        self.assertTrue(os.path.isfile(self.d_cache))
+        db = d.get_sqlite3(self.SPHERE_DATA, cache=True)
+
+        # a rewritten CSV removes the cache
+        d.add_column_by_row_data(self.SPHERE_DATA, "one", lambda x: "1")
+        self.assertFalse(os.path.exists(self.d_cache))
+        rows = list(d.get_iterator(self.SPHERE_DATA, cache=True))
+        self.assertEqual(rows[0], ("theta", "phi", "one", "FILE"))
+        self.assertTrue(os.path.isfile(self.d_cache))
+        d.get_sqlite3_to_csv(db, "sphere", self.SPHERE_DATA)
+        self.assertFalse(os.path.exists(self.d_cache))
+
+        # a changed CSV isn't read from the cache
+        d.get_cache(self.SPHERE_DATA)
+        with open(self.d_csv, "a") as f:
+            f.write("0,180,180/0.png\n")
+        self.assertEqual(list(d.get_iterator(self.SPHERE_DATA, cache=True)),
+                         list(d.get_iterator(self.SPHERE_DATA)))
+        self.assertEqual(len(list(d.get_iterator(self.SPHERE_DATA, 
+                                                 cache=True))), 22)
+
+class SidecarD(unittest.TestCase):
+    """
+    Tests for the persistent SQLite3 sidecar in the cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+        self.d_csv = os.path.join(self.SPHERE_DATA, d.SPEC_D_CSV_FILENAME)
+        self.d_sidecar = self.d_csv + d.SQLITE3_EXT
+
+    def tearDown(self):
+        sh.rmtree(self.TEMP_PATH)
+
+    def rows(self, db):
+        return db.execute("SELECT * FROM sphere").fetchall()
+
+    def test_reuse(self):
+        db = d.get_sqlite3_sidecar(self.SPHERE_DATA)
+        self.assertTrue(os.path.isfile(self.d_sidecar))
+        self.assertEqual(self.rows(db), 
+                         self.rows(d.get_sqlite3(self.SPHERE_DATA)))
+        db.close()
+        st = os.stat(self.d_sidecar)
+
+        # an unchanged CSV reuses the sidecar as it is
+        db = d.get_sqlite3_sidecar(self.SPHERE_DATA)
+        self.assertEqual(len(self.rows(db)), 20)
+        db.close()
+        self.assertEqual(os.stat(self.d_sidecar).st_mtime_ns, st.st_mtime_ns)
+
+        # unless it is rebuilt
+        db = d.get_sqlite3_sidecar(self.SPHERE_DATA, rebuild=True)
+        self.assertEqual(len(self.rows(db)), 20)
+        db.close()
+        self.assertNotEqual(os.stat(self.d_sidecar).st_ino, st.st_ino)
+
+        # a rewritten CSV removes it
+        d.add_column_by_row_data(self.SPHERE_DATA, "one", lambda x: "1")
+        self.assertFalse(os.path.exists(self.d_sidecar))
+        db = d.get_sqlite3_sidecar(self.SPHERE_DATA)
+        self.assertEqual(self.rows(db)[0], (0, -180, 1, "-180/0.png"))
+
+        self.assertEqual(d.get_sqlite3_sidecar(self.SPHERE_DATA, "nope.csv"),
+                         None)
+
+    def test_append(self):
+        d.get_sqlite3_sidecar(self.SPHERE_DATA).close()
+        ino = os.stat(self.d_sidecar).st_ino
+
+        # only complete rows are appended, in place
+        with open(self.d_csv, "a") as f:
+            f.write("1,180,180/1.png\n2,")
+        db = d.get_sqlite3_sidecar(self.SPHERE_DATA)
+        self.assertEqual(len(self.rows(db)), 21)
+        self.assertEqual(self.rows(db)[-1], (1, 180, "180/1.png"))
+        db.close()
+        with open(self.d_csv, "a") as f:
+            f.write("180,180/2.png\n")
+        db = d.get_sqlite3_sidecar(self.SPHERE_DATA)
+        self.assertEqual(self.rows(db)[-1], (2, 180, "180/2.png"))
+        self.assertEqual(self.rows(db)[:-2], 
+                         self.rows(d.get_sqlite3(self.SPHERE_DATA))[:-2])
+        db.close()
+        self.assertEqual(os.stat(self.d_sidecar).st_ino, ino)
+
+        # a changed row rebuilds it
+        with open(self.d_csv, "r+") as f:
+            f.seek(len("theta,phi,FILE\n"))
+            f.write("9")
+        db = d.get_sqlite3_sidecar(self.SPHERE_DATA)
+        self.assertEqual(self.rows(db)[0], (9, -180, "-180/0.png"))
+        self.assertEqual(len(self.rows(db)), 22)
+        db.close()
+        self.assertNotEqual(os.stat(self.d_sidecar).st_ino, ino)
+
+        # an appended row that widens the type of a column rebuilds it, 
+        # as a NaN or a float in an integer column, or a number in a text 
+        # column without values
+        for row, kept in (("3,nan,180/3.png", False), 
+                          ("4,1.5,180/4.png", True)):
+            ino = os.stat(self.d_sidecar).st_ino
+            with open(self.d_csv, "a") as f:
+                f.write(row + "\n")
+            db = d.get_sqlite3_sidecar(self.SPHERE_DATA)
+            self.assertEqual(self.rows(db), 
+                             self.rows(d.get_sqlite3(self.SPHERE_DATA)))
+            db.close()
+            self.assertEqual(os.stat(self.d_sidecar).st_ino == ino, kept)
+        d.add_column_by_row_data(self.SPHERE_DATA, "e", lambda x: None)
+        d.get_sqlite3_sidecar(self.SPHERE_DATA).close()
+        for row, kept, e_type in (("5,0,,180/5.png", True, "TEXT"), 
+                                  ("6,0,6,180/6.png", False, "INTEGER")):
+            ino = os.stat(self.d_sidecar).st_ino
+            with open(self.d_csv, "a") as f:
+                f.write(row + "\n")
+            db = d.get_sqlite3_sidecar(self.SPHERE_DATA)
+            self.assertEqual(self.rows(db), 
+                             self.rows(d.get_sqlite3(self.SPHERE_DATA)))
+            self.assertEqual(db.execute("PRAGMA table_info(sphere)"
+                                        ).fetchall()[2][2], e_type)
+            db.close()
+            self.assertEqual(os.stat(self.d_sidecar).st_ino == ino, kept)
+
+        # an appended row that doesn't fit the table fails to load
+        with open(self.d_csv, "a") as f:
+            f.write("3,180\n")
+        self.assertEqual(d.get_sqlite3_sidecar(self.SPHERE_DATA), None)
+
+class ServerD(unittest.TestCase):
+    """
+    Tests for the read-only query server in the cinema_lib.server module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+        self.d_csv = os.path.join(self.SPHERE_DATA, d.SPEC_D_CSV_FILENAME)
+
+        self.server = server.make_server(self.SPHERE_DATA, 
+                                         refresh_interval=0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://{0}:{1}".format(*self.server.server_address)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.pool.close()
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.server.pool.directory))
+        sh.rmtree(self.TEMP_PATH)
+
+    def get(self, path):
+        with urlopen(self.url + path) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def test_query(self):
+        self.assertEqual(self.get("/header"), 
+                         {"header": ["theta", "phi", "FILE"], 
+                          "types": ["INTEGER", "INTEGER", "STRING"],
+                          "rows": 20})
+        self.assertEqual(self.get("/files?theta=0&phi=-180"), 
+                         {"files": ["-180/0.png"]})
+        self.assertEqual(self.get("/files?theta=0&phi=162&phi=-180"), 
+                         {"files": ["-180/0.png", "162/0.png"]})
+        self.assertEqual(self.get("/rows?theta=0..&phi=..-144&limit=2"), 
+                         {"header": ["theta", "phi", "FILE"],
+                          "rows": [[0, -180, "-180/0.png"], 
+                                   [0, -162, "-162/0.png"]]})
+        self.assertEqual(self.get("/files?phi=")["files"], [])
+
+        # concurrent queries
+        expected = self.get("/files?phi=0")
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(self.get, ["/files?phi=0"] * 64))
+        self.assertTrue(all(r == expected for r in results))
+
+        for path, code in (("/files?nope=1", 400), ("/files?phi=x", 400),
+                           ("/nope", 404)):
+            with self.assertRaises(HTTPError) as e:
+                self.get(path)
+            self.assertEqual(e.exception.code, code)
+            e.exception.close()
+
+        stats = self.get("/stats")
+        self.assertEqual(stats["requests"], 73)
+        self.assertEqual(stats["errors"], 3)
+        self.assertTrue(stats["qps"] > 0)
+        self.assertTrue(0 < stats["median_ms"] <= stats["max_ms"])
+
+        # an empty value in a list of values matches empty cells
+        with open(self.d_csv, "w") as f:
+            f.write("a,FILE\n1,f1.png\n,f2.png\n2,f3.png\n")
+        self.assertEqual(self.get("/files?a=&a=1"), 
+                         {"files": ["f1.png", "f2.png"]})
+        self.assertEqual(self.get("/files?a=&a="), {"files": ["f2.png"]})
+
+    def test_refresh(self):
+        # appended rows are inserted in place
+        with open(self.d_csv, "a") as f:
+            f.write("1,360,360/1.png\n2,")
+        self.assertEqual(self.get("/files?phi=360"), {"files": ["360/1.png"]})
+        self.assertEqual(self.get("/header")["rows"], 21)
+        self.assertEqual(self.get("/stats")["appends"], 1)
+        with open(self.d_csv, "a") as f:
+            f.write("360,360/2.png\n")
+        self.assertEqual(self.get("/files?theta=2"), {"files": ["360/2.png"]})
+        self.assertEqual(self.get("/stats")["appends"], 2)
+
+        # a rewritten CSV is loaded again
+        d.add_column_by_row_data(self.SPHERE_DATA, "one", lambda x: "1")
+        self.assertEqual(self.get("/header")["header"], 
+                         ["theta", "phi", "one", "FILE"])
+        self.assertEqual(len(self.get("/files?one=1")["files"]), 22)
+        self.assertEqual(self.get("/stats")["loads"], 2)
+        # the connection is of the snapshot it is acquired with
+        snapshot, connection = self.server.pool.acquire()
+        self.assertEqual(snapshot.header, ("theta", "phi", "one", "FILE"))
+        self.assertEqual(d.query_sqlite3(connection, "sphere", {"one": 1}, 
+                                         limit=1), ["-180/0.png"])
+        snapshot.release(connection)
+        self.assertEqual(len(os.listdir(self.server.pool.directory)), 3)
+
+class CheckpointD(unittest.TestCase):
+    """
+    Tests for incremental checking in the cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+        self.d_csv = os.path.join(self.SPHERE_DATA, d.SPEC_D_CSV_FILENAME)
+        self.d_checkpoint = self.d_csv + d.CHECKPOINT_EXT
+
+        # keep the log messages
+        class Records(log.Handler):
+            def emit(self, record):
+                self.records.append((record.levelname, record.getMessage()))
+        self.handler = Records()
+        self.handler.records = []
+        self.logger = log.getLogger()
+        self.level = self.logger.level
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(log.INFO)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        sh.rmtree(self.TEMP_PATH)
+
+    def check(self, **kwargs):
+        self.handler.records = []
+        return d.check_database(self.SPHERE_DATA, **kwargs)
+
+    def test_append(self):
+        self.assertTrue(self.check(incremental=True))
+        self.assertTrue(os.path.isfile(self.d_checkpoint))
+        self.assertTrue(self.check(incremental=True))
+        self.assertIn(("INFO", "Checking rows after row #20 at byte 331, "
+                       "from the checkpoint."), self.handler.records)
+
+        # the errors are the same as checking all of the rows, rows that
+        # have errors aren't in a checkpoint
+        random.seed(0)
+        rows = ["0,0,0/0.png\n", "1.5,0,0/0.png\n", "2,0,nope.png\n", 
+                "4,0\n", "5,0,0/0.png"]
+        for i in range(0, 20):
+            with open(self.d_csv, "a") as f:
+                f.write(random.choice(rows))
+            incremental = (self.check(incremental=True), 
+                           [r for r in self.handler.records 
+                            if r[0] != "INFO" or "Types" in r[1] or 
+                            "Number of data" in r[1]])
+            full = (self.check(), 
+                    [r for r in self.handler.records 
+                     if r[0] != "INFO" or "Types" in r[1] or 
+                     "Number of data" in r[1]])
+            self.assertEqual(incremental, full)
+            with open(self.d_csv, "a") as f:
+                f.write("\n")
+
+    def test_verify(self):
+        # a checkpoint is only used if its files were verified as much
+        open(os.path.join(self.SPHERE_DATA, "0", "0.png"), "w").close()
+        self.assertTrue(self.check(incremental=True))
+        self.assertFalse(self.check(incremental=True, verify=d.VERIFY_SIZE))
+        self.assertIn(("INFO", "The files before the checkpoint were "
+                       "verified with None, not size, checking all rows."), 
+                      self.handler.records)
+        self.assertFalse(self.check(incremental=True, verify=d.VERIFY_SIZE))
+
+        # a stronger verification is used by a weaker one, and the new 
+        # checkpoint is as weak as the rows after it
+        with open(os.path.join(self.SPHERE_DATA, "0", "0.png"), "w") as f:
+            f.write("0")
+        self.assertTrue(self.check(incremental=True, 
+                                   verify=d.VERIFY_CHECKSUM))
+        with open(self.d_csv, "a") as f:
+            f.write("0,180,0/0.png\n")
+        self.assertTrue(self.check(incremental=True))
+        self.assertIn(("INFO", "Checking rows after row #20 at byte 331, "
+                       "from the checkpoint."), self.handler.records)
+        self.assertTrue(self.check(incremental=True, verify=d.VERIFY_SIZE))
+        self.assertIn(("INFO", "The files before the checkpoint were "
+                       "verified with None, not size, checking all rows."), 
+                      self.handler.records)
+
+    def test_types(self):
+        # the column types are kept in the checkpoint
+        with open(self.d_csv, "w") as f:
+            f.write("a,b,FILE\n1,,0/0.png\n")
+        self.assertTrue(self.check(incremental=True))
+        with open(self.d_csv, "a") as f:
+            f.write("2,1.5,0/0.png\n3,2.5,\n")
+        self.assertTrue(self.check(incremental=True))
+        self.assertIn(("INFO", "Types updated on row#2 from ['INTEGER', "
+                       "'EMPTY', 'STRING'] to ['INTEGER', 'FLOAT', "
+                       "'STRING']"), self.handler.records)
+        with open(self.d_csv, "a") as f:
+            f.write("4,5,0/0.png\n")
+        self.assertFalse(self.check(incremental=True))
+
+    def test_changed(self):
+        self.assertTrue(self.check(incremental=True))
+
+        # a changed prefix is checked again
+        with open(self.d_csv, "r+") as f:
+            f.seek(len("theta,phi,FILE\n"))
+            f.write("1")
+        self.assertTrue(self.check(incremental=True))
+        self.assertIn(("INFO", "Rows before the checkpoint changed, checking "
+                       "all rows."), self.handler.records)
+
+        # a rewritten CSV removes the checkpoint
+        d.add_column_by_row_data(self.SPHERE_DATA, "one", lambda x: "1")
+        self.assertFalse(os.path.exists(self.d_checkpoint))
+
+        # no checkpoint without a final newline
+        with open(self.d_csv, "a") as f:
+            f.write("0,0,1,0/0.png")
+        self.assertTrue(self.check(incremental=True))
+        self.assertFalse(os.path.exists(self.d_checkpoint))
+
+class SampleD(unittest.TestCase):
+    """
+    Tests for checking a sample of rows in the cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+        self.d_csv = os.path.join(self.SPHERE_DATA, d.SPEC_D_CSV_FILENAME)
+
+        # keep the log messages
+        class Records(log.Handler):
+            def emit(self, record):
+                self.records.append((record.levelname, record.getMessage()))
+        self.handler = Records()
+        self.handler.records = []
+        self.logger = log.getLogger()
+        self.level = self.logger.level
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(log.INFO)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        sh.rmtree(self.TEMP_PATH)
+
+    def check(self, **kwargs):
+        self.handler.records = []
+        return d.check_database(self.SPHERE_DATA, **kwargs)
+
+    def write(self, n_rows, bad=()):
+        with open(self.d_csv, "w") as f:
+            f.write("a,b,FILE\n")
+            for i in range(0, n_rows):
+                f.write("{0},{1},{2}\n".format(i, i * 0.5, 
+                    "nope.png" if i in bad else "0/0.png"))
+
+    def test_sample(self):
+        self.write(1000)
+        self.assertTrue(self.check(sample=0.05))
+        records = self.handler.records
+        self.assertIn(("INFO", "0 of 50 sampled rows have errors. With 95% "
+                       "confidence, at most 5.8155% of the rows have "
+                       "errors."), records)
+        self.assertTrue(self.check(sample=0.05))
+        self.assertEqual(self.handler.records, records)
+        self.assertTrue(self.check(sample=0.05, sample_seed=1))
+        self.assertNotEqual(self.handler.records, records)
+
+        # every row is bad
+        self.write(1000, range(0, 1000))
+        self.assertFalse(self.check(sample_rows=10))
+        self.assertIn(("INFO", "0 of 10 files in the sampled rows were found."
+                       " With 95% confidence, at most 100.0000% of the files "
+                       "are missing."), self.handler.records)
+        self.assertTrue(d.check_database(self.SPHERE_DATA, quick=True, 
+                                         sample_rows=10))
+
+    def test_index(self):
+        # with an index, the sample is exact
+        self.write(100, (17,))
+        d.get_row_index(self.SPHERE_DATA)
+        self.assertFalse(self.check(sample_rows=100))
+        self.assertIn(("INFO", "Sampled 100 of 100 data rows with seed 0."),
+                      self.handler.records)
+        self.assertIn(("ERROR", "Error on row #18: ('17', '8.5', "
+                       "'nope.png')"), self.handler.records)
+        self.assertTrue(self.check(sample_rows=10))
+        self.assertIn(("INFO", "Sampled 10 of 100 data rows with seed 0."),
+                      self.handler.records)
+
+        # without an index, rows are found by offsets
+        os.unlink(self.d_csv + d.INDEX_EXT)
+        self.assertFalse(self.check(sample_rows=1000))
+        self.assertIn(("ERROR", "Error on row #~16 (byte 254): ('17', '8.5', "
+                       "'nope.png')"), self.handler.records)
+
+        # rows that are found twice are drawn again, so there are as many
+        # rows as asked for
+        self.check(sample_rows=50, sample_seed=1)
+        self.assertEqual(len([r for r in self.handler.records 
+                              if r[1].startswith("Sampled 50 of about ")]), 
+                         1)
+
+    def test_arguments(self):
+        self.write(100)
+        for kwargs in ({"sample": 0}, {"sample": -0.5}, {"sample": 1.5},
+                       {"sample_rows": 0}, {"sample_rows": -1}):
+            with self.assertRaises(ValueError):
+                self.check(**kwargs)
+
+        # the files are verified
+        open(os.path.join(self.SPHERE_DATA, "0", "0.png"), "w").close()
+        self.assertTrue(self.check(sample_rows=10))
+        self.assertFalse(self.check(sample_rows=10, verify=d.VERIFY_SIZE))
+        self.assertIn(("ERROR", "File \"{0}\" is empty.".format(
+            os.path.join(self.SPHERE_DATA, "0/0.png"))), self.handler.records)
+
+class ImagesD(unittest.TestCase):
+    """
+    Tests for checking images in the cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+
+        # keep the log messages
+        class Records(log.Handler):
+            def emit(self, record):
+                self.records.append((record.levelname, record.getMessage()))
+        self.handler = Records()
+        self.handler.records = []
+        self.logger = log.getLogger()
+        self.level = self.logger.level
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(log.WARNING)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        sh.rmtree(self.TEMP_PATH)
+
+    def test_header(self):
+        self.assertEqual(d.get_image_header(os.path.join(self.SPHERE_DATA, 
+                         "0", "0.png")), ("PNG", 519, 422, 3, 8))
+        self.assertEqual(d.get_image_header(os.path.join(self.SPHERE_DATA, 
+                         "0", "0_cv_grey.png"), False), 
+                         ("PNG", 519, 422, 1, 8))
+        self.assertEqual(d.get_image_header(os.path.join(TEST_PATH, 
+                         "example2.cdb", "img", "001.jpg")), 
+                         ("JPEG", 519, 422, 3, 8))
+
+        # truncated and corrupt images
+        for source in (os.path.join(self.SPHERE_DATA, "0", "0.png"),
+                       os.path.join(TEST_PATH, "example2.cdb", "img", 
+                                    "001.jpg")):
+            with open(source, "rb") as f:
+                data = f.read()
+            fn = os.path.join(self.TEMP_PATH, "image")
+            for b in (data[:-1], data[:len(data) // 2], data[:20], 
+                      data[:100] + bytes([data[100] ^ 1]) + data[101:]
+                      if source.endswith(".png") else b"nope"):
+                with open(fn, "wb") as f:
+                    f.write(b)
+                with self.assertRaises(ValueError):
+                    d.get_image_header(fn)
+
+    def test_check(self):
+        self.assertTrue(d.check_database(self.SPHERE_DATA, 
+                                         images=d.IMAGE_HEADER))
+        with open(os.path.join(self.SPHERE_DATA, "36", "0.png"), "r+b") as f:
+            f.truncate(1000)
+        sh.copy(os.path.join(self.SPHERE_DATA, "0", "0_cv_grey.png"), 
+                os.path.join(self.SPHERE_DATA, "18", "0.png"))
+
+        results = []
+        for workers in (1, 2):
+            self.handler.records = []
+            results.append((d.check_database(self.SPHERE_DATA, 
+                                             images=d.IMAGE_HEADER, 
+                                             workers=workers), 
+                            self.handler.records))
+        self.assertEqual(results[0], results[1])
+        self.assertFalse(results[0][0])
+        self.assertIn(("ERROR", "On row #13: image \"36/0.png\" is invalid:"
+                       " truncated IDAT chunk."), results[0][1])
+        self.assertIn(("WARNING", "On row #12: image \"18/0.png\" is "
+                       "519x422 with 1 channel(s), but \"-180/0.png\" in "
+                       "column \"FILE\" is 519x422 with 3 channel(s)."), 
+                      results[0][1])
+        self.assertFalse(d.check_database(self.SPHERE_DATA, images="nope"))
+
+    def test_decode(self):
+        try:
+            import skimage
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        self.assertTrue(d.check_database(self.SPHERE_DATA, 
+                                         images=d.IMAGE_DECODE))
+        with open(os.path.join(self.SPHERE_DATA, "36", "0.png"), "r+b") as f:
+            f.truncate(1000)
+        self.assertFalse(d.check_database(self.SPHERE_DATA, 
+                                          images=d.IMAGE_DECODE))
+
+class CompressedD(unittest.TestCase):
+    """
+    Tests for compressed CSVs in the cinema_lib.spec.d module.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        # copy files to tmp
+        self.SOURCE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.TEMP_PATH = temp.mkdtemp()
+        self.SPHERE_DATA = os.path.join(self.TEMP_PATH, "sphere.cdb")
+        sh.copytree(self.SOURCE_DATA, self.SPHERE_DATA)
+        self.d_csv = os.path.join(self.SPHERE_DATA, d.SPEC_D_CSV_FILENAME)
+        self.rows = list(d.get_iterator(self.SPHERE_DATA))
+
+    def tearDown(self):
+        sh.rmtree(self.TEMP_PATH)
+
+    def compress(self, compression):
+        with open(self.d_csv, "rb") as f:
+            data = f.read()
+        os.unlink(self.d_csv)
+        opener = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+        with opener[compression](self.d_csv + d.COMPRESSION_EXTS[compression],
+                                 "wb") as f:
+            f.write(data)
+        return len(data)
+
+    def test_read(self):
+        for compression in ("gz", "bz2", "xz"):
+            sh.copyfile(os.path.join(self.SPHERE_DATA, "typecheck.csv"),
+                        self.d_csv)
+            rows = list(d.get_iterator(self.SPHERE_DATA))
+            n_bytes = self.compress(compression)
+            with self.assertLogs(level="INFO") as logs:
+                self.assertEqual(list(d.get_iterator(self.SPHERE_DATA)), rows)
+            self.assertTrue(logs.output[-1].endswith(
+                "decoded {0} bytes of \"{1}{2}\".".format(n_bytes, 
+                    self.d_csv, d.COMPRESSION_EXTS[compression])))
+
+            self.assertTrue(d.check_database(self.SPHERE_DATA))
+            self.assertTrue(d.check_database(self.SPHERE_DATA, workers=2))
+            db = d.get_sqlite3(self.SPHERE_DATA)
+            self.assertEqual(db.execute(
+                "SELECT COUNT(*) FROM sphere").fetchone()[0], len(rows) - 1)
+            self.assertEqual(d.get_row_index(self.SPHERE_DATA, 
+                os.path.basename(self.d_csv) + 
+                d.COMPRESSION_EXTS[compression]), None)
+            os.unlink(self.d_csv + d.COMPRESSION_EXTS[compression])
+
+    def test_write(self):
+        self.compress("gz")
+        backup = d.add_column_by_row_data(self.SPHERE_DATA, "phi plus one",
+                                          lambda x: str(int(x[1]) + 1))
+        self.assertTrue(backup.startswith(d.SPEC_D_CSV_FILENAME + ".gz."))
+        self.assertTrue(os.path.isfile(self.d_csv + ".gz"))
+        self.assertEqual(list(d.get_iterator(self.SPHERE_DATA, backup)),
+                         self.rows)
+        rows = list(d.get_iterator(self.SPHERE_DATA))
+        self.assertEqual(rows[0], ("theta", "phi", "phi plus one", "FILE"))
+
+        d.add_columns_by_row_data(self.SPHERE_DATA, ("one",), 
+                                  lambda x: ("1",), compression="xz")
+        self.assertFalse(os.path.exists(self.d_csv + ".gz"))
+        self.assertTrue(os.path.isfile(self.d_csv + ".xz"))
+        d.add_columns_by_row_data(self.SPHERE_DATA, ("two",), 
+                                  lambda x: ("2",), compression="")
+        self.assertTrue(os.path.isfile(self.d_csv))
+        self.assertEqual(next(d.get_iterator(self.SPHERE_DATA)), 
+            ("theta", "phi", "phi plus one", "one", "two", "FILE"))
+        self.assertTrue(d.check_database(self.SPHERE_DATA))
+
+        with self.assertRaises(ValueError):
+            d.add_columns_by_row_data(self.SPHERE_DATA, ("three",), 
+                                      lambda x: ("3",), compression="zip")
+
+class Tokenizer(unittest.TestCase):
+    """
+    Regression tests for the block-buffered tokenizer in cinema_lib.spec.d
+    against the original character-at-a-time tokenizer.
+    """
+
+    def setUp(self):
+        if unittest_verbosity() > 1:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=log.DEBUG, datefmt='%I:%M:%S')
+        else:
+            log.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                            level=60, datefmt='%I:%M:%S')
+
+        self.SPHERE_DATA = os.path.join(TEST_PATH, "sphere.cdb")
+        self.row_generator = getattr(d, "__row_generator")
+
+    def tokenize(self, generator, text, strict, *args):
+        rows = []
+        try:
+            for row in generator(io.StringIO(text, newline=None), strict,
+                                 *args):
+                rows.append(row)
+        except Exception as e:
+            rows.append(str(e))
+        return rows
+
+    def test_data_files(self):
+        for fn in sorted(os.listdir(self.SPHERE_DATA)):
+            if not fn.endswith(".csv"):
+                continue
+            with open(os.path.join(self.SPHERE_DATA, fn), "r", 
+                      encoding="utf-8") as f:
+                text = f.read()
+            for strict in (False, True):
+                expected = self.tokenize(reference_row_generator, text, 
+                                         strict)
+                for block_size in (1, 2, 7, 64, None):
+                    self.assertEqual(self.tokenize(self.row_generator, text,
+                                                   strict, block_size),
+                                     expected)
+
+    def test_edge_cases(self):
+        cases = ['', '\n', 'a', 'a\n', 'a,b\nc', 'a,b\nc,', 'a,b\nc,d',
+                 '""', '"",\n', '"a""b",c\n', '"a\nb",c\nd,e',
+                 'ab"c,d\ne,f\n', 'a,"b"c,d\ne\n', '"x",""', 
+                 ',\n,,\n\n\n', '"unterminated,\n', 'a\r\nb,c\r\n',
+                 '""x,y\n', '"a"\n"b"', 'a,"",\n']
+        for text in cases:
+            for strict in (False, True):
+                expected = self.tokenize(reference_row_generator, text, 
+                                         strict)
+                for block_size in (1, 2, 3, None):
+                    self.assertEqual(self.tokenize(self.row_generator, text,
+                                                   strict, block_size),
+                                     expected, repr(text))
+
+    def test_random(self):
+        rng = random.Random(4180)
+        for n in range(0, 2000):
+            text = "".join(rng.choice('ab,,"""\n\n ') for 
+                           i in range(0, rng.randint(0, 40)))
+            for strict in (False, True):
+                expected = self.tokenize(reference_row_generator, text, 
+                                         strict)
+                for block_size in (1, 3, 5, 16, None):
+                    self.assertEqual(self.tokenize(self.row_generator, text,
+                                                   strict, block_size),
+                                     expected, repr(text))
+
 class Convert(unittest.TestCase):
     """
     Conversion tests for the cinema_lib.spec module.
@@ -317,6 +1952,99 @@ class Convert(unittest.TestCase):
         os.unlink(self.d_csv)
         os.unlink(self.a_json)
 
+    def test_convert_a_to_d_rows(self):
+        sh.copyfile(self.a_backup, self.a_json)
+        self.assertTrue(spec.convert_a_to_d(self.SPHERE_DATA))
+        self.assertEqual(list(d.get_iterator(self.SPHERE_DATA)),
+                         [tuple(map(str, row)) 
+                          for row in a.get_iterator(self.SPHERE_DATA)])
+        os.unlink(self.d_csv)
+
+        # ParaView writes the JSON in image/
+        os.mkdir(os.path.join(self.SPHERE_DATA, "image"))
+        os.rename(self.a_json, os.path.join(self.SPHERE_DATA, "image", 
+                                            a.SPEC_A_JSON_FILENAME))
+        self.assertTrue(spec.convert_a_to_d(self.SPHERE_DATA))
+        rows = a.get_iterator(self.SPHERE_DATA, "image/info.json")
+        self.assertEqual(list(d.get_iterator(self.SPHERE_DATA)),
+                         [next(rows)] + [tuple(map(str, row[:-1])) + 
+                                         ("image/" + row[-1],) 
+                                         for row in rows])
+        os.unlink(self.d_csv)
+
+    def test_convert_a_to_d_quoting(self):
+        db = {a.KEY_NAME_PATTERN: "{name}/{phi}.png",
+              a.KEY_ARGUMENTS: {
+                  "phi": {a.KEY_ARG_VALUES: [0, 1.5]},
+                  "name": {a.KEY_ARG_VALUES: ["a,b", "c\"d", "e"]}}}
+        with open(self.a_json, "w") as f:
+            json.dump(db, f)
+        for batch_size in (1, 4, spec.CONVERT_BATCH_SIZE):
+            self.assertTrue(spec.convert_a_to_d(self.SPHERE_DATA, 
+                                                batch_size))
+            self.assertEqual(list(d.get_iterator(self.SPHERE_DATA)),
+                             [tuple(map(str, row)) for row in 
+                              a.get_iterator(self.SPHERE_DATA)])
+            os.unlink(self.d_csv)
+
+        # a name pattern that isn't in the same order as the columns
+        db[a.KEY_NAME_PATTERN] = "{phi:.2f},{name}.png"
+        with open(self.a_json, "w") as f:
+            json.dump(db, f)
+        self.assertTrue(spec.convert_a_to_d(self.SPHERE_DATA, 4))
+        with open(self.d_csv, "r") as f:
+            self.assertEqual(f.readline(), "name,phi,FILE\n")
+            self.assertEqual(f.readline(), '"a,b",0,"0.00,a,b.png"\n')
+        os.unlink(self.d_csv)
+
+        # a failed conversion doesn't leave a CSV
+        db[a.KEY_NAME_PATTERN] = "{phi:d}.png"
+        with open(self.a_json, "w") as f:
+            json.dump(db, f)
+        self.assertFalse(spec.convert_a_to_d(self.SPHERE_DATA))
+        self.assertFalse(os.path.exists(self.d_csv))
+        os.unlink(self.a_json)
+
+    def test_convert_a_to_sqlite3(self):
+        sh.copyfile(self.a_backup, self.a_json)
+        self.assertTrue(spec.convert_a_to_d(self.SPHERE_DATA))
+        expected = d.get_sqlite3(self.SPHERE_DATA)
+        for batch_size in (1, 4, spec.CONVERT_BATCH_SIZE):
+            db = spec.convert_a_to_sqlite3(self.SPHERE_DATA, 
+                                           batch_size=batch_size)
+            self.assertTrue(db != None)
+            query = "SELECT * FROM %s" % self.SPHERE_TABLE
+            self.assertEqual(db.execute(query).fetchall(), 
+                             expected.execute(query).fetchall())
+            query = "SELECT sql FROM sqlite_master"
+            self.assertEqual(db.execute(query).fetchall(), 
+                             expected.execute(query).fetchall())
+        # written straight to SQLite, never through a CSV
+        os.unlink(self.d_csv)
+        self.assertTrue(spec.convert_a_to_sqlite3(self.SPHERE_DATA) != None)
+        self.assertFalse(os.path.exists(self.d_csv))
+        os.unlink(self.a_json)
+        self.assertIsNone(spec.convert_a_to_sqlite3(self.SPHERE_DATA))
+
+    def test_convert_a_to_npz(self):
+        try:
+            import numpy as np
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        sh.copyfile(self.a_backup, self.a_json)
+        npz = os.path.join(self.SPHERE_DATA, "columns.npz")
+        self.assertTrue(spec.convert_a_to_npz(self.SPHERE_DATA, npz))
+        with np.load(npz) as columns:
+            self.assertEqual(tuple(columns.files), ("phi", "theta", "FILE"))
+            self.assertEqual(list(zip(*[columns[k].tolist() 
+                                        for k in columns.files])),
+                             list(a.get_iterator(self.SPHERE_DATA))[1:])
+        os.unlink(npz)
+        os.unlink(self.a_json)
+        self.assertFalse(spec.convert_a_to_npz(self.SPHERE_DATA, npz))
+
     def test_sqlite3(self):
         sh.copyfile(self.d_backup, self.d_csv)
         db = d.get_sqlite3(self.SPHERE_DATA)
@@ -338,6 +2066,190 @@ class Convert(unittest.TestCase):
         self.assertTrue(fetch[0] == 9)
         os.unlink(self.d_csv)
 
+    def test_sqlite3_bulk(self):
+        with open(self.d_csv, "w") as f:
+            f.write("i,x,s,FILE\n")
+            for n in range(0, 100):
+                f.write("{0},{1},s{2},{3}/0.png\n".format(n, n * 0.5, n % 7,
+                                                        n % 20 * 18 - 180))
+            # values that don't match the column types
+            f.write("1.5,2,8,0/0.png\n")
+            f.write("x,,,0/0.png\n")
+        query = "SELECT *, typeof(i), typeof(x), typeof(s) FROM %s" % \
+                self.SPHERE_TABLE
+        expected = d.get_sqlite3(self.SPHERE_DATA, 
+                                 infer=None).execute(query).fetchall()
+
+        where = os.path.join(self.SPHERE_DATA, "sphere.sqlite")
+        for chunk_size in (7, d.SQLITE3_CHUNK_SIZE):
+            db = d.get_sqlite3(self.SPHERE_DATA, bulk=True, 
+                               chunk_size=chunk_size, infer=None)
+            self.assertEqual(db.execute(query).fetchall(), expected)
+            db = d.get_sqlite3(self.SPHERE_DATA, where=where, bulk=True, 
+                               chunk_size=chunk_size, infer=None)
+            self.assertEqual(db.execute(query).fetchall(), expected)
+            self.assertEqual(db.execute("PRAGMA synchronous").fetchone(), 
+                             (2,))
+            db.close()
+            db = sqlite3.connect(where)
+            self.assertEqual(db.execute(query).fetchall(), expected)
+            db.close()
+            # the table exists
+            self.assertIsNone(d.get_sqlite3(self.SPHERE_DATA, where=where, 
+                                            bulk=True))
+            os.unlink(where)
+        self.assertEqual(expected[0], (0, 0.0, "s0", "-180/0.png", 
+                                       "integer", "real", "text"))
+        self.assertEqual(expected[-1][:3], ("x", None, None))
+
+        # NaN is text in a real column, as a NaN float is NULL, and 
+        # infinity is a float
+        with open(self.d_csv, "a") as f:
+            f.write("1,NaN,s,0/0.png\n1,-inf,t,0/0.png\n")
+        for infer in (None, d.INFER_ALL):
+            db = d.get_sqlite3(self.SPHERE_DATA, bulk=True, infer=infer)
+            self.assertEqual(db.execute("SELECT x FROM %s WHERE s IN "
+                "('s', 't')" % self.SPHERE_TABLE).fetchall(), 
+                [("NaN",), (float("-inf"),)])
+        self.assertIsNotNone(d.get_sqlite3_to_csv(db, self.SPHERE_TABLE, 
+                                                  self.SPHERE_DATA, 
+                                                  "out.csv"))
+        out_csv = os.path.join(self.SPHERE_DATA, "out.csv")
+        with open(out_csv) as f:
+            self.assertEqual(f.read().splitlines()[-2:], 
+                             ["1,NaN,s,0/0.png", "1,-inf,t,0/0.png"])
+        os.unlink(out_csv)
+
+        # a failed load drops the table, and a new database isn't left
+        def rows():
+            yield ("1", "2", "s", "0/0.png")
+            raise ValueError("failed")
+        for where in (":memory:", os.path.join(self.SPHERE_DATA, 
+                                               "failed.sqlite")):
+            db = sqlite3.connect(where)
+            db.execute("CREATE TABLE t (a, b, c, d)")
+            with self.assertRaises(ValueError):
+                getattr(d, "__bulk_load")(db, "t", ("a", "b", "c", "d"), 
+                                          rows(), 1)
+            self.assertEqual(db.execute("SELECT count(*) FROM sqlite_master"
+                                        ).fetchone(), (0,))
+            db.close()
+        os.unlink(self.d_csv)
+
+    def test_sqlite3_infer(self):
+        with open(self.d_csv, "w") as f:
+            f.write("e,i,x,n,s,FILE\n")
+            f.write(",1,,,1,0/0.png\n")
+            for n in range(0, 50):
+                f.write(",{0},{0},{0},{0},0/0.png\n".format(n))
+            f.write(",2,1.5,nan,x,0/0.png\n")
+            f.write(",{0},,3,,0/0.png\n".format(1 << 63))
+        query = "SELECT *, typeof(i), typeof(x), typeof(n) FROM %s" % \
+                self.SPHERE_TABLE
+        db = d.get_sqlite3(self.SPHERE_DATA)
+        self.assertEqual([row[1:3] for row in db.execute(
+            "PRAGMA table_info(%s)" % self.SPHERE_TABLE)], 
+            [("e", "TEXT"), ("i", "REAL"), ("x", "REAL"), ("n", "REAL"), 
+             ("s", "TEXT"), ("FILE", "TEXT")])
+        rows = db.execute(query).fetchall()
+        self.assertEqual(rows[0], (None, 1.0, None, None, "1", "0/0.png", 
+                                   "real", "null", "null"))
+        self.assertEqual(rows[-2], (None, 2.0, 1.5, "nan", "x", "0/0.png", 
+                                    "real", "real", "text"))
+        self.assertEqual(rows[-1][1], float(1 << 63))
+        # numbers compare as numbers
+        self.assertEqual(db.execute("SELECT count(*) FROM %s WHERE x > 9" %
+                                    self.SPHERE_TABLE).fetchone(), (40,))
+        for bulk in (False, True):
+            self.assertEqual(d.get_sqlite3(self.SPHERE_DATA, bulk=bulk, 
+                chunk_size=7).execute(query).fetchall(), rows)
+
+        # floats after the first chunk of an integer column, that SQLite
+        # would store as integers, and numbers before text in a column
+        with open(self.d_csv, "w") as f:
+            f.write("i,x,s,FILE\n")
+            for n in range(0, 10):
+                f.write("{0},{0},00{0},0/0.png\n".format(n))
+            f.write("2.0,1e3,x,0/0.png\n")
+        for bulk in (False, True):
+            db = d.get_sqlite3(self.SPHERE_DATA, bulk=bulk, chunk_size=7)
+            self.assertEqual([row[2] for row in db.execute(
+                "PRAGMA table_info(%s)" % self.SPHERE_TABLE)], 
+                ["REAL", "REAL", "TEXT", "TEXT"])
+            self.assertEqual(db.execute("SELECT i, x, s, typeof(i), "
+                "typeof(x) FROM %s" % self.SPHERE_TABLE).fetchall()[-2:],
+                [(9.0, 9.0, "009", "real", "real"), 
+                 (2.0, 1000.0, "x", "real", "real")])
+        with open(self.d_csv, "w") as f:
+            f.write("e,i,x,n,s,FILE\n")
+            f.write(",1,,,1,0/0.png\n")
+            for n in range(0, 50):
+                f.write(",{0},{0},{0},{0},0/0.png\n".format(n))
+            f.write(",2,1.5,nan,x,0/0.png\n")
+            f.write(",{0},,3,,0/0.png\n".format(1 << 63))
+
+        # a sample of the first chunk and random rows finds all the rows 
+        # of a small table
+        db = d.get_sqlite3(self.SPHERE_DATA, infer=d.INFER_SAMPLE, 
+                           chunk_size=7)
+        self.assertEqual(db.execute(query).fetchall(), rows)
+
+        # the legacy first row types fail with an empty first value
+        self.assertEqual(d.get_sqlite3(self.SPHERE_DATA, infer=None), None)
+        self.assertEqual(d.get_sqlite3(self.SPHERE_DATA, infer="nope"), None)
+
+        # a header without rows is a table without rows
+        with open(self.d_csv, "w") as f:
+            f.write("a,FILE\n")
+        db = d.get_sqlite3(self.SPHERE_DATA)
+        self.assertEqual(db.execute("SELECT count(*) FROM %s" % 
+                                    self.SPHERE_TABLE).fetchone(), (0,))
+        os.unlink(self.d_csv)
+
+    def test_sqlite3_query(self):
+        sh.copyfile(self.d_backup, self.d_csv)
+        db = d.get_sqlite3(self.SPHERE_DATA, index=True)
+        # theta has a single value, so only phi is indexed
+        self.assertEqual([row[0] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")], 
+            ["sphere_phi"])
+        plan = db.execute("EXPLAIN QUERY PLAN SELECT FILE FROM sphere "
+                          "WHERE phi = ?", (0,)).fetchall()
+        self.assertTrue("sphere_phi" in str(plan))
+        self.assertEqual(d.create_sqlite3_indexes(db, "sphere", ["theta"]), 
+                         ["theta"])
+        self.assertEqual(d.create_sqlite3_indexes(db, "sphere", ["nope"]), 
+                         None)
+        self.assertEqual(d.create_sqlite3_indexes(db, "nope"), None)
+
+        self.assertEqual(d.query_sqlite3(db, "sphere", {"phi": 0}), 
+                         ["0/0.png"])
+        self.assertEqual(d.query_sqlite3(db, "sphere", 
+                                         {"theta": 0, "phi": slice(126, None)}),
+                         ["126/0.png", "144/0.png", "162/0.png"])
+        self.assertEqual(d.query_sqlite3(db, "sphere", 
+                                         {"phi": slice(-180, -162)}, "phi"),
+                         [-180, -162])
+        self.assertEqual(d.query_sqlite3(db, "sphere", {"phi": [18, -18, 1]}),
+                         ["-18/0.png", "18/0.png"])
+        self.assertEqual(len(d.query_sqlite3(db, "sphere", {})), 20)
+        self.assertEqual(d.query_sqlite3(db, "sphere", {"phi": None}), [])
+        self.assertEqual(d.query_sqlite3(db, "sphere", {"phi": [None, 0]}),
+                         d.query_sqlite3(db, "sphere", {"phi": 0}))
+        self.assertEqual(d.query_sqlite3(db, "sphere", {"phi": [None]}), [])
+        self.assertEqual(d.query_sqlite3(db, "sphere", {"nope": 0}), None)
+        self.assertEqual(d.query_sqlite3(db, "sphere", {"phi": abs}), None)
+        self.assertEqual(d.query_sqlite3(db, "sphere; DROP TABLE sphere", 
+                                         {}), None)
+
+        # table names are quoted, not interpolated
+        self.assertEqual(d.get_sqlite3_to_csv(db, "sphere; --", 
+                                              self.SPHERE_DATA), None)
+        db.execute("ALTER TABLE sphere RENAME TO \"sphere \"\"2\"\"\"")
+        self.assertEqual(len(list(d.get_sqlite3_to_csv(db, "sphere \"2\"", 
+                                  self.SPHERE_DATA))), 21)
+        os.unlink(self.d_csv)
+
     def test_sqlite3_multiple_files(self):
         sh.copyfile(self.d_backup, self.d_csv)
         db = d.get_sqlite3(self.SPHERE_DATA, "files4.csv")
@@ -403,6 +2315,39 @@ class Convert(unittest.TestCase):
 
         os.unlink(self.d_csv)
 
+    def test_sqlite3_to_csv_query(self):
+        sh.copyfile(self.d_backup, self.d_csv)
+        sqlite_db = d.get_sqlite3(self.SPHERE_DATA, index=True)
+        before = sorted(os.listdir(self.SPHERE_DATA))
+
+        # a failed query leaves the CSV as it was
+        self.assertEqual(d.get_sqlite3_to_csv(sqlite_db, None, 
+            self.SPHERE_DATA, query="SELECT nope FROM sphere"), None)
+        self.assertEqual(sorted(os.listdir(self.SPHERE_DATA)), before)
+        self.assertTrue(filecmp.cmp(self.d_csv, self.d_backup))
+
+        # the rows of a query with parameters, in batches, with the FILE 
+        # column moved to the end
+        cinema_db = d.get_sqlite3_to_csv(sqlite_db, None, self.SPHERE_DATA,
+            query="SELECT FILE, phi, theta * 2 AS twice FROM sphere "
+                  "WHERE phi >= ? ORDER BY phi DESC", parameters=(90,),
+            batch_size=2)
+        self.assertEqual(list(cinema_db), 
+            [("phi", "twice", "FILE")] + 
+            [(str(p), "0", "{0}/0.png".format(p)) 
+             for p in (162, 144, 126, 108, 90)])
+        self.assertEqual(len(os.listdir(self.SPHERE_DATA)), len(before) + 1)
+
+        # a view
+        sqlite_db.execute("CREATE VIEW cinema AS SELECT * FROM sphere "
+                          "WHERE phi < 0")
+        cinema_db = d.get_sqlite3_to_csv(sqlite_db, "cinema", 
+                                         self.SPHERE_DATA)
+        self.assertEqual(len(list(cinema_db)), 11)
+        self.assertEqual(d.get_sqlite3_to_csv(sqlite_db, "nope", 
+                                              self.SPHERE_DATA), None)
+        os.unlink(self.d_csv)
+
     def test_sqlite3_to_csv_multiple_files(self):
         sh.copyfile(self.d_backup, self.d_csv)
         sqlite_db = d.get_sqlite3(self.SPHERE_DATA, "files4.csv")
@@ -800,6 +2745,127 @@ class ImageTests(unittest.TestCase):
 
         os.unlink(self.d_csv)
 
+    def test_file_add_column_cursor(self):
+        try:
+            from .. import image
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        from ..image import d as d_image
+
+        # write the database in two parts, as a simulation would
+        with open(self.d_backup, "r") as f:
+            lines = f.readlines()
+        with open(self.d_csv, "w") as f:
+            f.writelines(lines[:8])
+
+        def compute(b, a):
+            return (len(a),)
+        cursor = d.Cursor(self.SPHERE_DATA)
+        self.assertFalse(d_image.file_add_column(self.SPHERE_DATA, 2,
+            "compute", compute, n_components=1, cursor=cursor, 
+            out_csv_path="compute.csv"))
+        self.assertEqual(cursor.n_rows, 7)
+        with open(self.d_csv, "a") as f:
+            f.writelines(lines[8:])
+        self.assertFalse(d_image.file_add_column(self.SPHERE_DATA, 2,
+            "compute", compute, n_components=1, cursor=cursor, 
+            out_csv_path="compute.csv"))
+        self.assertEqual(cursor.n_rows, 20)
+
+        self.assertTrue(d.check_database(self.SPHERE_DATA, "compute.csv"))
+        self.assertFalse(d_image.file_add_column(self.SPHERE_DATA, 2,
+            "compute", compute, n_components=1))
+        self.assertEqual(list(d.get_iterator(self.SPHERE_DATA)),
+                         list(d.get_iterator(self.SPHERE_DATA, "compute.csv")))
+
+        self.assertTrue(d_image.file_add_column(self.SPHERE_DATA, 2,
+            "compute", compute, n_components=1, cursor=cursor))
+
+    def test_probe(self):
+        try:
+            from .. import image
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        import numpy as np
+        from skimage import io
+
+        for db_path, fn in ((self.SPHERE_DATA, "0/0.png"), 
+                            (self.SPHERE_DATA, "0/0_cv_grey.png"),
+                            (TEST_PATH, "example2.cdb/img/001.jpg")):
+            shape, dtype, channels = image.file_probe(db_path, fn)
+            im = io.imread(os.path.join(db_path, fn))
+            self.assertEqual(shape, im.shape)
+            self.assertEqual(dtype, im.dtype)
+            self.assertEqual(channels, 1 if len(im.shape) == 2 else 
+                             im.shape[2])
+
+        # tiff headers, (order, width, length, bits, samples, format)
+        import struct
+        for order, w, h, bits, samples, kind, dtype in (
+                ("<", 5, 4, (16,), 1, 1, np.uint16),
+                (">", 5, 4, (8, 8, 8), 3, 1, np.uint8),
+                ("<", 5, 4, (32,), 1, 3, np.float32)):
+            tags = [(256, 4, (w,)), (257, 4, (h,)), 
+                    (258, 3, bits), (277, 3, (samples,)), (339, 3, (kind,))]
+            ifd = struct.pack(order + "H", len(tags))
+            extra = b""
+            for tag, t, values in tags:
+                value_format = order + ("I" if t == 4 else "H") * len(values)
+                data = struct.pack(value_format, *values)
+                if len(data) > 4:
+                    offset = 8 + 2 + 12 * len(tags) + 4 + len(extra)
+                    extra = extra + data
+                    data = struct.pack(order + "I", offset)
+                ifd = ifd + struct.pack(order + "HHI", tag, t, 
+                    len(values)) + data.ljust(4, b"\0")
+            with open(os.path.join(self.SPHERE_DATA, "probe.tif"), 
+                      "wb") as f:
+                f.write((b"II" if order == "<" else b"MM") + 
+                        struct.pack(order + "HI", 42, 8) + ifd + 
+                        b"\0\0\0\0" + extra)
+            shape = (h, w) if samples == 1 else (h, w, samples)
+            self.assertEqual(image.file_probe(self.SPHERE_DATA, "probe.tif"),
+                             (shape, np.dtype(dtype), samples))
+
+        with open(os.path.join(self.SPHERE_DATA, "probe.png"), "wb") as f:
+            f.write(d.PNG_SIGNATURE + b"\0\0")
+        with self.assertRaises(ValueError):
+            image.file_probe(self.SPHERE_DATA, "probe.png")
+        with self.assertRaises(ValueError):
+            image.file_probe(self.SPHERE_DATA, a.SPEC_A_JSON_FILENAME)
+
+    def test_file_add_shape_columns(self):
+        try:
+            from .. import image
+        except Exception as e:
+            log.info("Unable to run test: " + str(e))
+            return
+
+        from ..image import d as d_image
+
+        sh.copyfile(self.d_backup, self.d_csv)
+        sh.copyfile(os.path.join(self.SPHERE_DATA, "0", "0_cv_grey.png"),
+                    os.path.join(self.SPHERE_DATA, "0", "0.png"))
+        with open(os.path.join(self.SPHERE_DATA, "18", "0.png"), "wb") as f:
+            f.write(b"foo")
+
+        self.assertFalse(d_image.file_add_shape_columns(self.SPHERE_DATA, 2))
+        d_db = d.get_iterator(self.SPHERE_DATA)
+        self.assertEqual(next(d_db), ("theta", "phi", "image width", 
+            "image height", "image channels", "FILE"))
+        for row in d_db:
+            if row[5] == "0/0.png":
+                self.assertEqual(row[2:5], ("519", "422", "1"))
+            elif row[5] == "18/0.png":
+                self.assertEqual(row[2:5], (None, None, None))
+            else:
+                self.assertEqual(row[2:5], ("519", "422", "3"))
+        self.assertTrue(d.check_database(self.SPHERE_DATA))
+
     def test_grey(self):
         try:
             from .. import image
@@ -2054,6 +4120,112 @@ class CommandLineTests(unittest.TestCase):
         # swap back
         sys.argv = old_argv
 
+    def test_spec_d_workers(self):
+        from .. import cl
+        import sys
+
+        # set arguments
+        arguments = [self.PYTHON_COMMAND, '-t', '-w', '4', '--verify', 
+                     'size', '--list-workers', '2', '-d', self.SPHERE_DATA]
+        old_argv = sys.argv
+        sys.argv = arguments 
+        exit_value = -1
+        # run command line
+        try:
+            cl.main()
+        except SystemExit as e:
+            exit_value = e
+        # assert we exited
+        self.assertTrue(int(str(exit_value)) == 0)
+        # swap back
+        sys.argv = old_argv
+
+    def test_spec_a_workers(self):
+        from .. import cl
+        import sys
+
+        # set arguments, where -w only applies to Spec D
+        arguments = [self.PYTHON_COMMAND, '-t', '-w', '4', '--verify', 
+                     'size', '--list-workers', '2', '-a', self.SPHERE_DATA]
+        old_argv = sys.argv
+        sys.argv = arguments 
+        exit_value = -1
+        # run command line
+        try:
+            with self.assertLogs(level="WARNING") as logs:
+                cl.main()
+        except SystemExit as e:
+            exit_value = e
+        # assert we exited
+        self.assertTrue(int(str(exit_value)) == 0)
+        self.assertTrue(any("ignoring --workers" in m for m in logs.output))
+        # swap back
+        sys.argv = old_argv
+
+    def test_spec_a_to_sqlite(self):
+        from .. import cl
+        import sys
+
+        # set arguments, writing sphere.sqlite in a temporary directory
+        arguments = [self.PYTHON_COMMAND, '--a2s', '-a', 
+                     os.path.abspath(self.SPHERE_DATA)]
+        old_argv = sys.argv
+        old_cwd = os.getcwd()
+        path = temp.mkdtemp()
+        os.chdir(path)
+        sys.argv = arguments 
+        exit_value = -1
+        # run command line
+        try:
+            cl.main()
+        except SystemExit as e:
+            exit_value = e
+        finally:
+            # swap back
+            sys.argv = old_argv
+            os.chdir(old_cwd)
+        # assert we exited
+        self.assertTrue(int(str(exit_value)) == 0)
+        db = sqlite3.connect(os.path.join(path, "sphere.sqlite"))
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM sphere").fetchone(),
+                         (20,))
+        db.close()
+        sh.rmtree(path)
+
+    def test_spec_d_to_sqlite_query(self):
+        from .. import cl
+        import sys
+
+        # write sphere.sqlite in a temporary directory, with indexes, and 
+        # convert a query from it into a copy of the database
+        path = temp.mkdtemp()
+        data = os.path.join(path, "sphere.cdb")
+        sh.copytree(self.SPHERE_DATA, data)
+        old_argv = sys.argv
+        old_cwd = os.getcwd()
+        os.chdir(path)
+        exit_values = []
+        try:
+            for arguments in ([self.PYTHON_COMMAND, '--d2s', '-d', data],
+                              [self.PYTHON_COMMAND, '--s2d', 'sphere.sqlite',
+                               '-d', data],
+                              [self.PYTHON_COMMAND, '--s2d', 'sphere.sqlite',
+                               '--query', 'SELECT * FROM sphere WHERE phi = 0',
+                               '-d', data]):
+                sys.argv = arguments
+                try:
+                    cl.main()
+                except SystemExit as e:
+                    exit_values.append(int(str(e)))
+        finally:
+            # swap back
+            sys.argv = old_argv
+            os.chdir(old_cwd)
+        self.assertEqual(exit_values, [0, 0, 0])
+        self.assertEqual(list(d.get_iterator(data)), 
+                         [("theta", "phi", "FILE"), ("0", "0", "0/0.png")])
+        sh.rmtree(path)
+
     def test_spec_a_verbose(self):
         from .. import cl
         import sys
@@ -0,0 +1,703 @@
+"""
+Benchmarks for cinema_lib. Execute with "python -m cinema_lib.test.benchmark".
+
+These are not run as part of the unit tests. Each benchmark generates a
+synthetic database in a temporary directory, and reports the throughput
+of the functions being measured.
+"""
+
+from ..spec import d
+from ..spec import a
+from .. import spec
+from .. import server
+from . import reference_row_generator
+
+import os
+import json
+import time
+import tempfile as temp
+import shutil as sh
+import argparse
+import csv
+import random
+import threading
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, product
+
+def write_synthetic_csv(fn, n_rows, n_columns, quoted=False, n_files=None):
+    """
+    Write a synthetic Spec D CSV file, with integer, float and string
+    parameter columns and a final FILE column.
+
+    arguments:
+        fn : string
+            POSIX path of the CSV file to write
+        n_rows : integer
+            number of data rows
+        n_columns : integer >= 2
+            number of columns, including the FILE column
+        quoted : boolean = False
+            if True, the string columns are quoted and contain commas
+        n_files : integer = None
+            if not None, the FILE column cycles through this many file
+            names, otherwise every row has a different file name
+
+    returns:
+        the number of bytes written
+
+    side effects:
+        writes out a CSV file at *fn*
+    """
+
+    header = ["p{0}".format(i) for i in range(0, n_columns - 1)] + \
+             [d.FILE_HEADER_KEYWORD]
+    with open(fn, "w", encoding="utf-8") as f:
+        f.write(",".join(header) + "\n")
+        lines = []
+        for r in range(0, n_rows):
+            row = []
+            for c in range(0, n_columns - 1):
+                if c % 3 == 0:
+                    row.append(str(r + c))
+                elif c % 3 == 1:
+                    row.append(str((r + c) * 0.25))
+                elif quoted:
+                    row.append('"s,{0}"'.format(r % 97))
+                else:
+                    row.append("s{0}".format(r % 97))
+            row.append("image/{0}.png".format(
+                r if n_files is None else r % n_files))
+            lines.append(",".join(row))
+            if len(lines) == 10000:
+                f.write("\n".join(lines) + "\n")
+                lines = []
+        if len(lines) > 0:
+            f.write("\n".join(lines) + "\n")
+    return os.path.getsize(fn)
+
+def write_synthetic_json(fn, n_rows, n_columns):
+    """
+    Write a synthetic Spec A JSON file, with integer, float and string 
+    arguments, whose parameter space has at least *n_rows* rows. The 
+    first argument has as many values as needed, the others have 10.
+
+    arguments:
+        fn : string
+            POSIX path of the JSON file to write
+        n_rows : integer
+            minimum number of rows
+        n_columns : integer >= 2
+            number of columns, including the FILE column
+
+    returns:
+        the number of rows
+
+    side effects:
+        writes out a JSON file at *fn*
+    """
+
+    n_arguments = max(1, min(n_columns - 1, 
+                             len(str(max(n_rows - 1, 1)))))
+    n_first = -(-n_rows // 10 ** (n_arguments - 1))
+    arguments = {}
+    for c in range(0, n_arguments):
+        n_values = n_first if c == 0 else 10
+        if c % 3 == 0:
+            values = list(range(0, n_values))
+        elif c % 3 == 1:
+            values = [v * 0.25 for v in range(0, n_values)]
+        else:
+            values = ["s{0}".format(v) for v in range(0, n_values)]
+        arguments["p{0}".format(c)] = {"default": values[0], 
+                                       "label": "p{0}".format(c),
+                                       "type": "range", "values": values}
+    pattern = "/".join(["{{p{0}}}".format(c) 
+                        for c in range(0, n_arguments)]) + ".png"
+    with open(fn, "w") as f:
+        json.dump({"type": "simple", "version": "1.1",
+                   "metadata": {"type": "parametric-image-stack"},
+                   "name_pattern": pattern, "arguments": arguments}, f)
+    return n_first * 10 ** (n_arguments - 1)
+
+def timed(function, *args, **kwargs):
+    """
+    Time a function call.
+
+    returns:
+        tuple of (elapsed seconds, return value of function)
+    """
+
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    return (time.perf_counter() - start, value)
+
+def report(name, n_rows, seconds, n_bytes=None):
+    line = "{0:<40} {1:>10} rows {2:>9.3f} s {3:>12.0f} rows/s".format(
+        name, n_rows, seconds, n_rows / seconds if seconds > 0 else 0)
+    if n_bytes is not None and seconds > 0:
+        line = line + " {0:>8.1f} MB/s".format(n_bytes / seconds / 1e6)
+    print(line)
+
+def bench_tokenizer(path, n_rows, n_columns):
+    """
+    Compare rows/sec of the block-buffered tokenizer against the original
+    character-at-a-time tokenizer.
+    """
+
+    row_generator = getattr(d, "__row_generator")
+    def count(generator, fn):
+        with open(fn, "r", encoding="utf-8") as f:
+            return sum(1 for row in generator(f, True))
+
+    for quoted in (False, True):
+        fn = os.path.join(path, "tokenizer.csv")
+        n_bytes = write_synthetic_csv(fn, n_rows, n_columns, quoted)
+        label = "quoted" if quoted else "unquoted"
+        t, rows = timed(count, reference_row_generator, fn)
+        report("tokenizer reference ({0})".format(label), rows, t, n_bytes)
+        t, rows = timed(count, row_generator, fn)
+        report("tokenizer block ({0})".format(label), rows, t, n_bytes)
+        os.unlink(fn)
+
+def bench_parallel(path, n_rows, n_columns):
+    """
+    Compare rows/sec of get_iterator and check_database with one worker
+    and with a worker per CPU.
+    """
+
+    n_files = 100
+    os.mkdir(os.path.join(path, "image"))
+    for i in range(0, n_files):
+        open(os.path.join(path, "image", "{0}.png".format(i)), "w").close()
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns, True, n_files)
+
+    def count(workers):
+        return sum(1 for row in d.get_iterator(path, workers=workers)) - 1
+
+    for workers in (1, os.cpu_count()):
+        t, rows = timed(count, workers)
+        report("get_iterator workers={0}".format(workers), rows, t, n_bytes)
+    for workers in (1, os.cpu_count()):
+        t, valid = timed(d.check_database, path, workers=workers)
+        report("check_database workers={0}".format(workers), n_rows, t, 
+               n_bytes)
+    os.unlink(fn)
+    sh.rmtree(os.path.join(path, "image"))
+
+def bench_select(path, n_rows, n_columns):
+    """
+    Compare rows/sec of get_iterator returning every row and column,
+    filtering rows in Python, and projecting and filtering in get_iterator.
+    """
+
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns)
+    where = "p0 < {0}".format(n_rows // 10)
+
+    def count_all():
+        return sum(1 for row in d.get_iterator(path)) - 1
+    def count_python():
+        rows = d.get_iterator(path)
+        next(rows)
+        return sum(1 for row in rows if int(row[0]) < n_rows // 10)
+    def count_select():
+        return sum(1 for row in d.get_iterator(path, 
+            columns=["p0", d.FILE_HEADER_KEYWORD], where=where)) - 1
+
+    t, rows = timed(count_all)
+    report("get_iterator all", n_rows, t, n_bytes)
+    t, rows = timed(count_python)
+    report("get_iterator filter in Python", n_rows, t, n_bytes)
+    t, rows = timed(count_select)
+    report("get_iterator columns and where", n_rows, t, n_bytes)
+    os.unlink(fn)
+
+def bench_cache(path, n_rows, n_columns):
+    """
+    Compare the time to read a database from the CSV and from the binary 
+    cache, with get_iterator and get_columns.
+    """
+
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns)
+
+    def count(**kwargs):
+        return sum(1 for row in d.get_iterator(path, **kwargs)) - 1
+
+    t, rows = timed(count)
+    report("get_iterator", n_rows, t, n_bytes)
+    t, rows = timed(d.get_cache, path)
+    report("get_cache (create)", n_rows, t, n_bytes)
+    t, rows = timed(count, cache=True)
+    report("get_iterator cache=True", n_rows, t, n_bytes)
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        t, columns = timed(d.get_columns, path)
+        report("get_columns", n_rows, t, n_bytes)
+        t, columns = timed(d.get_columns, path, cache=True)
+        report("get_columns cache=True", n_rows, t, n_bytes)
+    os.unlink(fn + d.CACHE_EXT)
+    os.unlink(fn)
+
+def bench_check(path, n_rows, n_columns):
+    """
+    Compare rows/sec of reading every row, checking every row one at a 
+    time, and check_database.
+    """
+
+    n_files = 100
+    os.mkdir(os.path.join(path, "image"))
+    for i in range(0, n_files):
+        open(os.path.join(path, "image", "{0}.png".format(i)), "w").close()
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns, False, n_files)
+
+    check_row = getattr(d, "__check_row")
+    def count():
+        return sum(1 for row in d.get_iterator(path, strict=True)) - 1
+    def check_rows():
+        rows = d.get_iterator(path, strict=True)
+        header = next(rows)
+        files = d.file_columns(header)
+        row = next(rows)
+        types = d.typecheck(row)
+        n = 1
+        for row in chain((row,), rows):
+            error, types, found, total = check_row(path, header, files, 
+                                                   types, row, n)
+            n = n + 1
+        return n - 1
+
+    t, rows = timed(count)
+    report("get_iterator", rows, t, n_bytes)
+    t, rows = timed(check_rows)
+    report("check a row at a time", rows, t, n_bytes)
+    t, valid = timed(d.check_database, path)
+    report("check_database", n_rows, t, n_bytes)
+    os.unlink(fn)
+    sh.rmtree(os.path.join(path, "image"))
+
+def bench_export(path, n_rows, n_columns):
+    """
+    Compare rows/sec of writing a SQLite table to a Spec D CSV one row at
+    a time, as get_sqlite3_to_csv did, with get_sqlite3_to_csv, and of 
+    writing a 10% subset of it from a query.
+    """
+
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    write_synthetic_csv(fn, n_rows, n_columns)
+    db = d.get_sqlite3(path)
+    table = os.path.splitext(os.path.split(os.path.normpath(path))[1])[0]
+    os.unlink(fn)
+
+    def row_at_a_time():
+        cursor = db.cursor()
+        names = [row[1] for row in 
+                 cursor.execute("pragma table_info(\"%s\")" % table)]
+        swizzle = list(range(0, len(names)))
+        output_row = [None] * len(names)
+        def write_row(writer, new_row):
+            for i in range(0, len(swizzle)):
+                output_row[swizzle[i]] = new_row[i]
+            writer.writerow(output_row)
+        with open(fn, "w") as out:
+            writer = csv.writer(out)
+            write_row(writer, names)
+            for row in cursor.execute("select * from \"%s\"" % table):
+                write_row(writer, row)
+
+    t, value = timed(row_at_a_time)
+    report("writerow per row", n_rows, t, os.path.getsize(fn))
+    os.unlink(fn)
+    t, value = timed(d.get_sqlite3_to_csv, db, table, path)
+    report("get_sqlite3_to_csv", n_rows, t, os.path.getsize(fn))
+    os.unlink(fn)
+    t, value = timed(d.get_sqlite3_to_csv, db, None, path, 
+                     query="SELECT * FROM \"{0}\" WHERE p0 % 10 = 0".format(
+                         table))
+    report("get_sqlite3_to_csv query", n_rows, t, os.path.getsize(fn))
+    db.close()
+    os.unlink(fn)
+
+def bench_files(path, n_rows, n_columns):
+    """
+    Compare rows/sec of check_database with a stat call per file, with
+    directory listings, and with a stat call per file in a pool of 
+    threads (verifying that the files aren't empty).
+    """
+
+    n_directories = 100
+    image = os.path.join(path, "image")
+    os.mkdir(image)
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    with open(fn, "w") as f:
+        f.write("p0,FILE\n")
+        for i in range(0, n_rows):
+            name = os.path.join("image", str(i % n_directories), 
+                                "{0}.png".format(i))
+            if i < n_directories:
+                os.mkdir(os.path.join(path, os.path.dirname(name)))
+            with open(os.path.join(path, name), "w") as image_file:
+                image_file.write("x")
+            f.write("{0},{1}\n".format(i, name))
+    n_bytes = os.path.getsize(fn)
+
+    check_row = getattr(d, "__check_row")
+    def check_rows():
+        rows = d.get_iterator(path, strict=True)
+        header = next(rows)
+        types = None
+        for n, row in enumerate(rows):
+            types = d.typecheck(row) if types is None else types
+            check_row(path, header, [1], types, row, n + 1)
+
+    t, value = timed(check_rows)
+    report("stat per file", n_rows, t, n_bytes)
+    t, value = timed(d.check_database, path)
+    report("check_database", n_rows, t, n_bytes)
+    for workers in (1, 16, 64):
+        t, value = timed(d.check_database, path, workers=workers, 
+                         verify=d.VERIFY_SIZE)
+        report("check_database verify workers={0}".format(workers), 
+               n_rows, t, n_bytes)
+    os.unlink(fn)
+    sh.rmtree(image)
+
+def bench_incremental(path, n_rows, n_columns):
+    """
+    Compare the time to check a database that is appended to in 10
+    steps, checking all of the rows and incrementally.
+    """
+
+    n_files = 100
+    os.mkdir(os.path.join(path, "image"))
+    for i in range(0, n_files):
+        open(os.path.join(path, "image", "{0}.png".format(i)), "w").close()
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns, False, n_files)
+    with open(fn, "rb") as f:
+        lines = f.readlines()
+    step = (len(lines) - 1) // 10
+
+    for incremental in (False, True):
+        with open(fn, "wb") as f:
+            f.write(lines[0])
+        total = 0
+        for i in range(1, len(lines), step):
+            with open(fn, "ab") as f:
+                f.writelines(lines[i:i + step])
+            t, valid = timed(d.check_database, path, 
+                             incremental=incremental)
+            total = total + t
+        report("check_database incremental={0}".format(incremental), 
+               n_rows, total, n_bytes)
+        if os.path.exists(fn + d.CHECKPOINT_EXT):
+            os.unlink(fn + d.CHECKPOINT_EXT)
+    os.unlink(fn)
+    sh.rmtree(os.path.join(path, "image"))
+
+def bench_sample(path, n_rows, n_columns):
+    """
+    Compare the time of check_database checking all of the rows, and a
+    1% sample of them, with and without a row index.
+    """
+
+    n_files = 100
+    os.mkdir(os.path.join(path, "image"))
+    for i in range(0, n_files):
+        open(os.path.join(path, "image", "{0}.png".format(i)), "w").close()
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns, False, n_files)
+
+    t, valid = timed(d.check_database, path)
+    report("check_database", n_rows, t, n_bytes)
+    t, valid = timed(d.check_database, path, sample=0.01)
+    report("check_database sample=0.01", n_rows, t, n_bytes)
+    d.get_row_index(path)
+    t, valid = timed(d.check_database, path, sample=0.01)
+    report("check_database sample=0.01 indexed", n_rows, t, n_bytes)
+    os.unlink(fn + d.INDEX_EXT)
+    os.unlink(fn)
+    sh.rmtree(os.path.join(path, "image"))
+
+def bench_probe(path, n_rows, n_columns):
+    """
+    Compare images/sec of reading the shape of the images by decoding them
+    with Scikit-image io.imread and by reading their headers with 
+    image.file_probe, and of adding width, height and channels columns.
+    """
+
+    from .. import image
+    from ..image import d as d_image
+    from skimage import io
+
+    source = os.path.join(os.path.dirname(__file__), "data", "sphere.cdb",
+                          "0", "0.png")
+    os.mkdir(os.path.join(path, "image"))
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    with open(fn, "w") as f:
+        f.write("p0,FILE\n")
+        for i in range(0, n_rows):
+            name = os.path.join("image", "{0}.png".format(i))
+            os.link(source, os.path.join(path, name))
+            f.write("{0},{1}\n".format(i, name))
+    n_bytes = os.path.getsize(fn)
+    names = [row[1] for row in d.get_iterator(path)][1:]
+
+    n_decode = min(n_rows, 1000)
+    t, value = timed(lambda: [io.imread(os.path.join(path, name)).shape 
+                              for name in names[:n_decode]])
+    report("imread ({0} images)".format(n_decode), n_decode, t)
+    t, value = timed(lambda: [image.file_probe(path, name)[0] 
+                              for name in names])
+    report("file_probe", n_rows, t)
+    t, value = timed(d_image.file_add_shape_columns, path, 1)
+    report("file_add_shape_columns", n_rows, t, n_bytes)
+    sh.rmtree(os.path.join(path, "image"))
+    for name in os.listdir(path):
+        os.unlink(os.path.join(path, name))
+
+def bench_expand(path, n_rows, n_columns):
+    """
+    Compare rows/sec of expanding a Spec A database by formatting the name
+    pattern with keyword arguments per row, with the compiled name pattern
+    (get_filenames), into NumPy arrays (get_columns), and of converting it
+    to Spec D.
+    """
+
+    fn = os.path.join(path, a.SPEC_A_JSON_FILENAME)
+    n_rows = write_synthetic_json(fn, n_rows, n_columns)
+    db = a.get_dictionary(path)
+    keys = tuple(sorted(db[a.KEY_ARGUMENTS].keys()))
+
+    def kwargs_filenames():
+        for row in product(*[db[a.KEY_ARGUMENTS][k][a.KEY_ARG_VALUES]
+                             for k in keys]):
+            kv = {k: v for k, v in zip(keys, row)}
+            yield db[a.KEY_NAME_PATTERN].format(**kv)
+
+    t, value = timed(lambda: sum(1 for f in kwargs_filenames()))
+    report("format(**kwargs)", n_rows, t)
+    t, value = timed(lambda: sum(1 for f in a.get_filenames(path)))
+    report("get_filenames", n_rows, t)
+    try:
+        t, value = timed(a.get_columns, path)
+        report("get_columns", n_rows, t)
+    except ImportError as e:
+        print("get_columns unavailable: {0}".format(e))
+    t, value = timed(spec.convert_a_to_d, path)
+    csv_fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    report("convert_a_to_d", n_rows, t, os.path.getsize(csv_fn))
+    os.unlink(csv_fn)
+    os.unlink(fn)
+
+def bench_a2d(path, n_rows, n_columns):
+    """
+    Compare rows/sec of converting a Spec A database to a Spec D CSV by
+    concatenating and writing each line, with convert_a_to_d, and of 
+    converting it directly to SQLite and to a NumPy .npz file.
+    """
+
+    fn = os.path.join(path, a.SPEC_A_JSON_FILENAME)
+    n_rows = write_synthetic_json(fn, n_rows, n_columns)
+    csv_fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+
+    def concatenate():
+        with open(csv_fn, "w") as f:
+            for row in a.get_iterator(path):
+                line = ""
+                for col in row[:-1]:
+                    line = line + str(col) + ","
+                f.write(line + str(row[-1]) + "\n")
+
+    t, value = timed(concatenate)
+    n_bytes = os.path.getsize(csv_fn)
+    report("concatenated lines", n_rows, t, n_bytes)
+    os.unlink(csv_fn)
+    t, value = timed(spec.convert_a_to_d, path)
+    report("convert_a_to_d", n_rows, t, os.path.getsize(csv_fn))
+    os.unlink(csv_fn)
+    where = os.path.join(path, "a.sqlite")
+    t, value = timed(spec.convert_a_to_sqlite3, path, where)
+    value.close()
+    report("convert_a_to_sqlite3", n_rows, t, os.path.getsize(where))
+    os.unlink(where)
+    where = os.path.join(path, "a.npz")
+    try:
+        t, value = timed(spec.convert_a_to_npz, path, where)
+        report("convert_a_to_npz", n_rows, t, os.path.getsize(where))
+        os.unlink(where)
+    except ImportError as e:
+        print("convert_a_to_npz unavailable: {0}".format(e))
+    os.unlink(fn)
+
+def bench_sqlite(path, n_rows, n_columns):
+    """
+    Compare rows/sec of get_sqlite3 with one executemany and the default
+    pragmas, and in bulk mode, in memory and on disk, and with the types
+    of the first row, a sample of rows, and all of the rows.
+    """
+
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns)
+    for infer in (None, d.INFER_SAMPLE, d.INFER_ALL):
+        t, db = timed(d.get_sqlite3, path, infer=infer)
+        db.close()
+        report("get_sqlite3 memory infer={0}".format(infer), n_rows, t, 
+               n_bytes)
+    where = os.path.join(path, "d.sqlite")
+    for bulk in (False, True):
+        t, db = timed(d.get_sqlite3, path, bulk=bulk)
+        db.close()
+        report("get_sqlite3 memory bulk={0}".format(bulk), n_rows, t, 
+               n_bytes)
+        t, db = timed(d.get_sqlite3, path, where=where, bulk=bulk)
+        db.close()
+        report("get_sqlite3 disk bulk={0}".format(bulk), n_rows, t, n_bytes)
+        os.unlink(where)
+    os.unlink(fn)
+
+def bench_query(path, n_rows, n_columns):
+    """
+    Compare queries/sec of query_sqlite3 selecting the FILE of a row by a
+    parameter, with a full table scan and with the parameter indexes.
+    """
+
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    write_synthetic_csv(fn, n_rows, n_columns)
+    db = d.get_sqlite3(path)
+    table = os.path.splitext(os.path.split(os.path.normpath(path))[1])[0]
+    n_queries = 100
+    rng = random.Random(0)
+    keys = [rng.randrange(0, n_rows) for i in range(0, n_queries)]
+    for index in (False, True):
+        if index:
+            t, columns = timed(d.create_sqlite3_indexes, db, table)
+            report("create_sqlite3_indexes {0} columns".format(len(columns)), 
+                   n_rows, t)
+        start = time.perf_counter()
+        for k in keys:
+            d.query_sqlite3(db, table, {"p0": k, "p1": slice(0, None)})
+        report("query_sqlite3 index={0}".format(index), n_queries, 
+               time.perf_counter() - start)
+    db.close()
+    os.unlink(fn)
+
+def bench_sidecar(path, n_rows, n_columns):
+    """
+    Compare the time of loading a database into SQLite3 in memory on every
+    call, and from the sidecar, when it is unchanged and when 100 rows 
+    are appended to it.
+    """
+
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns)
+    with open(fn, "rb") as f:
+        f.readline()
+        lines = [f.readline() for i in range(0, 100)]
+
+    t, db = timed(d.get_sqlite3, path)
+    db.close()
+    report("get_sqlite3 memory", n_rows, t, n_bytes)
+    t, db = timed(d.get_sqlite3_sidecar, path)
+    db.close()
+    report("get_sqlite3_sidecar build", n_rows, t, n_bytes)
+    t, db = timed(d.get_sqlite3_sidecar, path)
+    db.close()
+    report("get_sqlite3_sidecar unchanged", n_rows, t, n_bytes)
+    with open(fn, "ab") as f:
+        f.writelines(lines)
+    t, db = timed(d.get_sqlite3_sidecar, path)
+    db.close()
+    report("get_sqlite3_sidecar append 100", n_rows, t, n_bytes)
+    os.unlink(fn + d.SQLITE3_EXT)
+    os.unlink(fn)
+
+def bench_server(path, n_rows, n_columns):
+    """
+    Compare the queries/sec of selecting the FILE of a row by a parameter
+    through the query server, with 1 and 8 concurrent clients, to loading
+    the database into SQLite3 for a query, as a process without the server
+    would.
+    """
+
+    fn = os.path.join(path, d.SPEC_D_CSV_FILENAME)
+    n_bytes = write_synthetic_csv(fn, n_rows, n_columns)
+    t, db = timed(d.get_sqlite3, path)
+    db.close()
+    report("get_sqlite3 per query", 1, t, n_bytes)
+
+    t, query_server = timed(server.make_server, path)
+    report("make_server", n_rows, t, n_bytes)
+    thread = threading.Thread(target=query_server.serve_forever)
+    thread.start()
+    url = "http://{0}:{1}/files?p0={{0}}".format(
+        *query_server.server_address)
+    def get(k):
+        with urlopen(url.format(k)) as response:
+            return response.read()
+    n_queries = 1000
+    rng = random.Random(0)
+    keys = [rng.randrange(0, n_rows) for i in range(0, n_queries)]
+    try:
+        for clients in (1, 8):
+            with ThreadPoolExecutor(clients) as pool:
+                t, results = timed(lambda: list(pool.map(get, keys)))
+            report("server {0} clients".format(clients), n_queries, t)
+        stats = query_server.stats.stats()
+        print("{0:<40} {1:>10.3f} ms median, {2:.3f} ms p99".format(
+            "server latency", stats["median_ms"], stats["p99_ms"]))
+    finally:
+        query_server.shutdown()
+        query_server.server_close()
+        query_server.pool.close()
+        thread.join()
+    os.unlink(fn)
+
+BENCHMARKS = {
+    "a2d": bench_a2d,
+    "cache": bench_cache,
+    "check": bench_check,
+    "expand": bench_expand,
+    "export": bench_export,
+    "files": bench_files,
+    "incremental": bench_incremental,
+    "parallel": bench_parallel,
+    "probe": bench_probe,
+    "query": bench_query,
+    "sample": bench_sample,
+    "select": bench_select,
+    "server": bench_server,
+    "sidecar": bench_sidecar,
+    "sqlite": bench_sqlite,
+    "tokenizer": bench_tokenizer
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run cinema_lib benchmarks.")
+    parser.add_argument("benchmarks", metavar="NAME", nargs="*",
+        help="benchmarks to run (default all): {0}".format(
+            ", ".join(sorted(BENCHMARKS.keys()))))
+    parser.add_argument("-r", "--rows", type=int, default=100000,
+        help="number of rows in the synthetic database")
+    parser.add_argument("-c", "--columns", type=int, default=10,
+        help="number of columns in the synthetic database")
+    args = parser.parse_args()
+
+    names = args.benchmarks if len(args.benchmarks) > 0 else \
+            sorted(BENCHMARKS.keys())
+    path = temp.mkdtemp()
+    try:
+        for name in names:
+            BENCHMARKS[name](path, args.rows, args.columns)
+    finally:
+        sh.rmtree(path)
+
+if __name__ == "__main__":
+    main()